@@ -0,0 +1,270 @@
+"""
+Benchmarks tokenizer, graph build and ranking hot paths on a synthetic
+Zipf-distributed corpus across vocab sizes and neighbor counts. Records
+throughput, latency percentiles and peak RSS of each stage as json and
+optionally compares results against a stored baseline run.
+Run from repo root as:
+    python benchmarks/bench.py --vocab 1000 10000 --neighbors 5 20 \
+                               --out bench.json --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import numpy as np
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structs.tokenizer import Tokenizer
+from structs.tokengraph import TokenGraph
+from structs.neighborGraph import top_n_csr
+
+# version of benchmark result format
+FORMAT_VERSION = 1
+# metrics compared against baseline and whether higher values are better
+COMPARED_METRICS = {'throughput' : True, 'p50' : False, 'p99' : False}
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+# corpus generation
+def synthetic_words(vocabSize):
+    """ Returns list of vocabSize distinct alphabetic words of equal length """
+    width = max(3, int(np.ceil(np.log(vocabSize) / np.log(len(LETTERS)))))
+    digits = (np.arange(vocabSize)[:, None]
+              // (len(LETTERS) ** np.arange(width)[::-1])) % len(LETTERS)
+    letters = np.array(list(LETTERS))[digits]
+    return [''.join(row) for row in letters]
+
+
+def zipf_corpus(vocabSize, textNum, minLength=50, maxLength=300,
+                exponent=1.1, seed=0):
+    """
+    Generates textNum texts of minLength to maxLength words drawn from vocab
+    of vocabSize synthetic words with Zipf distributed frequencies
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array(synthetic_words(vocabSize), dtype=object)
+    cumProbs = np.cumsum(1.0 / np.arange(1, vocabSize + 1) ** exponent)
+    cumProbs /= cumProbs[-1]
+    lengths = rng.integers(minLength, maxLength + 1, size=textNum)
+    wordIds = np.searchsorted(cumProbs, rng.random(lengths.sum()))
+    # scatter word ids into texts by their lengths
+    bounds = np.concatenate(([0], np.cumsum(lengths)))
+    return [' '.join(words[wordIds[start:end]])
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+# measurement helpers
+def peak_rss_mb():
+    """ Returns peak resident set size of current process in MB """
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return peakRss / (2 ** 20 if (sys.platform == 'darwin') else 2 ** 10)
+
+
+def summarize(latencies, items=None):
+    """
+    Returns dict of throughput in items per second and latency percentiles
+    in ms from list of per-call latencies in seconds. items defaults to one
+    item per call.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    items = len(latencies) if (items is None) else items
+    totalTime = latencies.sum()
+    return {'calls'         :   len(latencies),
+            'items'         :   items,
+            'seconds'       :   round(float(totalTime), 6),
+            'throughput'    :   round(items / totalTime, 3) if totalTime
+                                else None,
+            'mean'          :   round(float(latencies.mean()) * 1e3, 6),
+            'p50'           :   round(float(np.percentile(latencies, 50))
+                                      * 1e3, 6),
+            'p90'           :   round(float(np.percentile(latencies, 90))
+                                      * 1e3, 6),
+            'p99'           :   round(float(np.percentile(latencies, 99))
+                                      * 1e3, 6)}
+
+
+def time_calls(func, inputs):
+    """ Calls func on each input and returns list of latencies in seconds """
+    latencies = []
+    for x in inputs:
+        start = time.perf_counter()
+        func(x)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def time_repeated(func, repeat):
+    """ Returns latency list of repeat calls to func taking no args """
+    return time_calls(lambda _ : func(), range(repeat))
+
+
+# benchmark cases
+def build_tokenizer(texts, vocabSize):
+    """ Builds initialized tokenizer of at most vocabSize tokens from texts """
+    tokenizer = Tokenizer()
+    tokenizer.freq_dict_from_file_iterator(lambda : iter(texts))
+    tokenizer.filter_freq_dict(-np.inf, np.inf, vocabSize)
+    tokenizer.build_tokenizer()
+    tokenizer.build_idx()
+    tokenizer.build_reverse_idx()
+    tokenizer.initialized = True
+    return tokenizer
+
+
+def run_case(vocabSize, neighbors, textNum, queryNum, rankIter, delta,
+             repeat, seed):
+    """
+    Runs all stages for a single vocab size and returns dict of stage
+    results. Neighbor-dependent stages are keyed by neighbor count and
+    whole-corpus stages are repeated repeat times.
+    """
+    texts = zipf_corpus(vocabSize, textNum, seed=seed)
+    queries = texts[:queryNum]
+    wordNum = sum(len(text.split()) for text in texts)
+    results = {'vocabSize' : vocabSize, 'texts' : textNum, 'words' : wordNum}
+
+    tokenizer = None
+    def build():
+        nonlocal tokenizer
+        tokenizer = build_tokenizer(texts, vocabSize)
+    results['build_tokenizer'] = summarize(time_repeated(build, repeat),
+                                         textNum * repeat)
+    results['tokens'] = tokenizer.vocabSize
+    results['clean'] = summarize(time_calls(tokenizer.clean, queries))
+    results['score_tokens'] = summarize(
+                    time_calls(tokenizer.single_mechanically_score_tokens,
+                               queries))
+
+    graphObj = TokenGraph(tokenizer)
+    for n in neighbors:
+        nResults = {}
+        nResults['build_corr_matrix'] = summarize(
+                time_repeated(lambda : graphObj.build_corr_matrix_from_iterator(
+                                                lambda : iter(texts), n),
+                              repeat),
+                textNum * repeat)
+        # top n row kernel replacing per-row norm_sort_and_filter_row
+        counts = graphObj.corrCounts
+        nResults['top_n_csr'] = summarize(
+                time_repeated(lambda : top_n_csr(counts.indptr,
+                                                 counts.indices,
+                                                 counts.scores, n),
+                              repeat),
+                len(counts) * repeat)
+        nResults['rank_text'] = summarize(
+                time_calls(lambda text : graphObj.DICT_graph_rank_text(
+                                                        text, rankIter, delta),
+                           queries))
+        nResults['rank_texts'] = summarize(
+                time_repeated(lambda : graphObj.DICT_graph_rank_texts(
+                                                queries, rankIter, delta),
+                              repeat),
+                len(queries) * repeat)
+        nResults['edges'] = int(len(graphObj.corrGraph.indices))
+        results[f'n={n}'] = nResults
+    results['peakRssMb'] = round(peak_rss_mb(), 3)
+    return results
+
+
+def run_isolated(args):
+    """ Runs case in fresh process so peak RSS is measured per vocab size """
+    with get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_case, args)
+
+
+# baseline comparison
+def compare(results, baseline, tolerance):
+    """
+    Prints ratio of each compared metric against baseline and returns list
+    of (case, stage, metric, ratio) regressions worse than tolerance
+    """
+    regressions = []
+
+    def compare_stages(case, current, previous):
+        for stage, metrics in current.items():
+            if not (isinstance(metrics, dict) and (stage in previous)):
+                continue
+            # recurse into stages grouped by neighbor count
+            if ('throughput' not in metrics):
+                compare_stages(f'{case}/{stage}', metrics, previous[stage])
+                continue
+            for metric, higherIsBetter in COMPARED_METRICS.items():
+                new, old = metrics.get(metric), previous[stage].get(metric)
+                if not (new and old):
+                    continue
+                # ratio above one is always an improvement
+                ratio = (new / old) if higherIsBetter else (old / new)
+                flag = ''
+                if (ratio < (1 - tolerance)):
+                    regressions.append((case, stage, metric, ratio))
+                    flag = '  REGRESSION'
+                print(f'{case:<16}{stage:<20}{metric:<12}{old:>14.4f}'\
+                      f'{new:>14.4f}{ratio:>8.3f}x{flag}')
+
+    print(f"{'case':<16}{'stage':<20}{'metric':<12}{'baseline':>14}"\
+          f"{'current':>14}{'ratio':>9}")
+    for case, current in results['cases'].items():
+        if case in baseline['cases']:
+            compare_stages(case, current, baseline['cases'][case])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark TokenGraph.')
+    parser.add_argument('--vocab', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--neighbors', type=int, nargs='+', default=[5, 20])
+    parser.add_argument('--texts', type=int, default=2000,
+                        help='Number of synthetic texts per vocab size.')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Number of texts to time latency stages on.')
+    parser.add_argument('--iter', type=int, default=3)
+    parser.add_argument('--delta', type=float, default=0.001)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs of whole-corpus stages.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='bench.json')
+    parser.add_argument('--baseline', default=None,
+                        help='Json results of earlier run to compare to.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed fractional slowdown before failing.')
+    args = parser.parse_args()
+
+    results = {'format'     :   'TokenGraphBench',
+               'version'    :   FORMAT_VERSION,
+               'created'    :   time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python'     :   platform.python_version(),
+               'numpy'      :   np.__version__,
+               'platform'   :   platform.platform(),
+               'params'     :   vars(args),
+               'cases'      :   {}}
+    for vocabSize in args.vocab:
+        print(f'Benchmarking vocab size {vocabSize}...')
+        results['cases'][f'vocab={vocabSize}'] = run_isolated(
+                (vocabSize, args.neighbors, args.texts,
+                 min(args.queries, args.texts), args.iter, args.delta,
+                 args.repeat, args.seed))
+    with open(args.out, 'w') as resultsFile:
+        json.dump(results, resultsFile, indent=2)
+    print(f'Wrote results to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline, 'r') as baselineFile:
+            baseline = json.load(baselineFile)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regressions beyond '\
+                  f'{args.tolerance:.0%} tolerance.')
+            sys.exit(1)
+    return True
+
+
+if __name__ == '__main__':
+    main()
@@ -4,26 +4,166 @@ features of pre-ranked word vectors and targets of convergence ranked word
 vectors.
 """
 
+import os
 import numpy as np
+from tqdm import tqdm
+from multiprocessing import Pool
 
-corrMatrix = np.array([[1, 0.9, 0.1], [0.2, 1, 0.1], [0.0001, 0.0001, 1]])
-textVec = np.array([0.2, 0.2, 0.6])
+from structs.tokengraph import TokenGraph
+from structs.wikiReader import WikiReader
+
+# per-process graph and ranking settings set by pool initializer
+WORKER_STATE = {}
 
-for num, col in enumerate(corrMatrix.T):
-    colSum = np.sum(col)
-    print(colSum)
-    corrMatrix[:, num] = np.divide(col, colSum)
 
 def graph_rank_test(corrMatrix, textVec, iter=400):
-    iterMatrix = np.linalg.matrix_power(corrMatrix, iter)
-    scoreVec = np.dot(iterMatrix, textVec)
-    return scoreVec
+    for _ in range(iter):
+        textVec = np.dot(corrMatrix, textVec)
+    return textVec
 
-def graph_rank_weight_vector(text, maxIter, minDelta):
+def graph_rank_weight_vector(tokenGraph, text, maxIter, minDelta,
+                             damping=0.85):
     """
     Rescores mechanical token weight vector using TokenGraph by running shadow
     token voting and graph ranking to convergence (as determined by first of
-    maxIter or minDelta). Returns rescored vector as list of tuples in form
-    (token id, token rank).
+    maxIter or minDelta). Returns tuple of rescored vector as list of tuples in
+    form (token id, token rank) sorted by rank and number of iterations taken
+    to converge.
+    """
+    _, rankedIds, rankedScores, iterations = tokenGraph.converge_rank_texts(
+                                                        [text], maxIter,
+                                                        minDelta,
+                                                        damping=damping)
+    rankOrder = np.argsort(-rankedScores, kind='stable')
+    rankedTokens = list(zip(rankedIds[rankOrder].tolist(),
+                            rankedScores[rankOrder].tolist()))
+    return rankedTokens, int(iterations[0])
+
+
+def scores_to_csr(scoreDicts):
     """
-    pass
+    Packs list of dicts mapping token id to score into CSR arrays
+    (indptr, ids, scores)
+    """
+    indptr = np.zeros(shape=(len(scoreDicts) + 1), dtype=np.int64)
+    np.cumsum([len(scoreDict) for scoreDict in scoreDicts], out=indptr[1:])
+    ids = np.fromiter((tokenId for scoreDict in scoreDicts
+                       for tokenId in scoreDict), dtype=np.int32,
+                      count=indptr[-1])
+    scores = np.fromiter((score for scoreDict in scoreDicts
+                          for score in scoreDict.values()), dtype=np.float32,
+                         count=indptr[-1])
+    return indptr, ids, scores
+
+
+def concat_csr(indptrs, ids, scores):
+    """ Concatenates CSR arrays of consecutive blocks of rows """
+    shifts = np.cumsum([0] + [indptr[-1] for indptr in indptrs])
+    indptr = np.concatenate([np.zeros(shape=1, dtype=np.int64)]
+                            + [(blockIndptr[1:] + shift) for blockIndptr, shift
+                               in zip(indptrs, shifts)])
+    return (indptr, np.concatenate([np.zeros(shape=0, dtype=np.int32)] + ids),
+            np.concatenate([np.zeros(shape=0, dtype=np.float32)] + scores))
+
+
+def rank_pairs(tokenGraph, texts, iter, delta):
+    """
+    Returns dict of CSR arrays holding mechanical token scores of each text as
+    features and its token scores ranked as in DICT_graph_rank_text as
+    targets. Each text is scored once and its observed tokens are ranked
+    directly. Texts with no known tokens are dropped.
+    """
+    scoreDicts = [tokenGraph.tokenizer.single_mechanically_score_tokens(text)
+                  for text in texts]
+    scoreDicts = [scoreDict for scoreDict in scoreDicts if scoreDict]
+    if not scoreDicts:
+        indptr, ids, scores = scores_to_csr([])
+        return {'inputIndptr' : indptr, 'inputIds' : ids,
+                'inputScores' : scores, 'targetIndptr' : indptr,
+                'targetIds' : ids, 'targetScores' : scores}
+    observedLists = [tokenGraph.top_observed(scoreDict)
+                     for scoreDict in scoreDicts]
+    offsets, rankedIds, rankedScores = tokenGraph.rank_observed(observedLists,
+                                                                iter, delta)
+    inputIndptr, inputIds, inputScores = scores_to_csr(scoreDicts)
+    return {'inputIndptr'   :   inputIndptr,
+            'inputIds'      :   inputIds,
+            'inputScores'   :   inputScores,
+            'targetIndptr'  :   np.asarray(offsets, dtype=np.int64),
+            'targetIds'     :   rankedIds.astype(np.int32),
+            'targetScores'  :   rankedScores.astype(np.float32)}
+
+
+def init_worker(graphPath, iter, delta):
+    """ Loads memory-mapped graph once into worker process """
+    graphObj = TokenGraph()
+    graphObj.load(graphPath)
+    WORKER_STATE.update({'graph' : graphObj, 'iter' : iter, 'delta' : delta})
+
+
+def pair_shard(shard):
+    """
+    Worker ranking texts of byte range of wiki file in batches and saving
+    their feature and target arrays as npz at outPath. Returns outPath.
+    """
+    path, start, end, outPath, batchSize = shard
+    batches = [rank_pairs(WORKER_STATE['graph'], texts, WORKER_STATE['iter'],
+                          WORKER_STATE['delta'])
+               for texts in WikiReader(path).iter_batches(batchSize, start,
+                                                          end)]
+    shardArrays = {}
+    for side in ['input', 'target']:
+        (shardArrays[f'{side}Indptr'], shardArrays[f'{side}Ids'],
+         shardArrays[f'{side}Scores']) = concat_csr(
+                        [batch[f'{side}Indptr'] for batch in batches],
+                        [batch[f'{side}Ids'] for batch in batches],
+                        [batch[f'{side}Scores'] for batch in batches])
+    # write through temp file so finished shards are always whole
+    tempPath = f'{outPath}.tmp'
+    with open(tempPath, 'wb') as shardFile:
+        np.savez(shardFile, **shardArrays)
+    os.replace(tempPath, outPath)
+    return outPath
+
+
+def write_pair_shards(graphPath, wikiPath, outFolder, shardNum=64, workers=1,
+                      iter=2, delta=0.001, batchSize=256):
+    """
+    Ranks every text of wiki file with graph saved at graphPath and writes
+    (mechanical scores, graph ranked scores) pairs of each of shardNum
+    record-aligned shards to outFolder as pairs{shardId:05d}.npz. Shards that
+    already exist are skipped, so an interrupted run resumes where it
+    stopped. Returns sorted list of shard paths.
+    """
+    assert (workers > 0), f'workers must be positive, but found {workers}.'
+    os.makedirs(outFolder, exist_ok=True)
+    shards = [(wikiPath, start, end, f'{outFolder}/pairs{shardId:05d}.npz',
+               batchSize)
+              for shardId, (start, end)
+              in enumerate(WikiReader(wikiPath).shard(shardNum))]
+    pending = [shard for shard in shards if not os.path.exists(shard[3])]
+    initArgs = (graphPath, iter, delta)
+    if (workers == 1):
+        init_worker(*initArgs)
+        for shard in tqdm(pending):
+            pair_shard(shard)
+    else:
+        with Pool(processes=workers, initializer=init_worker,
+                  initargs=initArgs) as pool:
+            for _ in tqdm(pool.imap_unordered(pair_shard, pending),
+                          total=len(pending)):
+                pass
+    return [shard[3] for shard in shards]
+
+
+if __name__ == '__main__':
+    corrMatrix = np.array([[1, 0.9, 0.1], [0.2, 1, 0.1],
+                           [0.0001, 0.0001, 1]])
+    textVec = np.array([0.2, 0.2, 0.6])
+
+    for num, col in enumerate(corrMatrix.T):
+        colSum = np.sum(col)
+        print(colSum)
+        corrMatrix[:, num] = np.divide(col, colSum)
+
+    print(graph_rank_test(corrMatrix, textVec))
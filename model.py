@@ -1,38 +1,269 @@
+"""
+Trains model predicting convergence ranked token scores of a text from its
+mechanical token scores. Sparse (features, targets) pairs are streamed from
+shards written by graphrank.write_pair_shards, one shard in memory at a time.
+Features enter as the ids and scores of the top tokens of each text, summed
+through an embedding bag of a vocabSize x dim matrix, and tokens are scored
+against a vocabSize x dim matrix of output embeddings, so the model grows as
+vocabSize * dim rather than vocabSize^2. Training scores only the top targets
+of each text and a sample of other tokens, so batches stay sparse, and every
+batch has the same shape, so the model compiles once.
+"""
+
+import os
+import argparse
+import numpy as np
 import keras
+from scipy.sparse import csr_matrix
+
+import graphrank as graphrank
+from structs.tokengraph import TokenGraph
+from structs.embeddingEdges import top_n_rows
+
+
+@keras.saving.register_keras_serializable(package='TokenGraph')
+class TokenScores(keras.layers.Layer):
+    """
+    Scores tokens by the dot product of hidden vectors with an output
+    embedding of each token plus a bias of each token. Given candidate ids,
+    scores only the candidates of each text, else every token in vocab.
+    """
+    def __init__(self, vocabSize, dim, **kwargs):
+        super().__init__(**kwargs)
+        self.vocabSize = vocabSize
+        self.dim = dim
+        self.embeddings = self.add_weight(shape=(vocabSize, dim),
+                                          initializer='glorot_uniform',
+                                          name='embeddings')
+        self.biases = self.add_weight(shape=(vocabSize,), initializer='zeros',
+                                      name='biases')
+        self.built = True
+
+    def call(self, hidden, candidateIds=None):
+        if candidateIds is None:
+            return (keras.ops.matmul(hidden,
+                                     keras.ops.transpose(self.embeddings))
+                    + self.biases)
+        candidateEmbeddings = keras.ops.take(self.embeddings, candidateIds,
+                                             axis=0)
+        return (keras.ops.einsum('bd,bcd->bc', hidden, candidateEmbeddings)
+                + keras.ops.take(self.biases, candidateIds, axis=0))
 
-class Language():
-    def __init__(self, size):
-        self.vocabSize = size
-
-def build_model(Language):
-    """ Returns structure of model for word vector optimization """
-    vocabSize = Language.vocabSize
-    initial_score_vec = keras.layers.Input(shape=(vocabSize,),
-                                            name='initial_score_vec')
-    dense_1 = keras.layers.Dense(units=vocabSize)(initial_score_vec)
-    dense_2 = keras.layers.Dense(units=vocabSize)(dense_1)
-    dense_3 = keras.layers.Dense(units=vocabSize)(dense_2)
-    output = keras.layers.Dense(units=vocabSize, activation='relu')(dense_3)
-    model = keras.models.Model(inputs=initial_score_vec,  outputs=output)
+    def get_config(self):
+        config = super().get_config()
+        config.update({'vocabSize' : self.vocabSize, 'dim' : self.dim})
+        return config
+
+
+def build_model(vocabSize, dim=128, hiddenDim=None):
+    """
+    Returns training model mapping padded ids and mechanical scores of
+    features of each text and ids of its candidate tokens to logits of the
+    candidates
+    """
+    feature_ids = keras.layers.Input(shape=(None,), dtype='int32',
+                                     name='feature_ids')
+    feature_scores = keras.layers.Input(shape=(None,), name='feature_scores')
+    candidate_ids = keras.layers.Input(shape=(None,), dtype='int32',
+                                       name='candidate_ids')
+    # score-weighted bag of token embeddings, where padding has zero score
+    token_embeddings = keras.layers.Embedding(input_dim=vocabSize,
+                                              output_dim=dim,
+                                              name='token_embeddings'
+                                              )(feature_ids)
+    token_bag = keras.layers.Dot(axes=1, name='token_bag')([feature_scores,
+                                                            token_embeddings])
+    hidden = keras.layers.Dense(units=(hiddenDim or dim), activation='relu',
+                                name='hidden')(token_bag)
+    candidate_logits = TokenScores(vocabSize, (hiddenDim or dim),
+                                   name='token_scores')(hidden, candidate_ids)
+    model = keras.models.Model(inputs=[feature_ids, feature_scores,
+                                       candidate_ids],
+                               outputs=candidate_logits)
     return model
 
-size = 5
-e = Language(size)
-m = build_model(e)
-m.compile(optimizer='adam', loss='categorical_crossentropy')
 
-import numpy as np
+def ranking_model(model):
+    """
+    Returns model sharing weights of training model that maps padded ids and
+    mechanical scores of features of each text to ranked scores of every
+    token in vocab
+    """
+    hidden = model.get_layer('hidden').output
+    token_logits = model.get_layer('token_scores')(hidden)
+    output = keras.layers.Softmax(name='ranked_score_vec')(token_logits)
+    return keras.models.Model(inputs=model.inputs[:2], outputs=output)
+
+
+def load_pair_shard(path, vocabSize):
+    """
+    Returns tuple (features, targets) of sparse matrices with a row for every
+    text of pair shard at path
+    """
+    with np.load(path) as shard:
+        textNum = len(shard['inputIndptr']) - 1
+        features = csr_matrix((shard['inputScores'], shard['inputIds'],
+                               shard['inputIndptr']),
+                              shape=(textNum, vocabSize))
+        targets = csr_matrix((shard['targetScores'], shard['targetIds'],
+                              shard['targetIndptr']),
+                             shape=(textNum, vocabSize))
+    return features, targets
+
+
+def shard_steps(shardPaths, batchSize):
+    """ Returns number of batches yielded per pass over pair shards """
+    steps = 0
+    for path in shardPaths:
+        with np.load(path) as shard:
+            steps += -(-(len(shard['inputIndptr']) - 1) // batchSize)
+    return steps
+
+
+def pad_rows(rows, width):
+    """
+    Returns tuple (ids, scores, filled) of len(rows) x width arrays holding
+    the width highest scoring entries of every row of sparse CSR rows in
+    descending order, padded with id 0 and score 0 where filled is False
+    """
+    indptr, rowIds, rowScores = top_n_rows(rows.indptr.astype(np.int64),
+                                           rows.indices, rows.data, width)
+    rowLocs = np.repeat(np.arange(rows.shape[0]), np.diff(indptr))
+    colLocs = np.arange(len(rowIds)) - indptr[rowLocs]
+    ids = np.zeros(shape=(rows.shape[0], width), dtype=np.int32)
+    scores = np.zeros(shape=(rows.shape[0], width), dtype=np.float32)
+    filled = np.zeros(shape=(rows.shape[0], width), dtype=bool)
+    ids[rowLocs, colLocs] = rowIds
+    scores[rowLocs, colLocs] = rowScores
+    filled[rowLocs, colLocs] = True
+    return ids, scores, filled
+
+
+def sample_candidates(targets, vocabSize, maxTargets, negativeNum, rng):
+    """
+    Returns tuple (candidateIds, candidateWeights) of arrays with a row of
+    maxTargets + negativeNum candidates for every row of sparse targets. Each
+    row holds the top maxTargets targets of its text, padded with ids drawn
+    uniformly from vocab that aren't targets of the text. Weights are target
+    scores scaled to unit sum in each row and zero for drawn ids.
+    """
+    assert (maxTargets < vocabSize), ('maxTargets must be under vocabSize, '\
+                                      f'but found {maxTargets}.')
+    ids, scores, isTarget = pad_rows(targets, maxTargets)
+    rowNum = len(ids)
+    candidateIds = rng.integers(vocabSize, size=(rowNum,
+                                                 (maxTargets + negativeNum)),
+                                dtype=np.int32)
+    candidateIds[:, :maxTargets][isTarget] = ids[isTarget]
+    candidateWeights = np.pad(scores, ((0, 0), (0, negativeNum)))
+    isTarget = np.pad(isTarget, ((0, 0), (0, negativeNum)))
+    # redraw ids that hit a target of their text until none do, unless its
+    # targets span all of vocab
+    targetNums = np.diff(targets.indptr)
+    rowKeys = np.arange(rowNum, dtype=np.int64)[:, None] * vocabSize
+    targetKeys = ((np.repeat(np.arange(rowNum, dtype=np.int64), targetNums)
+                   * vocabSize) + targets.indices)
+    hits = (~isTarget & (targetNums < vocabSize)[:, None]
+            & np.isin((rowKeys + candidateIds), targetKeys))
+    while hits.any():
+        candidateIds[hits] = rng.integers(vocabSize, size=hits.sum(),
+                                          dtype=np.int32)
+        hits &= np.isin((rowKeys + candidateIds), targetKeys)
+    weightSums = candidateWeights.sum(axis=1, keepdims=True)
+    np.divide(candidateWeights, weightSums, out=candidateWeights,
+              where=(weightSums != 0))
+    return candidateIds, candidateWeights
+
+
+def pair_batches(shardPaths, vocabSize, batchSize=256, maxFeatures=64,
+                 maxTargets=32, negativeNum=64, seed=0, loop=True):
+    """
+    Yields ((featureIds, featureScores, candidateIds), candidateWeights)
+    batches holding the top maxFeatures features of each text from pad_rows
+    and its candidates from sample_candidates, visiting shards and texts
+    within each shard in fresh random order every pass. The last batch of
+    each shard is filled with texts from the start of its order, so all
+    batches have batchSize rows. Passes repeat forever if loop.
+    """
+    rng = np.random.default_rng(seed)
+    while True:
+        for shardLoc in rng.permutation(len(shardPaths)):
+            features, targets = load_pair_shard(shardPaths[shardLoc],
+                                                vocabSize)
+            batchNum = -(-features.shape[0] // batchSize)
+            textOrder = np.resize(rng.permutation(features.shape[0]),
+                                  (batchNum * batchSize))
+            for batchStart in range(0, len(textOrder), batchSize):
+                batchRows = textOrder[batchStart : batchStart + batchSize]
+                featureIds, featureScores, _ = pad_rows(features[batchRows],
+                                                        maxFeatures)
+                candidateIds, candidateWeights = sample_candidates(
+                                            targets[batchRows], vocabSize,
+                                            maxTargets, negativeNum, rng)
+                yield ((featureIds, featureScores, candidateIds),
+                       candidateWeights)
+            del features, targets
+        if not loop:
+            break
+
+
+def train_model(model, shardPaths, vocabSize, batchSize=256, epochs=5,
+                maxFeatures=64, maxTargets=32, negativeNum=64, seed=0):
+    """
+    Compiles and fits training model on batches streamed from pair shards,
+    with softmax cross entropy over the candidates of each text. Returns
+    training history.
+    """
+    assert shardPaths, 'No pair shards found to train on.'
+    model.compile(optimizer='adam',
+                  loss=keras.losses.CategoricalCrossentropy(from_logits=True))
+    return model.fit(pair_batches(shardPaths, vocabSize, batchSize,
+                                  maxFeatures, maxTargets, negativeNum, seed),
+                     steps_per_epoch=shard_steps(shardPaths, batchSize),
+                     epochs=epochs, shuffle=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train token rank model.')
+    parser.add_argument('--graph', default='data/outData/10000Dict_graphObj')
+    parser.add_argument('--wiki', default=None,
+                        help='Wiki csv to rank into pair shards if given.')
+    parser.add_argument('--pairs', default='data/outData/rankPairs')
+    parser.add_argument('--shards', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--iter', type=int, default=2)
+    parser.add_argument('--delta', type=float, default=0.001)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--hidden', type=int, default=None)
+    parser.add_argument('--batch', type=int, default=256)
+    parser.add_argument('--features', type=int, default=64)
+    parser.add_argument('--targets', type=int, default=32)
+    parser.add_argument('--negatives', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='data/outData/rankModel.keras')
+    args = parser.parse_args()
 
-x = np.random.randint(low=0, high=10, size=(10000, size))
-y = np.array([10*e for e in x])
-print(x[0])
-print(y[0])
-m.fit(x, y, epochs=30)
+    if args.wiki:
+        shardPaths = graphrank.write_pair_shards(args.graph, args.wiki,
+                                                 args.pairs, args.shards,
+                                                 args.workers, args.iter,
+                                                 args.delta)
+    else:
+        shardPaths = sorted(f'{args.pairs}/{name}'
+                            for name in os.listdir(args.pairs)
+                            if name.endswith('.npz'))
+    graphObj = TokenGraph()
+    graphObj.load(args.graph)
+    vocabSize = graphObj.tokenizer.vocabSize
+    del graphObj
+    model = build_model(vocabSize, args.dim, args.hidden)
+    model.summary()
+    train_model(model, shardPaths, vocabSize, args.batch, args.epochs,
+                args.features, args.targets, args.negatives, args.seed)
+    ranking_model(model).save(args.out)
+    return True
 
-import matplotlib.pyplot as plt
 
-# while True:
-# t = np.array([input(f'{i}: ') for i in range(size)])
-t = np.expand_dims(np.array([0.1, 0.2, 0.3, 0.4, 0.5]), axis=0)
-pred = (m.predict(t))
-print(pred)
+if __name__ == '__main__':
+    main()
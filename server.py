@@ -0,0 +1,218 @@
+"""
+Serves TokenGraph ranking over a local TCP or unix socket with asyncio.
+Requests are newline-delimited json objects like {"text": "...", "n": 7} and
+each gets a json line back like {"tokens": [[id, word, score], ...]}, or
+like {"status": 400, "error": "..."} if the request is malformed or n is not
+positive and {"status": 500, "error": "..."} if ranking fails.
+Concurrent requests are coalesced into micro-batches that are ranked with
+DICT_graph_rank_texts in a pool of worker processes, each of which loads the
+memory-mapped graph once.
+"""
+
+import json
+import asyncio
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from structs.tokengraph import TokenGraph
+
+# per-process graph and ranking settings set by pool initializer
+WORKER_STATE = {}
+
+
+def init_worker(graphPath, iter, delta, cacheSize):
+    """ Loads memory-mapped graph once into worker process """
+    graphObj = TokenGraph()
+    graphObj.load(graphPath)
+    if cacheSize:
+        graphObj.enable_cache(maxSize=cacheSize)
+    WORKER_STATE.update({'graph' : graphObj, 'iter' : iter, 'delta' : delta})
+
+
+def rank_batch(requests):
+    """
+    Ranks batch of (text, n) requests at once and returns list of top n
+    [id, word, score] lists for each request
+    """
+    graphObj = WORKER_STATE['graph']
+    offsets, ids, scores = graphObj.DICT_graph_rank_texts(
+                                        [text for text, _ in requests],
+                                        WORKER_STATE['iter'],
+                                        WORKER_STATE['delta'])
+    reverseIdx = graphObj.tokenizer.reverseIdx
+    results = []
+    for i, (_, n) in enumerate(requests):
+        textIds = ids[offsets[i]:offsets[i + 1]]
+        textScores = scores[offsets[i]:offsets[i + 1]]
+        topLocs = np.argsort(-textScores, kind='stable')[:n]
+        results.append([[int(textIds[loc]), reverseIdx[int(textIds[loc])],
+                         float(textScores[loc])] for loc in topLocs])
+    return results
+
+
+class MicroBatcher(object):
+    """
+    Collects concurrent requests into batches of at most maxBatch, waiting
+    at most maxWait seconds after the first request of a batch, and runs
+    each batch in executor with at most maxInFlight batches at once
+    """
+    def __init__(self, executor, maxBatch=64, maxWait=0.005, maxInFlight=1):
+        self.executor = executor
+        self.maxBatch = maxBatch
+        self.maxWait = maxWait
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(maxInFlight)
+        self.batchNum = 0
+        self.requestNum = 0
+        # references to running dispatches so they aren't garbage collected
+        self.tasks = set()
+
+    async def rank(self, text, n):
+        """ Queues single request and waits for its result """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(((text, n), future))
+        return await future
+
+    async def run(self):
+        """ Forever pulls batches off queue and dispatches them """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.maxWait
+            while (len(batch) < self.maxBatch):
+                timeout = deadline - loop.time()
+                if (timeout <= 0):
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+            task = loop.create_task(self.dispatch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def dispatch(self, batch):
+        """ Ranks batch in executor and resolves futures of its requests """
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, rank_batch,
+                                                 [request for request, _
+                                                  in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            self.batchNum += 1
+            self.requestNum += len(batch)
+            self.slots.release()
+
+
+def parse_request(line, defaultN):
+    """
+    Returns tuple (text, n) of json request line, raising ValueError if it
+    isn't an object with a text and a positive integer n
+    """
+    request = json.loads(line)
+    if not (isinstance(request, dict) and ('text' in request)):
+        raise ValueError('request must be a json object with a text.')
+    n = request.get('n', defaultN)
+    # bools are ints, and floats would be truncated or overflow int()
+    if isinstance(n, bool) or not isinstance(n, int):
+        raise ValueError(f'n must be an integer, but found {n!r}.')
+    if (n <= 0):
+        raise ValueError(f'n must be positive, but found {n}.')
+    return str(request['text']), n
+
+
+async def handle_client(batcher, defaultN, reader, writer):
+    """ Answers newline-delimited json requests from a single connection """
+    async def answer(line):
+        try:
+            text, n = parse_request(line, defaultN)
+        except (ValueError, TypeError) as error:
+            response = {'status' : 400,
+                        'error' : f'{type(error).__name__}: {error}'}
+            return (json.dumps(response) + '\n').encode('utf-8')
+        try:
+            response = {'tokens' : await batcher.rank(text, n)}
+        except Exception as error:
+            response = {'status' : 500,
+                        'error' : f'{type(error).__name__}: {error}'}
+        return (json.dumps(response) + '\n').encode('utf-8')
+
+    async def respond(pending):
+        """ Writes answers back in request order as they complete """
+        while True:
+            task = await pending.get()
+            if task is None:
+                break
+            writer.write(await task)
+            await writer.drain()
+
+    # rank requests of a connection concurrently but answer them in order
+    pending = asyncio.Queue()
+    responder = asyncio.ensure_future(respond(pending))
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                await pending.put(asyncio.ensure_future(answer(line)))
+        await pending.put(None)
+        await responder
+    finally:
+        responder.cancel()
+        writer.close()
+
+
+async def serve(args):
+    """ Starts worker pool, batcher and socket server """
+    assert (args.n > 0), f'n must be positive, but found {args.n}.'
+    workers = max(1, args.workers)
+    executor = ProcessPoolExecutor(max_workers=workers,
+                                   initializer=init_worker,
+                                   initargs=(args.graph, args.iter,
+                                             args.delta, args.cache))
+    batcher = MicroBatcher(executor, args.max_batch, args.max_wait, workers)
+    handler = lambda reader, writer : handle_client(batcher, args.n, reader,
+                                                    writer)
+    if args.unix:
+        server = await asyncio.start_unix_server(handler, path=args.unix)
+    else:
+        server = await asyncio.start_server(handler, args.host, args.port)
+    batcherTask = asyncio.get_running_loop().create_task(batcher.run())
+    print(f'Serving {args.graph} with {workers} workers on '\
+          f'{args.unix or f"{args.host}:{args.port}"}')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcherTask.cancel()
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve TokenGraph ranking.')
+    parser.add_argument('--graph', default='data/outData/10000Dict_graphObj')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', default=None,
+                        help='Serve on unix socket path instead of tcp.')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait', type=float, default=0.005,
+                        help='Max seconds to wait while filling a batch.')
+    parser.add_argument('--iter', type=int, default=20)
+    parser.add_argument('--delta', type=float, default=0.0000001)
+    parser.add_argument('--n', type=int, default=7)
+    parser.add_argument('--cache', type=int, default=0,
+                        help='Per-worker ranking cache size, 0 to disable.')
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,185 @@
+"""
+Implements ChunkCheckpoint() object for resumable processing of corpus files
+in byte-range chunks, and checkpointed builds of token counts and
+cooccurrence scores that save each finished chunk to disk and merge chunks
+once all are done
+"""
+
+import os
+import hashlib
+import numpy as np
+from tqdm import tqdm
+from collections import Counter
+
+import utils as utils
+import structs.ingest as ingest
+from structs.stringTable import StringTable
+from structs.corrAccumulator import CorrAccumulator
+
+# version of on-disk checkpoint manifest format
+FORMAT_VERSION = 1
+# default number of corpus bytes processed per checkpointed chunk
+CHUNK_BYTES = 2 ** 26
+
+
+class ChunkCheckpoint(object):
+    """
+    Splits corpus file into byte-range chunks and records which chunks have
+    been processed in a manifest in folder at path. A chunk counts as done
+    only once its output is written and the manifest is atomically replaced,
+    so a crash at any point loses at most the chunks in flight. Reopening an
+    existing checkpoint asserts it was made for the same corpus and params.
+    """
+    def __init__(self, path, corpusPath, chunkBytes=CHUNK_BYTES, params=None):
+        assert (chunkBytes > 0), ('chunkBytes must be positive, but found '\
+                                  f'{chunkBytes}.')
+        utils.path_exists(corpusPath)
+        self.path = path
+        corpusStat = os.stat(corpusPath)
+        corpus = {'path'    :   os.path.abspath(corpusPath),
+                  'size'    :   corpusStat.st_size,
+                  'mtime'   :   int(corpusStat.st_mtime)}
+        params = params or {}
+        if os.path.exists(f'{path}/manifest.json'):
+            self.manifest = utils.load_json(f'{path}/manifest')
+            assert (self.manifest['version'] <= FORMAT_VERSION), ('Checkpoint'\
+                            f" format version {self.manifest['version']} is "\
+                            'newer than supported.')
+            assert ((self.manifest['corpus'] == corpus)
+                    and (self.manifest['params'] == params)), ('Checkpoint '\
+                            f'at {path} was made for a different corpus or '\
+                            'settings. Delete it to start over.')
+        else:
+            os.makedirs(path, exist_ok=True)
+            chunkNum = max(1, -(-corpus['size'] // chunkBytes))
+            self.manifest = {'format'       :   'ChunkCheckpoint',
+                             'version'      :   FORMAT_VERSION,
+                             'corpus'       :   corpus,
+                             'params'       :   params,
+                             'chunks'       :   ingest.shard_file(corpusPath,
+                                                                  chunkNum),
+                             'completed'    :   {}}
+            self.save_manifest()
+        self.corpusPath = corpusPath
+
+    def __str__(self):
+        return (f'<ChunkCheckpoint Object: PATH={self.path} | ' \
+                f'DONE={len(self.manifest["completed"])}/{len(self)}>')
+
+    def __len__(self):
+        return len(self.manifest['chunks'])
+
+    def save_manifest(self):
+        """ Atomically replaces manifest on disk """
+        utils.save_json(self.manifest, f'{self.path}/manifestTemp')
+        os.replace(f'{self.path}/manifestTemp.json',
+                   f'{self.path}/manifest.json')
+        return True
+
+    def chunk_name(self, chunkId):
+        """ Returns name prefix of files holding output of chunk """
+        return f'chunk{chunkId:05d}'
+
+    def pending(self):
+        """ Returns list of (chunkId, start, end) of unfinished chunks """
+        return [(chunkId, start, end) for chunkId, (start, end)
+                in enumerate(self.manifest['chunks'])
+                if (str(chunkId) not in self.manifest['completed'])]
+
+    def complete(self, chunkId, info=None):
+        """ Marks chunk as done, storing json-serializable info about it """
+        self.manifest['completed'][str(chunkId)] = info or {}
+        return self.save_manifest()
+
+    def info(self, chunkId):
+        """ Returns info stored when chunk was completed """
+        return self.manifest['completed'][str(chunkId)]
+
+    def run(self, func, tokenizer, workers=1):
+        """
+        Maps ingest worker func over pending chunks, yielding (chunkId,
+        result) as each finishes in chunk order. Callers save result and
+        call complete before the next chunk is yielded.
+        """
+        pending = self.pending()
+        results = ingest.map_ranges(func, self.corpusPath,
+                                    [(start, end) for _, start, end
+                                     in pending],
+                                    tokenizer, workers)
+        for (chunkId, _, _), result in tqdm(zip(pending, results),
+                                            total=len(pending)):
+            yield chunkId, result
+
+
+def vocab_digest(tokenizer):
+    """ Returns hex digest of tokenizer vocab and freqs in idx order """
+    vocab = tokenizer.vocab_list()
+    if tokenizer.freqs is None:
+        tokenizer.build_freqs()
+    freqs = np.asarray(tokenizer.freqs, dtype=np.float64)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update('\n'.join(vocab).encode('utf-8'))
+    digest.update(freqs.tobytes())
+    return digest.hexdigest()
+
+
+def checkpointed_counts(tokenizer, corpusPath, checkpointPath, workers=1,
+                        chunkBytes=CHUNK_BYTES):
+    """
+    Counts token stats of corpus file in checkpointed chunks, saving tokens
+    of each chunk as a string table alongside an array of their term and doc
+    counts, then merges all chunks in order. Returns tuple of (tokenCounts,
+    tokenAppearances, totalLength, textCount) as in Tokenizer.count_tokens.
+    """
+    checkpoint = ChunkCheckpoint(f'{checkpointPath}/counts', corpusPath,
+                                 chunkBytes, {'lower' : tokenizer.lower})
+    for chunkId, chunkStats in checkpoint.run(ingest.count_shard, tokenizer,
+                                              workers):
+        chunkCounts, chunkAppearances, chunkLength, chunkTexts = chunkStats
+        chunkName = checkpoint.chunk_name(chunkId)
+        tokens = list(chunkCounts.keys())
+        StringTable.from_list(tokens).save(checkpoint.path,
+                                           f'{chunkName}Tokens')
+        np.save(f'{checkpoint.path}/{chunkName}Counts.npy',
+                np.array([[chunkCounts[token] for token in tokens],
+                          [chunkAppearances[token] for token in tokens]],
+                         dtype=np.int64))
+        checkpoint.complete(chunkId, {'totalLength' :   chunkLength,
+                                      'textCount'   :   chunkTexts})
+    # merge chunks in corpus order to keep first-appearance order of tokens
+    tokenCounts, tokenAppearances = Counter(), Counter()
+    totalLength, textCount = 0, 0
+    for chunkId in range(len(checkpoint)):
+        chunkName = checkpoint.chunk_name(chunkId)
+        tokens = StringTable.load(checkpoint.path, f'{chunkName}Tokens',
+                                  mmapMode=None).to_list()
+        counts = np.load(f'{checkpoint.path}/{chunkName}Counts.npy')
+        tokenCounts.update(dict(zip(tokens, counts[0].tolist())))
+        tokenAppearances.update(dict(zip(tokens, counts[1].tolist())))
+        totalLength += checkpoint.info(chunkId)['totalLength']
+        textCount += checkpoint.info(chunkId)['textCount']
+    return tokenCounts, tokenAppearances, totalLength, textCount
+
+
+def checkpointed_corr(tokenizer, corpusPath, checkpointPath, workers=1,
+                      chunkBytes=CHUNK_BYTES):
+    """
+    Accumulates cooccurrence scores of corpus file in checkpointed chunks,
+    saving sorted COO keys and values of each chunk as npz, then merges all
+    chunks. Returns CorrAccumulator holding merged scores.
+    """
+    checkpoint = ChunkCheckpoint(f'{checkpointPath}/corr', corpusPath,
+                                 chunkBytes,
+                                 {'lower' : tokenizer.lower,
+                                  'vocab' : vocab_digest(tokenizer)})
+    for chunkId, (keys, vals) in checkpoint.run(ingest.corr_shard, tokenizer,
+                                                workers):
+        np.savez(f'{checkpoint.path}/{checkpoint.chunk_name(chunkId)}Corr.npz',
+                 keys=keys, vals=vals)
+        checkpoint.complete(chunkId, {'pairs' : len(keys)})
+    corrAccumulator = CorrAccumulator(tokenizer.vocabSize)
+    for chunkId in range(len(checkpoint)):
+        chunkName = checkpoint.chunk_name(chunkId)
+        with np.load(f'{checkpoint.path}/{chunkName}Corr.npz') as shard:
+            corrAccumulator.merge_coo(shard['keys'], shard['vals'])
+    return corrAccumulator
@@ -0,0 +1,134 @@
+"""
+Implements CorrAccumulator() object for sparsely accumulating token-token
+cooccurrence scores without materializing a dense vocabSize x vocabSize matrix
+"""
+
+import numpy as np
+
+
+def reduce_coo(keys, vals):
+    """ Sorts flattened COO keys and sums the values of duplicate keys """
+    if (len(keys) == 0):
+        return keys, vals
+    order = np.argsort(keys, kind='stable')
+    keys, vals = keys[order], vals[order]
+    # locate first occurence of each distinct key
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(vals, starts)
+
+
+class CorrAccumulator(object):
+    """
+    Accumulates cooccurrence scores as batches of COO triplets that are
+    periodically reduced into sorted, deduplicated runs. The two newest runs
+    are merged whenever the older was built from at most twice as many
+    triplets, so run sizes more than double from each run to the one before
+    it and at most O(log triplets) runs are held, as in timsort.
+    Memory scales with the number of observed token pairs rather than
+    vocabSize^2.
+    """
+    def __init__(self, vocabSize, batchSize=2000000):
+        assert (vocabSize > 0), ('vocabSize must be positive, but found '\
+                                f'{vocabSize}.')
+        assert (batchSize > 0), ('batchSize must be positive, but found '\
+                                f'{batchSize}.')
+        self.vocabSize = vocabSize
+        self.batchSize = batchSize
+        # sorted runs of flattened (row * vocabSize + col) keys and values
+        # and the number of triplets reduced into each
+        self.runs = []
+        self.runSizes = []
+        # pending COO batches waiting to be reduced into a run
+        self.pendingKeys = []
+        self.pendingVals = []
+        self.pendingSize = 0
+
+    def __str__(self):
+        return (f'<CorrAccumulator Object: VOCAB_SIZE={self.vocabSize} | ' \
+                f'RUNS={len(self.runs)} | PENDING={self.pendingSize}>')
+
+    def add_scores(self, tokenScores):
+        """
+        Adds outer product of a single text's token scores to accumulator
+        Args:
+            tokenScores:    Dict mapping token id to mechanical score in text
+        """
+        if not tokenScores:
+            return False
+        ids = np.fromiter(tokenScores.keys(), dtype=np.int64,
+                          count=len(tokenScores))
+        scores = np.fromiter(tokenScores.values(), dtype=np.float32,
+                             count=len(tokenScores))
+        # flattened keys of every (id, relId) pair observed in the text
+        pairKeys = (ids[:, None] * self.vocabSize + ids[None, :]).ravel()
+        pairVals = np.outer(scores, scores).ravel()
+        self.pendingKeys.append(pairKeys)
+        self.pendingVals.append(pairVals)
+        self.pendingSize += len(pairKeys)
+        if (self.pendingSize >= self.batchSize):
+            self.flush()
+        return True
+
+    def merge_coo(self, keys, vals):
+        """ Merges sorted, deduplicated partial store from another worker """
+        self.pendingKeys.append(keys)
+        self.pendingVals.append(vals)
+        self.pendingSize += len(keys)
+        if (self.pendingSize >= self.batchSize):
+            self.flush()
+        return True
+
+    def merge_csr(self, indptr, indices, data):
+        """ Merges previously accumulated scores given as CSR arrays """
+        rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64),
+                         np.diff(indptr))
+        return self.merge_coo((rows * self.vocabSize + indices),
+                              np.asarray(data, dtype=np.float32))
+
+    def flush(self):
+        """ Reduces pending COO batches into a run and merges similar runs """
+        if not self.pendingKeys:
+            return False
+        self.runs.append(reduce_coo(np.concatenate(self.pendingKeys),
+                                    np.concatenate(self.pendingVals)))
+        self.runSizes.append(self.pendingSize)
+        self.pendingKeys, self.pendingVals, self.pendingSize = [], [], 0
+        while ((len(self.runs) > 1)
+               and (self.runSizes[-2] <= (2 * self.runSizes[-1]))):
+            self.merge_last_runs()
+        return True
+
+    def merge_last_runs(self):
+        """ Merges the two newest runs into one """
+        (keys, vals), (lastKeys, lastVals) = self.runs[-2:]
+        # both are sorted runs, so the stable sort is a linear merge
+        self.runs[-2:] = [reduce_coo(np.concatenate([keys, lastKeys]),
+                                     np.concatenate([vals, lastVals]))]
+        self.runSizes[-2:] = [sum(self.runSizes[-2:])]
+        return True
+
+    def merged(self):
+        """
+        Flushes pending batches and merges all runs. Returns tuple (keys,
+        vals) of sorted, deduplicated flattened keys and their summed values.
+        """
+        self.flush()
+        while (len(self.runs) > 1):
+            self.merge_last_runs()
+        if not self.runs:
+            return (np.zeros(shape=0, dtype=np.int64),
+                    np.zeros(shape=0, dtype=np.float32))
+        return self.runs[0]
+
+    def to_csr(self):
+        """
+        Flushes pending batches and returns accumulated scores as CSR arrays
+        (indptr, indices, data) with rows sorted by token id
+        """
+        keys, vals = self.merged()
+        rows = keys // self.vocabSize
+        indices = (keys % self.vocabSize).astype(np.int32)
+        rowCounts = np.bincount(rows, minlength=self.vocabSize)
+        indptr = np.zeros(shape=(self.vocabSize + 1), dtype=np.int64)
+        np.cumsum(rowCounts, out=indptr[1:])
+        return indptr, indices, vals
@@ -0,0 +1,187 @@
+"""
+Kernels for building top n related tokens of every token from cosine
+similarity of token embeddings, either exactly over memory-bounded blocks of
+rows or approximately over candidates from a random-projection LSH index,
+and for blending those edges with cooccurrence edges of a NeighborGraph
+"""
+
+import numpy as np
+
+from structs.corrAccumulator import reduce_coo
+from structs.neighborGraph import (BLOCK_CELLS, NeighborGraph, ragged_arange,
+                                   top_n_block, compact_top_n, top_n_csr)
+
+
+def load_embeddings(path, vocabSize, mmapMode='r'):
+    """
+    Loads .npy matrix whose row i embeds token of id i in Tokenizer.idx,
+    memory-mapped with mmapMode
+    """
+    embeddings = np.load(path, mmap_mode=mmapMode)
+    assert (embeddings.ndim == 2), ('embeddings must be 2D matrix, but found '\
+                                    f'shape {embeddings.shape}.')
+    assert (len(embeddings) == vocabSize), ('embeddings must have a row for '\
+                                            f'each of {vocabSize} tokens, but '\
+                                            f'found {len(embeddings)}.')
+    return embeddings
+
+
+def unit_rows(embeddings):
+    """
+    Returns float32 copy of embeddings with rows scaled to unit length. Rows
+    of zeros stay zero and so relate to no tokens.
+    """
+    units = np.array(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(units, axis=1, keepdims=True)
+    np.divide(units, norms, out=units, where=(norms != 0))
+    return units
+
+
+def unit_sum_rows(indptr, scores):
+    """ Scales scores of every CSR row to unit sum in place """
+    hasEdges = (np.diff(indptr) > 0)
+    if hasEdges.any():
+        rowSums = np.add.reduceat(scores, indptr[:-1][hasEdges])
+        scores /= np.repeat(rowSums, np.diff(indptr)[hasEdges])
+    return scores
+
+
+def top_n_rows(indptr, indices, scores, n):
+    """
+    Keeps the n highest scores of every CSR row without renormalizing them.
+    Returns CSR arrays (indptr, ids, scores) sorted by descending score in
+    each row.
+    """
+    rowNum = len(indptr) - 1
+    rows = np.repeat(np.arange(rowNum), np.diff(indptr))
+    order = np.lexsort((-scores, rows))
+    rowRanks = np.arange(len(order)) - indptr[rows[order]]
+    order = order[rowRanks < n]
+    topIndptr = np.zeros(shape=(rowNum + 1), dtype=np.int64)
+    np.cumsum(np.bincount(rows[order], minlength=rowNum), out=topIndptr[1:])
+    return (topIndptr, indices[order].astype(np.int32),
+            scores[order].astype(np.float32))
+
+
+def top_n_cosine(embeddings, n, blockRows=None):
+    """
+    Finds top n tokens of highest positive cosine similarity to every token,
+    multiplying blocks of rows against all embeddings so no block holds more
+    than BLOCK_CELLS similarities. Scores of each row are scaled to unit sum.
+    Returns CSR arrays (indptr, ids, scores).
+    """
+    units = unit_rows(embeddings)
+    rowNum = len(units)
+    if not blockRows:
+        blockRows = max(1, BLOCK_CELLS // max(rowNum, 1))
+    allRows, allIds, allScores = [], [], []
+    for blockStart in range(0, rowNum, blockRows):
+        block = units[blockStart : blockStart + blockRows] @ units.T
+        blockRowIds = np.arange(blockStart, blockStart + len(block))
+        # tokens don't relate to themselves or to dissimilar tokens
+        np.maximum(block, 0, out=block)
+        block[np.arange(len(block)), blockRowIds] = 0
+        cols, scores = top_n_block(block, n)
+        rowSums = scores.sum(axis=1, keepdims=True)
+        np.divide(scores, rowSums, out=scores, where=(rowSums != 0))
+        allRows.append(blockRowIds)
+        allIds.append(cols)
+        allScores.append(scores)
+    if not allRows:
+        return compact_top_n(np.zeros(shape=0, dtype=np.int64),
+                             np.zeros(shape=(0, 0), dtype=np.int32),
+                             np.zeros(shape=(0, 0), dtype=np.float32), rowNum)
+    return compact_top_n(np.concatenate(allRows), np.concatenate(allIds),
+                         np.concatenate(allScores), rowNum)
+
+
+def lsh_candidate_keys(units, tables=8, bits=16, maxBucket=64, seed=0):
+    """
+    Hashes unit embeddings by signs of bits random projections in each of
+    tables independent tables and returns sorted unique flattened
+    (row * rowNum + col) keys of token pairs sharing a bucket in any table.
+    Buckets are cut into chunks of at most maxBucket tokens, shuffled per
+    table, to bound the number of pairs.
+    """
+    assert (0 < bits < 63), f'bits must be in [1, 62], but found {bits}.'
+    assert (maxBucket > 1), ('maxBucket must be greater than 1, but found '\
+                             f'{maxBucket}.')
+    rowNum = len(units)
+    rng = np.random.default_rng(seed)
+    planes = rng.standard_normal(size=(units.shape[1], (tables * bits)),
+                                 dtype=np.float32)
+    bitValues = (1 << np.arange(bits, dtype=np.int64))
+    positions = np.arange(rowNum)
+    allKeys = []
+    for table in range(tables):
+        tablePlanes = planes[:, (table * bits):((table + 1) * bits)]
+        codes = ((units @ tablePlanes) > 0) @ bitValues
+        # sort tokens by bucket, in random order within each bucket
+        order = np.lexsort((rng.random(rowNum), codes))
+        sortedCodes = codes[order]
+        isStart = np.concatenate(([True], sortedCodes[1:] != sortedCodes[:-1]))
+        bucketStarts = np.maximum.accumulate(np.where(isStart, positions, 0))
+        isStart |= (((positions - bucketStarts) % maxBucket) == 0)
+        starts = np.flatnonzero(isStart)
+        sizes = np.diff(np.append(starts, rowNum))
+        # pair every token with every token of its chunk
+        memberSizes = np.repeat(sizes, sizes)
+        rows = np.repeat(order, memberSizes)
+        cols = order[ragged_arange(np.repeat(starts, sizes), memberSizes)]
+        notSelf = (rows != cols)
+        allKeys.append(np.unique(rows[notSelf] * rowNum + cols[notSelf]))
+    if not allKeys:
+        return np.zeros(shape=0, dtype=np.int64)
+    return np.unique(np.concatenate(allKeys))
+
+
+def top_n_lsh(embeddings, n, tables=8, bits=16, maxBucket=64, seed=0):
+    """
+    Approximates top_n_cosine by scoring only token pairs that share an LSH
+    bucket, so work scales with rowNum * tables * maxBucket rather than
+    rowNum^2. Returns CSR arrays (indptr, ids, scores).
+    """
+    units = unit_rows(embeddings)
+    rowNum = len(units)
+    keys = lsh_candidate_keys(units, tables, bits, maxBucket, seed)
+    rows, cols = keys // rowNum, keys % rowNum
+    # score candidate pairs in chunks of at most BLOCK_CELLS products
+    chunkSize = max(1, BLOCK_CELLS // max(units.shape[1], 1))
+    sims = np.zeros(shape=len(keys), dtype=np.float32)
+    for chunkStart in range(0, len(keys), chunkSize):
+        chunk = slice(chunkStart, chunkStart + chunkSize)
+        sims[chunk] = np.einsum('ij,ij->i', units[rows[chunk]],
+                                units[cols[chunk]])
+    positive = (sims > 0)
+    indptr = np.zeros(shape=(rowNum + 1), dtype=np.int64)
+    np.cumsum(np.bincount(rows[positive], minlength=rowNum), out=indptr[1:])
+    topIndptr, topIds, topScores = top_n_csr(indptr,
+                                             cols[positive].astype(np.int32),
+                                             sims[positive], n)
+    return topIndptr, topIds, unit_sum_rows(topIndptr, topScores)
+
+
+def blend_graphs(graph, otherGraph, weight, n):
+    """
+    Returns NeighborGraph whose edge scores are (1 - weight) times scores in
+    graph plus weight times scores in otherGraph, keeping top n edges of
+    every token. Zero weight returns the top n edges of graph unchanged.
+    """
+    assert (0 <= weight <= 1), f'weight must be in [0, 1], but found {weight}.'
+    assert (len(graph) == len(otherGraph)), ('graphs must have equal numbers '\
+                                             f'of tokens, but found '\
+                                             f'{len(graph)} and '\
+                                             f'{len(otherGraph)}.')
+    rowNum = len(graph)
+    allKeys, allVals = [], []
+    for edgeGraph, edgeWeight in ((graph, (1 - weight)), (otherGraph, weight)):
+        rows = np.repeat(np.arange(rowNum, dtype=np.int64),
+                         np.diff(edgeGraph.indptr))
+        allKeys.append(rows * rowNum + edgeGraph.indices.astype(np.int64))
+        allVals.append(edgeGraph.decode() * np.float32(edgeWeight))
+    keys, vals = reduce_coo(np.concatenate(allKeys), np.concatenate(allVals))
+    keep = (vals > 0)
+    keys, vals = keys[keep], vals[keep]
+    indptr = np.zeros(shape=(rowNum + 1), dtype=np.int64)
+    np.cumsum(np.bincount((keys // rowNum), minlength=rowNum), out=indptr[1:])
+    return NeighborGraph(*top_n_rows(indptr, (keys % rowNum), vals, n))
@@ -0,0 +1,236 @@
+"""
+Implements streaming summaries for counting token stats of corpora whose
+distinct tokens don't fit in memory: MisraGries() for approximate term counts
+of the most frequent tokens, CountMinSketch() for approximate doc counts of
+any token, and TokenSketch() combining both under one memory budget
+"""
+
+import zlib
+import numpy as np
+from collections import Counter
+
+# rough bytes taken by a counter entry of a short token string
+ENTRY_BYTES = 160
+# bytes of a uint64 sketch cell, wide enough for doc counts of any corpus
+CELL_BYTES = 8
+# seed of second hash used to derive sketch row hashes
+HASH_SEED = 0x9E3779B9
+
+
+def sketch_params(memoryBytes=None, errorRate=None, failureRate=0.01):
+    """
+    Returns tuple (capacity, width, depth) of TokenSketch whose term counts
+    are off by at most errorRate times the number of words seen and whose doc
+    counts are off by at most errorRate times the number of (text, token)
+    appearances seen, with probability 1 - failureRate. If errorRate is None,
+    memoryBytes is split evenly between term and doc counts. If both are
+    given, doc counts take whatever memory term counts leave.
+    """
+    assert (memoryBytes or errorRate), ('memoryBytes or errorRate must be '\
+                                        'given.')
+    assert (0 < failureRate < 1), ('failureRate must be in (0, 1), but found '\
+                                   f'{failureRate}.')
+    depth = int(np.ceil(np.log(1 / failureRate)))
+    # counter holds up to 2 * capacity entries between prunes and sketch
+    # holds depth rows of CELL_BYTES cells
+    if errorRate is None:
+        capacity = int(memoryBytes // (4 * ENTRY_BYTES))
+        width = int(memoryBytes // (2 * CELL_BYTES * depth))
+        assert (capacity > 0), (f'memoryBytes={memoryBytes} is too small for '\
+                                'any sketch.')
+        return capacity, width, depth
+    assert (0 < errorRate < 1), ('errorRate must be in (0, 1), but found '\
+                                 f'{errorRate}.')
+    capacity = int(np.ceil(1 / errorRate))
+    width = int(np.ceil(np.e / errorRate))
+    if memoryBytes:
+        spareBytes = memoryBytes - (2 * ENTRY_BYTES * capacity)
+        neededBytes = ((2 * ENTRY_BYTES * capacity)
+                       + (CELL_BYTES * depth * width))
+        assert (spareBytes >= (CELL_BYTES * depth * width)), (f'errorRate='\
+                                    f'{errorRate} needs about {neededBytes} '\
+                                    f'bytes, over memoryBytes={memoryBytes}.')
+        width = int(spareBytes // (CELL_BYTES * depth))
+    return capacity, width, depth
+
+
+class MisraGries(object):
+    """
+    Keeps counts of at most capacity tokens. Whenever more than 2 * capacity
+    tokens are held, the (capacity + 1)th largest count is subtracted from
+    every count and non-positive counts are dropped. Counts are then under
+    true counts by at most decrement, which never exceeds total count seen
+    over capacity + 1, and every token with a larger true count is held.
+    Summaries merge by adding counts and decrements.
+    """
+    def __init__(self, capacity):
+        assert (capacity > 0), ('capacity must be positive, but found '\
+                                f'{capacity}.')
+        self.capacity = capacity
+        self.counts = Counter()
+        self.decrement = 0
+        self.total = 0
+
+    def __str__(self):
+        return (f'<MisraGries Object: CAPACITY={self.capacity} | ' \
+                f'HELD={len(self.counts)} | DECREMENT={self.decrement}>')
+
+    def __len__(self):
+        return len(self.counts)
+
+    def update(self, tokenCounts):
+        """ Adds dict of token counts """
+        self.counts.update(tokenCounts)
+        self.total += sum(tokenCounts.values())
+        if (len(self.counts) > (2 * self.capacity)):
+            self.prune()
+        return True
+
+    def prune(self):
+        """ Shrinks counts to at most capacity tokens """
+        if (len(self.counts) <= self.capacity):
+            return False
+        counts = np.fromiter(self.counts.values(), dtype=np.int64,
+                             count=len(self.counts))
+        cut = int(np.partition(counts, (len(counts) - self.capacity - 1))
+                  [len(counts) - self.capacity - 1])
+        self.counts = Counter({token : (count - cut)
+                               for token, count in self.counts.items()
+                               if (count > cut)})
+        self.decrement += cut
+        return True
+
+    def merge(self, other):
+        """ Folds counts of another MisraGries summary into this one """
+        self.counts.update(other.counts)
+        self.decrement += other.decrement
+        self.total += other.total
+        self.prune()
+        return True
+
+
+class CountMinSketch(object):
+    """
+    Approximately counts any token in a depth x width array of uint64 cells,
+    adding each count to one cell per row chosen by a stable hash of the
+    token. Queries take the min over rows, so they are never under the true
+    count. Tokens are hashed in batches of batchSize.
+    """
+    def __init__(self, width, depth, batchSize=2 ** 20):
+        assert ((width > 0) and (depth > 0)), ('width and depth must be '\
+                                               f'positive, but found {width} '\
+                                               f'and {depth}.')
+        self.width = width
+        self.depth = depth
+        self.batchSize = batchSize
+        self.table = np.zeros(shape=(depth, width), dtype=np.uint64)
+        self.pending = []
+        self.total = 0
+
+    def __str__(self):
+        return (f'<CountMinSketch Object: WIDTH={self.width} | ' \
+                f'DEPTH={self.depth}>')
+
+    def hash_cells(self, tokens):
+        """ Returns depth x len(tokens) array of cells of each token """
+        encoded = [token.encode('utf-8') for token in tokens]
+        firstHashes = np.fromiter((zlib.crc32(data) for data in encoded),
+                                  dtype=np.int64, count=len(encoded))
+        secondHashes = np.fromiter((zlib.crc32(data, HASH_SEED) | 1
+                                    for data in encoded),
+                                   dtype=np.int64, count=len(encoded))
+        rows = np.arange(self.depth, dtype=np.int64)[:, None]
+        return (firstHashes + (rows * secondHashes)) % self.width
+
+    def add(self, tokens):
+        """ Counts one occurence of each token in iterable of tokens """
+        pendingNum = len(self.pending)
+        self.pending.extend(tokens)
+        self.total += len(self.pending) - pendingNum
+        if (len(self.pending) >= self.batchSize):
+            self.flush()
+        return True
+
+    def flush(self):
+        """ Adds pending tokens to table """
+        if not self.pending:
+            return False
+        for row, cells in enumerate(self.hash_cells(self.pending)):
+            self.table[row] += np.bincount(cells, minlength=self.width
+                                           ).astype(np.uint64)
+        self.pending = []
+        return True
+
+    def query(self, tokens):
+        """ Returns int64 array of estimated counts of list of tokens """
+        self.flush()
+        cells = self.hash_cells(tokens)
+        return self.table[np.arange(self.depth)[:, None], cells].min(axis=0
+                                                            ).astype(np.int64)
+
+    def merge(self, other):
+        """ Adds table of another sketch of equal shape """
+        assert (self.table.shape == other.table.shape), ('sketches must have '\
+                                                         'equal shape.')
+        self.flush()
+        other.flush()
+        self.table += other.table
+        self.total += other.total
+        return True
+
+
+class TokenSketch(object):
+    """
+    Counts token stats of streamed texts in bounded memory, keeping term
+    counts of frequent tokens in a MisraGries summary and doc counts of all
+    tokens in a CountMinSketch
+    """
+    def __init__(self, capacity, width, depth):
+        self.termCounts = MisraGries(capacity)
+        self.docCounts = CountMinSketch(width, depth)
+        self.totalLength = 0
+        self.textCount = 0
+
+    def __str__(self):
+        return (f'<TokenSketch Object: TEXTS={self.textCount} | ' \
+                f'HELD={len(self.termCounts)}>')
+
+    def add_text(self, tokenList):
+        """ Counts list of tokens in a single text """
+        currentCounts = Counter(tokenList)
+        self.termCounts.update(currentCounts)
+        self.docCounts.add(currentCounts.keys())
+        self.totalLength += len(tokenList)
+        self.textCount += 1
+        return True
+
+    def merge(self, other):
+        """ Folds counts of another sketch of equal params into this one """
+        self.termCounts.merge(other.termCounts)
+        self.docCounts.merge(other.docCounts)
+        self.totalLength += other.totalLength
+        self.textCount += other.textCount
+        return True
+
+    def error_bounds(self):
+        """
+        Returns tuple of max undercount of held term counts and max overcount
+        of doc counts, the latter holding with the sketch's failure rate
+        """
+        return (self.termCounts.decrement,
+                int(np.ceil(np.e * self.docCounts.total
+                            / self.docCounts.width)))
+
+    def token_stats(self):
+        """
+        Returns tuple (tokenCounts, tokenAppearances, totalLength, textCount)
+        as in Tokenizer.count_tokens for held tokens, with doc counts clipped
+        to the range [1, textCount]
+        """
+        self.termCounts.prune()
+        tokens = list(self.termCounts.counts)
+        appearances = np.clip(self.docCounts.query(tokens), 1,
+                              max(1, self.textCount))
+        return (Counter(self.termCounts.counts),
+                Counter(dict(zip(tokens, appearances.tolist()))),
+                self.totalLength, self.textCount)
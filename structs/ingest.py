@@ -0,0 +1,93 @@
+"""
+Implements helpers for sharding corpus files by byte range and mapping shard
+workers over a process pool
+"""
+
+import os
+from multiprocessing import Pool
+
+from structs.wikiReader import WikiReader
+from structs.corrAccumulator import CorrAccumulator
+
+# per-process state set by pool initializer so tokenizer is pickled once
+WORKER_STATE = {}
+
+
+def shard_file(path, shardNum):
+    """
+    Splits file at path into shardNum contiguous byte ranges as list of
+    (start, end) tuples. Readers align ranges to line boundaries.
+    """
+    assert (shardNum > 0), f'shardNum must be positive, but found {shardNum}.'
+    fileSize = os.path.getsize(path)
+    bounds = [(fileSize * i) // shardNum for i in range(shardNum + 1)]
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:])
+            if (end > start)]
+
+
+def init_worker(tokenizer):
+    """ Pool initializer storing tokenizer in worker process state """
+    WORKER_STATE['tokenizer'] = tokenizer
+
+
+def map_ranges(func, path, ranges, tokenizer, workers):
+    """
+    Maps func over (start, end) byte ranges of file at path using a pool of
+    workers processes, or in this process if workers is 1, yielding partial
+    results in range order. func is called with (path, start, end) and can
+    read tokenizer from WORKER_STATE.
+    """
+    assert (workers > 0), f'workers must be positive, but found {workers}.'
+    shards = [(path, start, end) for start, end in ranges]
+    if (len(shards) > 1):
+        # record index lets every worker align its range to whole records
+        WikiReader(path).load_index(build=True)
+    if (workers == 1):
+        init_worker(tokenizer)
+        for shard in shards:
+            yield func(shard)
+        return
+    with Pool(processes=workers, initializer=init_worker,
+              initargs=(tokenizer,)) as pool:
+        for result in pool.imap(func, shards):
+            yield result
+
+
+def map_shards(func, path, tokenizer, workers, shardsPerWorker=4):
+    """
+    Maps func over workers * shardsPerWorker byte-range shards of file at
+    path as in map_ranges
+    """
+    assert (workers > 0), f'workers must be positive, but found {workers}.'
+    return map_ranges(func, path,
+                      shard_file(path, (workers * shardsPerWorker)),
+                      tokenizer, workers)
+
+
+def count_shard(shard):
+    """ Worker counting token stats over a single shard """
+    path, start, end = shard
+    tokenizer = WORKER_STATE['tokenizer']
+    return tokenizer.count_tokens(tokenizer.wiki_iterator(path, start, end))
+
+
+def corr_shard(shard):
+    """ Worker accumulating cooccurrence scores over a single shard """
+    path, start, end = shard
+    tokenizer = WORKER_STATE['tokenizer']
+    corrAccumulator = CorrAccumulator(tokenizer.vocabSize)
+    for text in tokenizer.wiki_iterator(path, start, end):
+        tokenScores = tokenizer.single_mechanically_score_tokens(text)
+        corrAccumulator.add_scores(tokenScores)
+    return corrAccumulator.merged()
+
+
+def sketch_shard(sketchParams, shard):
+    """
+    Worker counting token stats over a single shard into a TokenSketch of
+    sketchParams (capacity, width, depth)
+    """
+    path, start, end = shard
+    tokenizer = WORKER_STATE['tokenizer']
+    return tokenizer.sketch_tokens(tokenizer.wiki_iterator(path, start, end),
+                                   sketchParams)
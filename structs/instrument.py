@@ -0,0 +1,226 @@
+"""
+Implements Instrument() object for timing stages of tokenizing and ranking
+and counting sizes of intermediate structures, and sinks that collect those
+observations as in-memory histograms, log records or Prometheus text. The
+default NULL_INSTRUMENT does nothing so disabled instrumentation costs close
+to nothing.
+"""
+
+import os
+import time
+import logging
+import numpy as np
+from bisect import bisect_left
+
+# default histogram bucket upper bounds for stage seconds and counted sizes
+TIMER_BOUNDS = [float(bound) for bound in 10 ** np.arange(-6, 1.01, 0.25)]
+COUNT_BOUNDS = [float(2 ** power) for power in range(21)]
+
+
+class StageTimer(object):
+    """ Context manager reporting seconds spent in block to instrument """
+    __slots__ = ('instrument', 'name', 'start')
+
+    def __init__(self, instrument, name):
+        self.instrument = instrument
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrument.observe('timer', self.name,
+                                (time.perf_counter() - self.start))
+        return False
+
+
+class NullStage(object):
+    """ Context manager that does nothing """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullInstrument(object):
+    """ Instrument that ignores all observations """
+    enabled = False
+
+    def __str__(self):
+        return '<NullInstrument Object>'
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def count(self, name, values):
+        return False
+
+    def observe(self, kind, name, value):
+        return False
+
+
+class Instrument(NullInstrument):
+    """
+    Times named stages and counts named sizes, forwarding every observation
+    to each sink in sinks. Sinks implement observe(kind, name, value) where
+    kind is 'timer' or 'count' and value is a scalar or array of values.
+    """
+    enabled = True
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks) if sinks else [HistogramSink()]
+
+    def __str__(self):
+        return f'<Instrument Object: SINKS={len(self.sinks)}>'
+
+    def stage(self, name):
+        """ Returns context manager timing block as stage name """
+        return StageTimer(self, name)
+
+    def count(self, name, values):
+        """ Records scalar or array of sizes under name """
+        return self.observe('count', name, values)
+
+    def observe(self, kind, name, value):
+        for sink in self.sinks:
+            sink.observe(kind, name, value)
+        return True
+
+
+class HistogramSink(object):
+    """
+    Collects observations into fixed-bucket histograms keyed by (kind, name),
+    tracking count, sum, min and max of each
+    """
+    def __init__(self, timerBounds=TIMER_BOUNDS, countBounds=COUNT_BOUNDS):
+        self.bounds = {'timer' : list(timerBounds),
+                       'count' : list(countBounds)}
+        # maps (kind, name) to [bucket counts, count, sum, min, max]
+        self.histograms = {}
+
+    def __str__(self):
+        return f'<HistogramSink Object: METRICS={len(self.histograms)}>'
+
+    def observe(self, kind, name, value):
+        histogram = self.histograms.get((kind, name))
+        if histogram is None:
+            histogram = [np.zeros(shape=(len(self.bounds[kind]) + 1),
+                                  dtype=np.int64), 0, 0.0, np.inf, -np.inf]
+            self.histograms[(kind, name)] = histogram
+        bounds = self.bounds[kind]
+        if np.ndim(value) == 0:
+            # bucket i holds values in (bounds[i-1], bounds[i]]
+            histogram[0][bisect_left(bounds, value)] += 1
+            histogram[1] += 1
+            histogram[2] += value
+            histogram[3] = min(histogram[3], value)
+            histogram[4] = max(histogram[4], value)
+        elif len(value):
+            values = np.asarray(value, dtype=np.float64)
+            histogram[0] += np.bincount(np.searchsorted(bounds, values),
+                                        minlength=len(histogram[0]))
+            histogram[1] += len(values)
+            histogram[2] += float(values.sum())
+            histogram[3] = min(histogram[3], float(values.min()))
+            histogram[4] = max(histogram[4], float(values.max()))
+        return True
+
+    def quantile(self, kind, name, q):
+        """
+        Estimates q quantile of metric as upper bound of bucket holding it,
+        clipped to observed max
+        """
+        bucketCounts, count, _, _, maxValue = self.histograms[(kind, name)]
+        if count == 0:
+            return None
+        bucket = int(np.searchsorted(np.cumsum(bucketCounts), (q * count)))
+        bounds = self.bounds[kind]
+        return min(bounds[bucket], maxValue) if (bucket < len(bounds)) \
+                else maxValue
+
+    def summary(self):
+        """
+        Returns dict mapping kind to dict of metric name to count, sum, mean,
+        min, max and estimated p50, p90 and p99
+        """
+        summary = {'timer' : {}, 'count' : {}}
+        for (kind, name), (_, count, total, minValue,
+                           maxValue) in self.histograms.items():
+            summary[kind][name] = {'count'  :   count,
+                                   'sum'    :   total,
+                                   'mean'   :   (total / count) if count
+                                                else None,
+                                   'min'    :   minValue,
+                                   'max'    :   maxValue,
+                                   'p50'    :   self.quantile(kind, name, 0.5),
+                                   'p90'    :   self.quantile(kind, name, 0.9),
+                                   'p99'    :   self.quantile(kind, name,
+                                                              0.99)}
+        return summary
+
+    def reset(self):
+        """ Drops all collected histograms """
+        self.histograms.clear()
+        return True
+
+
+class PrometheusSink(HistogramSink):
+    """ HistogramSink that renders its histograms in Prometheus text format """
+    def __init__(self, prefix='tokengraph', **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix
+
+    def render(self):
+        """ Returns all histograms as Prometheus text exposition string """
+        lines = []
+        for (kind, name), (bucketCounts, count, total,
+                           _, _) in sorted(self.histograms.items()):
+            metric = f'{self.prefix}_{name}' + ('_seconds' if (kind == 'timer')
+                                                else '')
+            lines.append(f'# TYPE {metric} histogram')
+            cumCounts = np.cumsum(bucketCounts)
+            for bound, cumCount in zip(self.bounds[kind], cumCounts):
+                lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumCount}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum {total:g}')
+            lines.append(f'{metric}_count {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Atomically writes rendered text to path, as read by a node exporter
+        textfile collector
+        """
+        tempPath = f'{path}.tmp'
+        with open(tempPath, 'w') as promFile:
+            promFile.write(self.render())
+        os.replace(tempPath, path)
+        return True
+
+
+class LoggingSink(object):
+    """ Logs every observation to logger at level """
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('tokengraph')
+        self.level = level
+
+    def __str__(self):
+        return f'<LoggingSink Object: LOGGER={self.logger.name}>'
+
+    def observe(self, kind, name, value):
+        if not self.logger.isEnabledFor(self.level):
+            return False
+        if np.ndim(value) == 0:
+            self.logger.log(self.level, '%s %s: %g', kind, name, value)
+        elif len(value):
+            self.logger.log(self.level, '%s %s: n=%d sum=%g max=%g', kind,
+                            name, len(value), np.sum(value), np.max(value))
+        return True
+
+
+NULL_STAGE = NullStage()
+NULL_INSTRUMENT = NullInstrument()
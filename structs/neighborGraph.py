@@ -0,0 +1,386 @@
+"""
+Implements NeighborGraph() object for compactly storing the top related tokens
+of every token, optionally with quantized scores and narrow ids, and
+vectorized kernels for extracting them from a token-token correlation matrix
+"""
+
+import os
+import numpy as np
+
+try:
+    from scipy.sparse import csr_matrix
+except ImportError:
+    # walks fall back to numpy bincount without scipy
+    csr_matrix = None
+
+# max number of cells in a padded block handed to the top n kernel
+BLOCK_CELLS = 2 ** 24
+# score encodings NeighborGraph can be quantized to
+ENCODINGS = ('float32', 'float16', 'uint8')
+# largest code of uint8 scores, which decode as code * row scale
+CODE_MAX = 255
+
+
+def ragged_arange(starts, lens):
+    """
+    Returns concatenation of ranges [start, start + len) for every pair of
+    starts and lens without a python loop
+    """
+    lens = np.asarray(lens, dtype=np.int64)
+    offsets = np.cumsum(lens) - lens
+    return (np.repeat(np.asarray(starts, dtype=np.int64) - offsets, lens)
+            + np.arange(lens.sum(), dtype=np.int64))
+
+
+def top_n_block(block, n):
+    """
+    Row-normalizes dense block of correlations to unit sum in place and finds
+    top n values of every row at once. Returns tuple (cols, scores) of arrays
+    with shape (rows, min(n, blockCols)) sorted by descending score in each
+    row. Rows with zero sum yield zero scores.
+    """
+    rowNum, colNum = block.shape
+    rowSums = block.sum(axis=1, keepdims=True)
+    np.divide(block, rowSums, out=block, where=(rowSums != 0))
+    k = min(n, colNum)
+    if (k == 0):
+        return (np.zeros(shape=(rowNum, 0), dtype=np.int64),
+                np.zeros(shape=(rowNum, 0), dtype=block.dtype))
+    # partition so last k cols of each row hold its k largest values
+    if (k < colNum):
+        cols = np.argpartition(block, (colNum - k), axis=1)[:, (colNum - k):]
+    else:
+        cols = np.tile(np.arange(colNum), reps=(rowNum, 1))
+    scores = np.take_along_axis(block, cols, axis=1)
+    # sort the k survivors of each row by descending score
+    order = np.argsort(-scores, axis=1, kind='stable')
+    cols = np.take_along_axis(cols, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+    return cols, scores
+
+
+def compact_top_n(rowIds, ids, scores, rowNum):
+    """
+    Drops zero scores from per-row top n arrays of rows rowIds and packs them
+    into CSR arrays (indptr, ids, scores) ordered by row
+    """
+    keep = (scores > 0)
+    rowCounts = np.zeros(shape=rowNum, dtype=np.int64)
+    rowCounts[rowIds] = keep.sum(axis=1)
+    flatRows = np.repeat(rowIds, keep.sum(axis=1))
+    order = np.argsort(flatRows, kind='stable')
+    indptr = np.zeros(shape=(rowNum + 1), dtype=np.int64)
+    np.cumsum(rowCounts, out=indptr[1:])
+    return (indptr, ids[keep][order].astype(np.int32),
+            scores[keep][order].astype(np.float32))
+
+
+def top_n_dense(matrix, n, blockRows=None):
+    """
+    Finds normed top n related tokens of every row of dense matrix, working
+    over blocks of rows. Normalizes matrix rows in place. Returns CSR arrays
+    (indptr, ids, scores).
+    """
+    rowNum, colNum = matrix.shape
+    if not blockRows:
+        blockRows = max(1, BLOCK_CELLS // max(colNum, 1))
+    allRows, allIds, allScores = [], [], []
+    for blockStart in range(0, rowNum, blockRows):
+        block = matrix[blockStart : blockStart + blockRows]
+        cols, scores = top_n_block(block, n)
+        allRows.append(np.arange(blockStart, blockStart + len(block)))
+        allIds.append(cols)
+        allScores.append(scores)
+    if not allRows:
+        return compact_top_n(np.zeros(shape=0, dtype=np.int64),
+                             np.zeros(shape=(0, 0), dtype=np.int32),
+                             np.zeros(shape=(0, 0), dtype=np.float32), rowNum)
+    return compact_top_n(np.concatenate(allRows), np.concatenate(allIds),
+                         np.concatenate(allScores), rowNum)
+
+
+def top_n_csr(indptr, indices, data, n):
+    """
+    Finds normed top n related tokens of every row of sparse CSR matrix.
+    Rows are grouped by length and padded into dense blocks of at most
+    BLOCK_CELLS cells for top_n_block. Returns CSR arrays
+    (indptr, ids, scores).
+    """
+    rowNum = len(indptr) - 1
+    rowLens = np.diff(indptr)
+    # visit rows by length so padding in each block stays small
+    rowOrder = np.argsort(rowLens, kind='stable')
+    rowOrder = rowOrder[rowLens[rowOrder] > 0]
+    allRows, allIds, allScores = [], [], []
+    blockStart = 0
+    while (blockStart < len(rowOrder)):
+        # rows are sorted by length, so sizing block by width at a first
+        # guess of its end can only shrink it to fit under BLOCK_CELLS
+        width = rowLens[rowOrder[blockStart]]
+        guessEnd = min(len(rowOrder),
+                       blockStart + max(1, BLOCK_CELLS // width))
+        width = rowLens[rowOrder[guessEnd - 1]]
+        blockEnd = blockStart + max(1, BLOCK_CELLS // width)
+        blockRowIds = rowOrder[blockStart:blockEnd]
+        blockLens = rowLens[blockRowIds]
+        width = blockLens.max()
+        # scatter sparse row entries into padded dense block
+        padRows = np.repeat(np.arange(len(blockRowIds)), blockLens)
+        padCols = ragged_arange(np.zeros_like(blockLens), blockLens)
+        flatLocs = ragged_arange(indptr[blockRowIds], blockLens)
+        padVals = np.zeros(shape=(len(blockRowIds), width), dtype=np.float32)
+        padIds = np.zeros(shape=(len(blockRowIds), width), dtype=np.int32)
+        padVals[padRows, padCols] = data[flatLocs]
+        padIds[padRows, padCols] = indices[flatLocs]
+        cols, scores = top_n_block(padVals, n)
+        allRows.append(blockRowIds)
+        allIds.append(np.take_along_axis(padIds, cols, axis=1))
+        allScores.append(scores)
+        blockStart = blockEnd
+    if not allRows:
+        return compact_top_n(np.zeros(shape=0, dtype=np.int64),
+                             np.zeros(shape=(0, 0), dtype=np.int32),
+                             np.zeros(shape=(0, 0), dtype=np.float32), rowNum)
+    # blocks have differing widths, so pad top n arrays to common width
+    k = max(ids.shape[1] for ids in allIds)
+    padTo = lambda arr : np.pad(arr, ((0, 0), (0, k - arr.shape[1])))
+    return compact_top_n(np.concatenate(allRows),
+                         np.concatenate([padTo(ids) for ids in allIds]),
+                         np.concatenate([padTo(s) for s in allScores]),
+                         rowNum)
+
+
+class NeighborGraph(object):
+    """
+    Stores top related tokens of every token as CSR arrays. Row tokenId holds
+    related ids indices[indptr[tokenId]:indptr[tokenId+1]] and their scores.
+    Scores are floats, or uint8 codes decoding to code * scoreScales[row]
+    when scoreScales is given.
+    """
+    def __init__(self, indptr, indices, scores, scoreScales=None):
+        assert (len(indices) == len(scores)), ('indices and scores must have '\
+                                               'equal length.')
+        assert (len(indptr) > 0 and indptr[-1] == len(indices)), \
+                ('indptr must end at number of stored neighbors.')
+        assert ((scoreScales is None)
+                or (len(scoreScales) == (len(indptr) - 1))), ('scoreScales '\
+                                            'must hold one scale per row.')
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+        self.scoreScales = scoreScales
+        # lazily built transition operator for random walks
+        self.walkCache = None
+
+    def __str__(self):
+        return (f'<NeighborGraph Object: TOKENS={len(self)} | ' \
+                f'EDGES={len(self.indices)} | BYTES={self.nbytes}>')
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __contains__(self, tokenId):
+        return (0 <= tokenId < len(self))
+
+    def __getitem__(self, tokenId):
+        """ Returns arrays (ids, scores) of top related tokens of tokenId """
+        start, end = self.indptr[tokenId], self.indptr[tokenId + 1]
+        return (self.indices[start:end],
+                self.decode(np.arange(start, end),
+                            np.full(shape=(end - start), fill_value=tokenId)))
+
+    @property
+    def nbytes(self):
+        scaleBytes = 0 if (self.scoreScales is None) \
+                     else self.scoreScales.nbytes
+        return (self.indptr.nbytes + self.indices.nbytes + self.scores.nbytes
+                + scaleBytes)
+
+    @property
+    def encoding(self):
+        """ Name of dtype scores are stored as """
+        return 'uint8' if (self.scoreScales is not None) \
+               else self.scores.dtype.name
+
+    def decode(self, locs=None, rows=None):
+        """
+        Returns float32 scores of edges at locs, which leave rows, or of all
+        edges if locs is None
+        """
+        if locs is None:
+            codes = self.scores
+            if (self.scoreScales is not None):
+                rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        else:
+            codes = self.scores[locs]
+        if (self.scoreScales is None):
+            return np.asarray(codes, dtype=np.float32)
+        return codes * self.scoreScales[rows]
+
+    def quantize(self, encoding='uint8', minScore=0.0):
+        """
+        Returns copy of graph with scores stored as encoding, ids stored as
+        uint16 if there are few enough tokens and uint32 otherwise, and edges
+        scoring under minScore pruned. uint8 scores are scaled per row so the
+        top score of each row maps to CODE_MAX and rounded to the nearest
+        code. Edges rounding to code 0 are pruned too, so every decoded score,
+        pruned ones included, is off by at most half a step of the row scale.
+        """
+        assert (encoding in ENCODINGS), (f'encoding must be one of '\
+                                         f'{ENCODINGS}, but found {encoding}.')
+        rowNum = len(self)
+        edgeRows = np.repeat(np.arange(rowNum), np.diff(self.indptr))
+        scores = self.decode()
+        kept = (scores >= minScore) & (scores > 0)
+        edgeRows, scores = edgeRows[kept], scores[kept]
+        indices = self.indices[kept].astype(np.uint16 if (rowNum <= 2 ** 16)
+                                            else np.uint32)
+        if (encoding == 'uint8'):
+            rowStarts = np.zeros(shape=rowNum, dtype=np.int64)
+            np.cumsum(np.bincount(edgeRows, minlength=rowNum)[:-1],
+                      out=rowStarts[1:])
+            hasEdges = np.zeros(shape=rowNum, dtype=bool)
+            hasEdges[edgeRows] = True
+            scoreScales = np.zeros(shape=rowNum, dtype=np.float32)
+            if hasEdges.any():
+                scoreScales[hasEdges] = (np.maximum.reduceat(
+                                            scores, rowStarts[hasEdges])
+                                         / CODE_MAX)
+            # round to nearest code and prune edges rounding to zero
+            codes = np.minimum(np.rint(scores / scoreScales[edgeRows]),
+                               CODE_MAX)
+            nonzero = (codes > 0)
+            edgeRows, indices = edgeRows[nonzero], indices[nonzero]
+            scores = codes[nonzero].astype(np.uint8)
+        indptr = np.zeros(shape=(rowNum + 1),
+                          dtype=(np.int32 if (len(scores) < 2 ** 31)
+                                 else np.int64))
+        np.cumsum(np.bincount(edgeRows, minlength=rowNum), out=indptr[1:])
+        if (encoding != 'uint8'):
+            return NeighborGraph(indptr, indices, scores.astype(encoding))
+        return NeighborGraph(indptr, indices, scores, scoreScales)
+
+    def gather(self, tokenIds):
+        """
+        Gathers rows of all tokenIds at once using fancy indexing. Returns
+        flat arrays (baseIds, relatedIds, relatedScores) holding one entry
+        per edge leaving tokenIds, with scores decoded to float32.
+        """
+        tokenIds = np.asarray(tokenIds, dtype=np.int64)
+        starts = self.indptr[tokenIds]
+        lens = self.indptr[tokenIds + 1] - starts
+        locs = ragged_arange(starts, lens)
+        baseIds = np.repeat(tokenIds, lens)
+        return baseIds, self.indices[locs], self.decode(locs, baseIds)
+
+    def walk(self, ranks):
+        """
+        Moves rank vector one random-walk step along graph edges, following
+        each edge with probability proportional to its score
+        """
+        if (self.indptr[-1] == 0):
+            # graphs without rows or edges move no rank
+            return np.zeros(shape=len(self), dtype=np.float64)
+        if self.walkCache is None:
+            rowLens = np.diff(self.indptr)
+            edgeRows = np.repeat(np.arange(len(self), dtype=np.int32), rowLens)
+            hasEdges = (rowLens > 0)
+            scores = self.decode(np.arange(len(self.scores)), edgeRows)
+            rowSums = np.add.reduceat(scores, self.indptr[:-1][hasEdges])
+            edgeProbs = np.divide(scores, np.repeat(rowSums,
+                                                    rowLens[hasEdges]),
+                                  dtype=np.float64)
+            if csr_matrix:
+                # transposed transition matrix pulls mass into each target
+                self.walkCache = csr_matrix((edgeProbs,
+                                             (self.indices, edgeRows)),
+                                            shape=(len(self), len(self)))
+            else:
+                self.walkCache = (edgeRows, edgeProbs)
+        if csr_matrix:
+            return self.walkCache @ ranks
+        edgeRows, edgeProbs = self.walkCache
+        return np.bincount(self.indices, weights=(edgeProbs * ranks[edgeRows]),
+                           minlength=len(self))
+
+    def rows(self, tokenIds):
+        """
+        Returns CSR arrays (indptr, indices, scores) of sub-graph holding only
+        rows of tokenIds, in order of tokenIds, with scores decoded to float32
+        """
+        tokenIds = np.asarray(tokenIds, dtype=np.int64)
+        starts = self.indptr[tokenIds]
+        lens = self.indptr[tokenIds + 1] - starts
+        locs = ragged_arange(starts, lens)
+        subIndptr = np.zeros(shape=(len(tokenIds) + 1), dtype=np.int64)
+        np.cumsum(lens, out=subIndptr[1:])
+        return (subIndptr, self.indices[locs],
+                self.decode(locs, np.repeat(tokenIds, lens)))
+
+    def replace_rows(self, tokenIds, rowIndptr, rowIndices, rowScores):
+        """
+        Returns new NeighborGraph with rows of tokenIds replaced by CSR arrays
+        (rowIndptr, rowIndices, rowScores) given in order of tokenIds
+        """
+        tokenIds = np.asarray(tokenIds, dtype=np.int64)
+        replaced = np.zeros(shape=len(self), dtype=bool)
+        replaced[tokenIds] = True
+        # keep old edges of untouched rows and tag every edge with its row
+        oldRows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        keep = ~replaced[oldRows]
+        newRows = np.repeat(tokenIds, np.diff(rowIndptr))
+        allRows = np.concatenate((oldRows[keep], newRows))
+        order = np.argsort(allRows, kind='stable')
+        indptr = np.zeros(shape=(len(self) + 1), dtype=np.int64)
+        np.cumsum(np.bincount(allRows, minlength=len(self)), out=indptr[1:])
+        indices = np.concatenate((self.indices[keep], rowIndices))[order]
+        scores = np.concatenate((self.decode()[keep], rowScores))[order]
+        if (self.scoreScales is not None):
+            # requantize so rescored rows get scales of their own
+            return NeighborGraph(indptr, indices, scores.astype(np.float32)
+                                 ).quantize('uint8')
+        return NeighborGraph(indptr, indices.astype(self.indices.dtype),
+                             scores.astype(self.scores.dtype))
+
+    @classmethod
+    def from_dict(cls, corrDict, tokenNum=None):
+        """
+        Builds NeighborGraph from legacy corr dict mapping token ids to lists
+        of (score, id) tuples
+        """
+        if tokenNum is None:
+            tokenNum = (max(corrDict) + 1) if corrDict else 0
+        rowLens = np.zeros(shape=tokenNum, dtype=np.int64)
+        for tokenId, related in corrDict.items():
+            rowLens[tokenId] = len(related)
+        indptr = np.zeros(shape=(tokenNum + 1), dtype=np.int64)
+        np.cumsum(rowLens, out=indptr[1:])
+        indices = np.zeros(shape=indptr[-1], dtype=np.int32)
+        scores = np.zeros(shape=indptr[-1], dtype=np.float32)
+        for tokenId, related in corrDict.items():
+            if related:
+                start, end = indptr[tokenId], indptr[tokenId + 1]
+                scores[start:end], indices[start:end] = zip(*related)
+        return cls(indptr, indices, scores)
+
+    # save/load methods
+    def save(self, path):
+        """ Saves NeighborGraph arrays as .npy files in folder at path """
+        np.save(f'{path}/indptr.npy', self.indptr)
+        np.save(f'{path}/indices.npy', self.indices)
+        np.save(f'{path}/scores.npy', self.scores)
+        if (self.scoreScales is not None):
+            np.save(f'{path}/scoreScales.npy', self.scoreScales)
+        return True
+
+    @classmethod
+    def load(cls, path, mmapMode='r'):
+        """ Loads NeighborGraph arrays from folder at path """
+        scoreScales = None
+        if os.path.exists(f'{path}/scoreScales.npy'):
+            scoreScales = np.load(f'{path}/scoreScales.npy',
+                                  mmap_mode=mmapMode)
+        return cls(np.load(f'{path}/indptr.npy', mmap_mode=mmapMode),
+                   np.load(f'{path}/indices.npy', mmap_mode=mmapMode),
+                   np.load(f'{path}/scores.npy', mmap_mode=mmapMode),
+                   scoreScales)
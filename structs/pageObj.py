@@ -1,3 +1,150 @@
 """
-Implements obeject to store information about single page of text
+Implements obeject to store information about single page of text and
+PageStore() object for packing many pages into contiguous arrays
 """
+
+import numpy as np
+from bisect import bisect_right
+
+import utils as utils
+from structs.stringTable import StringTable
+
+
+class Page(object):
+    """ Stores a single page as its title and ranked token vector """
+    __slots__ = ('id', 'title', 'tokenIds', 'scores')
+
+    def __init__(self, id, title, tokenIds, scores):
+        assert (len(tokenIds) == len(scores)), ('tokenIds and scores must '\
+                                                'have equal length.')
+        self.id = id
+        self.title = title
+        self.tokenIds = np.asarray(tokenIds, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+
+    def __str__(self):
+        return (f'<Page Object: ID={self.id} | TITLE={self.title} | ' \
+                f'TOKENS={len(self)}>')
+
+    def __len__(self):
+        return len(self.tokenIds)
+
+    def top_tokens(self, n):
+        """ Returns top n tokens of page as list of (token id, score) tuples """
+        topLocs = np.argsort(-self.scores, kind='stable')[:n]
+        return list(zip(self.tokenIds[topLocs].tolist(),
+                        self.scores[topLocs].tolist()))
+
+
+class PageStore(object):
+    """
+    Packs token vectors of many pages into contiguous arrays, where tokens of
+    page i span offsets[i]:offsets[i+1] of tokenIds and scores. Pages added
+    since the last compact are buffered as chunks, which are only packed on
+    save or when a caller needs the whole store contiguous.
+    """
+    def __init__(self):
+        self.offsets = np.zeros(shape=1, dtype=np.int64)
+        self.tokenIds = np.zeros(shape=0, dtype=np.int32)
+        self.scores = np.zeros(shape=0, dtype=np.float32)
+        self.titles = StringTable.from_list([])
+        # chunks of (titles, indptr, tokenIds, scores) waiting to be packed
+        self.pending = []
+        self.pendingPages = 0
+        # page id of first page of each pending chunk
+        self.pendingStarts = []
+
+    def __str__(self):
+        return (f'<PageStore Object: PAGES={len(self)} | ' \
+                f'TOKENS={len(self.tokenIds)}>')
+
+    def __len__(self):
+        return (len(self.offsets) - 1) + self.pendingPages
+
+    def __getitem__(self, pageId):
+        """
+        Returns Page whose token arrays are views into the store, reading
+        pages added since the last compact from their pending chunk
+        """
+        if not (0 <= pageId < len(self)):
+            raise IndexError(f'pageId {pageId} out of range for store of '\
+                             f'{len(self)} pages.')
+        packedNum = len(self.offsets) - 1
+        if (pageId < packedNum):
+            start, end = self.offsets[pageId], self.offsets[pageId + 1]
+            return Page(pageId, self.titles[pageId], self.tokenIds[start:end],
+                        self.scores[start:end])
+        chunkLoc = bisect_right(self.pendingStarts, pageId) - 1
+        chunkTitles, chunkIndptr, chunkIds, chunkScores = self.pending[chunkLoc]
+        loc = pageId - self.pendingStarts[chunkLoc]
+        start, end = chunkIndptr[loc], chunkIndptr[loc + 1]
+        return Page(pageId, chunkTitles[loc], chunkIds[start:end],
+                    chunkScores[start:end])
+
+    def add_page(self, title, tokenIds, scores):
+        """ Adds a single page to store and returns its page id """
+        indptr = np.array([0, len(tokenIds)], dtype=np.int64)
+        self.add_pages([title], indptr, tokenIds, scores)
+        return len(self) - 1
+
+    def add_pages(self, titles, indptr, tokenIds, scores):
+        """
+        Adds many pages given as CSR arrays, where tokens of page i span
+        indptr[i]:indptr[i+1]. titles may be None to leave pages untitled.
+        """
+        pageNum = len(indptr) - 1
+        if titles is None:
+            titles = [''] * pageNum
+        assert (len(titles) == pageNum), ('titles must have one entry per '\
+                                          'page.')
+        self.pendingStarts.append(len(self))
+        self.pending.append((list(titles), np.asarray(indptr, dtype=np.int64),
+                             np.asarray(tokenIds, dtype=np.int32),
+                             np.asarray(scores, dtype=np.float32)))
+        self.pendingPages += pageNum
+        return True
+
+    def compact(self):
+        """
+        Packs pending chunks into contiguous arrays. Titles are joined as
+        encoded string tables, so packed titles are never decoded again.
+        """
+        if not self.pending:
+            return False
+        lengths = [np.diff(self.offsets)]
+        tokenIds, scores = [self.tokenIds], [self.scores]
+        titles = [self.titles]
+        for chunkTitles, chunkIndptr, chunkIds, chunkScores in self.pending:
+            lengths.append(np.diff(chunkIndptr))
+            tokenIds.append(chunkIds[chunkIndptr[0]:chunkIndptr[-1]])
+            scores.append(chunkScores[chunkIndptr[0]:chunkIndptr[-1]])
+            titles.append(StringTable.from_list(chunkTitles))
+        lengths = np.concatenate(lengths)
+        self.offsets = np.zeros(shape=(len(lengths) + 1), dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.tokenIds = np.concatenate(tokenIds)
+        self.scores = np.concatenate(scores)
+        self.titles = StringTable.concat(titles)
+        self.pending, self.pendingPages, self.pendingStarts = [], 0, []
+        return True
+
+    # save/load methods
+    def save(self, path, overwrite=False):
+        """ Saves PageStore arrays to folder at path """
+        self.compact()
+        utils.make_folder(path, overwrite)
+        np.save(f'{path}/offsets.npy', self.offsets)
+        np.save(f'{path}/tokenIds.npy', self.tokenIds)
+        np.save(f'{path}/scores.npy', self.scores)
+        self.titles.save(path, 'titles')
+        return True
+
+    def load(self, path, mmapMode='r'):
+        """ Loads PageStore arrays from folder at path """
+        utils.path_exists(path)
+        assert (len(self) == 0), "PageStore can't be loaded into a used store."
+        self.offsets = np.load(f'{path}/offsets.npy', mmap_mode=mmapMode)
+        self.tokenIds = np.load(f'{path}/tokenIds.npy', mmap_mode=mmapMode)
+        self.scores = np.load(f'{path}/scores.npy', mmap_mode=mmapMode)
+        self.titles = StringTable.load(path, 'titles', mmapMode)
+        return True
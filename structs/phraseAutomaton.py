@@ -0,0 +1,129 @@
+"""
+Implements PhraseAutomaton() object, an Aho-Corasick automaton over words
+that finds every occurence of every token in a text in one pass, including
+tokens overlapping or nested inside other tokens
+"""
+
+import numpy as np
+from collections import deque
+
+from structs.neighborGraph import ragged_arange
+
+
+class PhraseAutomaton(object):
+    """
+    Trie of tokens as word sequences with failure links. Each state holds
+    the (tokenId, wordNum) pairs of every token ending there, including those
+    reached through failure links, so scanning a word reports all tokens that
+    end at it.
+    """
+    def __init__(self, tokenIds):
+        """
+        Builds automaton from dict mapping tokens to ids. Tokens are split on
+        whitespace and later ids win tokens with equal words.
+        """
+        self.wordIds = {}
+        self.children = [{}]
+        self.ends = [None]
+        for token, tokenId in sorted(tokenIds.items(), key=lambda x : x[1]):
+            words = token.split()
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                wordId = self.wordIds.setdefault(word, len(self.wordIds))
+                nextState = self.children[state].get(wordId)
+                if nextState is None:
+                    nextState = len(self.children)
+                    self.children[state][wordId] = nextState
+                    self.children.append({})
+                    self.ends.append(None)
+                state = nextState
+            self.ends[state] = (tokenId, len(words))
+        self.build_links()
+
+    def __str__(self):
+        return (f'<PhraseAutomaton Object: STATES={len(self.children)} | ' \
+                f'WORDS={len(self.wordIds)}>')
+
+    def __len__(self):
+        return len(self.children)
+
+    def build_links(self):
+        """
+        Sets failure link of every state to the state of its longest proper
+        suffix in trie and gathers outputs along failure links, visiting
+        states breadth first so shorter suffixes are done first
+        """
+        self.fail = [0] * len(self.children)
+        self.outputs = [()] * len(self.children)
+        queue = deque(self.children[0].values())
+        while queue:
+            state = queue.popleft()
+            ownEnd = self.ends[state]
+            self.outputs[state] = (((ownEnd,) if ownEnd else ())
+                                   + self.outputs[self.fail[state]])
+            for wordId, child in self.children[state].items():
+                failState = self.fail[state]
+                while failState and (wordId not in self.children[failState]):
+                    failState = self.fail[failState]
+                self.fail[child] = self.children[failState].get(wordId, 0)
+                queue.append(child)
+        return True
+
+    def scan(self, words):
+        """
+        Finds all token occurences in list of words. Returns tuple (starts,
+        lengths, ids) of int64 arrays of word position, number of words and
+        token id of each occurence.
+        """
+        starts, lengths, ids = [], [], []
+        children, fail, outputs = self.children, self.fail, self.outputs
+        state = 0
+        for position, word in enumerate(words):
+            wordId = self.wordIds.get(word)
+            if wordId is None:
+                state = 0
+                continue
+            while state and (wordId not in children[state]):
+                state = fail[state]
+            state = children[state].get(wordId, 0)
+            for tokenId, wordNum in outputs[state]:
+                starts.append(position - wordNum + 1)
+                lengths.append(wordNum)
+                ids.append(tokenId)
+        return (np.array(starts, dtype=np.int64),
+                np.array(lengths, dtype=np.int64),
+                np.array(ids, dtype=np.int64))
+
+
+def greedy_matches(starts, lengths, wordNum):
+    """
+    Picks leftmost-longest non-overlapping occurences as flashtext does.
+    Returns tuple of locs of picked occurences and arrays mapping every word
+    position to the start and length of the picked occurence covering it,
+    with length 0 where none does.
+    """
+    # longest occurence starting at each position is last in sorted order
+    order = np.lexsort((lengths, starts))
+    isLast = np.append((starts[order][1:] != starts[order][:-1]), True)
+    longestLocs = np.full(shape=wordNum, fill_value=-1, dtype=np.int64)
+    longestLocs[starts[order][isLast]] = order[isLast]
+    longestLocs, lengthList = longestLocs.tolist(), lengths.tolist()
+    picked = []
+    position = 0
+    while (position < wordNum):
+        loc = longestLocs[position]
+        if (loc >= 0):
+            picked.append(loc)
+            position += lengthList[loc]
+        else:
+            position += 1
+    picked = np.array(picked, dtype=np.int64)
+    coverStarts = np.zeros(shape=wordNum, dtype=np.int64)
+    coverLengths = np.zeros(shape=wordNum, dtype=np.int64)
+    pickedLengths = lengths[picked]
+    coverLocs = ragged_arange(starts[picked], pickedLengths)
+    coverStarts[coverLocs] = np.repeat(starts[picked], pickedLengths)
+    coverLengths[coverLocs] = np.repeat(pickedLengths, pickedLengths)
+    return picked, coverStarts, coverLengths
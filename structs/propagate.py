@@ -0,0 +1,87 @@
+"""
+Implements vectorized sparse helpers for propagating token weights over
+block-diagonal batches of candidate subgraphs
+"""
+
+import numpy as np
+
+
+def coo_matvec(rows, cols, vals, vec):
+    """
+    Multiplies sparse square matrix given as COO arrays by vec. Duplicate
+    (row, col) pairs are summed.
+    """
+    return np.bincount(rows, weights=(vals * vec[cols]), minlength=len(vec))
+
+
+def block_sums(vec, blockIds, blockNum):
+    """ Sums vec within each block and broadcasts sums back to entries """
+    return np.bincount(blockIds, weights=vec, minlength=blockNum)[blockIds]
+
+
+def power_iterate(matvec, seed, blockIds, blockNum, maxIter, minDelta,
+                  damping=0.85):
+    """
+    Runs damped power iteration x <- damping * Mx + (1 - damping) * seed, with
+    Mx renormalized to unit mass within each block. Blocks stop updating once
+    the L1 change of their weights drops below minDelta.
+    Args:
+        matvec:     Function computing Mx for weight vector x
+        seed:       Initial weight vector with unit mass in each block
+        blockIds:   Block id of each entry of seed
+        blockNum:   Number of blocks
+        maxIter:    Max number of iterations to run
+        minDelta:   L1 change under which a block counts as converged
+        damping:    Fraction of weight propagated along edges each iteration
+    Returns:
+        Tuple (weights, iterations) where iterations holds the number of
+        iterations each block took to converge (maxIter if it did not)
+    """
+    assert (0 < damping <= 1), ('damping must be in (0, 1], but found '\
+                                f'{damping}.')
+    weights = seed.copy()
+    iterations = np.full(shape=blockNum, fill_value=maxIter, dtype=np.int64)
+    active = np.ones(shape=blockNum, dtype=bool)
+    for i in range(1, (maxIter + 1)):
+        stepped = matvec(weights)
+        # renormalize each block, leaving blocks without edges untouched
+        mass = block_sums(stepped, blockIds, blockNum)
+        stepped = np.divide(stepped, mass, out=weights.copy(), where=(mass > 0))
+        stepped = (damping * stepped) + ((1 - damping) * seed)
+        deltas = np.bincount(blockIds, weights=np.abs(stepped - weights),
+                             minlength=blockNum)
+        weights = np.where(active[blockIds], stepped, weights)
+        converged = active & (deltas < minDelta)
+        iterations[converged] = i
+        active &= ~converged
+        if not active.any():
+            break
+    return weights, iterations
+
+
+def personalized_pagerank(walk, seed, alpha=0.85, maxIter=50,
+                          minDelta=0.000001, init=None):
+    """
+    Runs personalized PageRank over whole graph. Walkers follow an edge with
+    probability alpha and otherwise restart at seed. Mass that leaves through
+    nodes without edges is also returned to seed.
+    Args:
+        walk:       Function moving rank vector one step along graph edges
+        seed:       Restart distribution over all nodes with unit sum
+        alpha:      Probability of following an edge at each step
+        maxIter:    Max number of iterations to run
+        minDelta:   L1 change under which ranking counts as converged
+        init:       Optional warm start distribution with unit sum
+    Returns:
+        Tuple (ranks, iterations)
+    """
+    ranks = seed.copy() if (init is None) else init.copy()
+    for i in range(1, (maxIter + 1)):
+        pushed = walk(ranks)
+        lostMass = 1 - pushed.sum()
+        stepped = (alpha * pushed) + ((1 - alpha + (alpha * lostMass)) * seed)
+        delta = np.abs(stepped - ranks).sum()
+        ranks = stepped
+        if (delta < minDelta):
+            return ranks, i
+    return ranks, maxIter
@@ -0,0 +1,71 @@
+"""
+Implements RankCache() object for bounded caching of ranking results
+"""
+
+import time
+from collections import OrderedDict
+
+
+class RankCache(object):
+    """
+    Least-recently-used cache holding at most maxSize entries, each of which
+    expires ttl seconds after being stored if ttl is given. Times are read
+    from clock, which returns seconds. Counts hits, misses and evictions.
+    """
+    def __init__(self, maxSize=10000, ttl=None, clock=time.monotonic):
+        assert (maxSize > 0), f'maxSize must be positive, but found {maxSize}.'
+        assert (ttl is None) or (ttl > 0), ('ttl must be positive or None, '\
+                                            f'but found {ttl}.')
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.clock = clock
+        # maps key to (expiry time, value) in least to most recent order
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return (f'<RankCache Object: SIZE={len(self)}/{self.maxSize} | ' \
+                f'HITS={self.hits} | MISSES={self.misses}>')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """ Returns value stored under key or default if missing or expired """
+        entry = self.entries.get(key)
+        if entry is not None:
+            expiry, value = entry
+            if (expiry is None) or (expiry > self.clock()):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+            self.evictions += 1
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """ Stores value under key, evicting least recently used if full """
+        expiry = (self.clock() + self.ttl) if self.ttl else None
+        self.entries[key] = (expiry, value)
+        self.entries.move_to_end(key)
+        while (len(self.entries) > self.maxSize):
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def clear(self):
+        """ Drops all entries, keeping counters """
+        self.entries.clear()
+        return True
+
+    def stats(self):
+        """ Returns dict of cache size and counters """
+        lookups = self.hits + self.misses
+        return {'size'      :   len(self),
+                'hits'      :   self.hits,
+                'misses'    :   self.misses,
+                'evictions' :   self.evictions,
+                'hitRate'   :   (self.hits / lookups) if lookups else 0.0}
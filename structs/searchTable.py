@@ -3,12 +3,137 @@ The SearchTable is a wide-column store in which tokens keys hash to numpy
 arrays of page token vectors
 """
 
+import numpy as np
+from tqdm import tqdm
+
+import utils as utils
+from structs.pageObj import PageStore
+from structs.neighborGraph import NeighborGraph, top_n_csr
+
+# version of on-disk SearchTable format written by save
+FORMAT_VERSION = 1
+
+
 class SearchTable(object):
+    """
+    Inverted index in which each token id keys posting arrays of the pages
+    it appears in and its graph-ranked weight in each page. Postings are
+    stored as CSR arrays where rows are token ids, indices are page ids and
+    scores are weights.
+    """
     def __init__(self, tokenGraph):
+        assert tokenGraph.initialized, ('tokenGraph must be initialized '\
+                                        'before being passed to SearchTable.')
         self.tokenGraph = tokenGraph
-        # build dict mappping each element of vocabulary to None
-        idxDict = {token : None for token in tokenGraph.corrDict.keys()}
+        self.pageStore = PageStore()
+        self.postings = None
+        self.pageNum = 0
+
+    def __str__(self):
+        postingNum = len(self.postings.indices) if self.postings else 0
+        return (f'<SearchTable Object: PAGES={self.pageNum} | ' \
+                f'POSTINGS={postingNum}>')
+
+    # save/load methods
+    def save(self, path, overwrite=False):
+        """ Saves search table postings to folder at path """
+        assert (self.postings is not None), ('SearchTable must be built '\
+                                             'before saving.')
+        utils.make_folder(path, overwrite)
+        self.postings.save(path)
+        self.pageStore.save(f'{path}/pages')
+        utils.save_json({'format'   :   'SearchTable',
+                         'version'  :   FORMAT_VERSION,
+                         'pageNum'  :   self.pageNum},
+                        f'{path}/meta')
+        return True
+
+    def load(self, path, mmapMode='r'):
+        """ Loads search table postings from folder at path """
+        utils.path_exists(path)
+        meta = utils.load_json(f'{path}/meta')
+        assert (meta['version'] <= FORMAT_VERSION), ('SearchTable format '\
+                                                    f"version {meta['version']}"\
+                                                    ' is newer than supported.')
+        self.postings = NeighborGraph.load(path, mmapMode)
+        self.pageStore = PageStore()
+        self.pageStore.load(f'{path}/pages', mmapMode)
+        self.pageNum = meta['pageNum']
+        return True
+
+    # build methods
+    def build_from_iterator(self, iterator, iter=20, delta=0.001,
+                            pageTokens=100, batchSize=1024):
+        """
+        Builds page store and postings from file iterator of page texts. Page
+        ids follow iterator order.
+        Args:
+            iterator:       File iterator that returns generator of page texts
+            iter:           Number of graph ranking iterations per page
+            delta:          Initial score to assign shadow token candidates
+            pageTokens:     Number of top ranked tokens to post for each page
+            batchSize:      Number of pages to graph rank at once
+        """
+        self.pageStore = PageStore()
+        batch = []
+
+        def add_batch():
+            """ Ranks pages in batch and adds their top tokens to page store """
+            offsets, ids, scores = self.tokenGraph.DICT_graph_rank_texts(
+                                                        batch, iter, delta)
+            # keep top pageTokens of each page normed to unit sum
+            self.pageStore.add_pages(None, *top_n_csr(offsets, ids, scores,
+                                                      pageTokens))
+            batch.clear()
+
+        for text in tqdm(iterator()):
+            batch.append(text)
+            if (len(batch) >= batchSize):
+                add_batch()
+        if batch:
+            add_batch()
+        return self.build_from_page_store(self.pageStore)
+
+    def build_from_page_store(self, pageStore):
+        """ Builds postings by inverting token vectors of pages in pageStore """
+        pageStore.compact()
+        self.pageStore = pageStore
+        self.pageNum = len(pageStore)
+        tokenIds = pageStore.tokenIds
+        pageIds = np.repeat(np.arange(self.pageNum, dtype=np.int32),
+                            np.diff(pageStore.offsets))
+        # group postings by token, keeping pages ascending within each token
+        order = np.argsort(tokenIds, kind='stable')
+        vocabSize = self.tokenGraph.tokenizer.vocabSize
+        indptr = np.zeros(shape=(vocabSize + 1), dtype=np.int64)
+        np.cumsum(np.bincount(tokenIds, minlength=vocabSize), out=indptr[1:])
+        self.postings = NeighborGraph(indptr, pageIds[order],
+                                      pageStore.scores[order])
+        return True
 
-    def save(self, path):
-        """ Saves search table to path """
-        
+    # query methods
+    def search(self, text, k=10, iter=20, delta=0.001):
+        """
+        Scores pages against graph ranked query vector of text by accumulating
+        posting weights of every query token. Returns top k pages as list of
+        (page id, score) tuples sorted by score.
+        """
+        offsets, queryIds, queryWeights = \
+                self.tokenGraph.DICT_graph_rank_texts([text], iter, delta)
+        if (len(queryIds) == 0) or (self.pageNum == 0) or (k <= 0):
+            return []
+        queryWeights = queryWeights / queryWeights.sum()
+        # gather postings of all query tokens at once
+        postingLens = (self.postings.indptr[queryIds + 1]
+                       - self.postings.indptr[queryIds])
+        _, pageIds, pageWeights = self.postings.gather(queryIds)
+        pageScores = np.bincount(pageIds,
+                                 weights=(pageWeights
+                                          * np.repeat(queryWeights,
+                                                      postingLens)),
+                                 minlength=self.pageNum)
+        k = min(k, self.pageNum)
+        topPages = np.argpartition(pageScores, -k)[-k:]
+        topPages = topPages[np.argsort(-pageScores[topPages], kind='stable')]
+        topPages = topPages[pageScores[topPages] > 0]
+        return list(zip(topPages.tolist(), pageScores[topPages].tolist()))
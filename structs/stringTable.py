@@ -0,0 +1,185 @@
+"""
+Implements StringTable() object for storing a list of strings as one flat
+utf-8 byte buffer plus offsets, so it can be saved as arrays and memory-mapped,
+and StringIndex() object for looking strings up in a StringTable through a
+memory-mappable hash table
+"""
+
+import zlib
+import numpy as np
+
+
+class StringTable(object):
+    """ Stores strings as flat byte buffer where string i spans offsets[i:i+2] """
+    def __init__(self, data, offsets):
+        assert (len(offsets) > 0 and offsets[-1] == len(data)), \
+                ('offsets must end at length of data.')
+        self.data = data
+        self.offsets = offsets
+
+    def __str__(self):
+        return f'<StringTable Object: STRINGS={len(self)}>'
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def to_list(self):
+        """ Decodes all strings at once into list """
+        rawBytes = self.data.tobytes()
+        offsetList = self.offsets.tolist()
+        return [rawBytes[start:end].decode('utf-8')
+                for start, end in zip(offsetList[:-1], offsetList[1:])]
+
+    @classmethod
+    def from_list(cls, strings):
+        """ Builds StringTable from list of strings """
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(shape=(len(encoded) + 1), dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    @classmethod
+    def concat(cls, tables):
+        """ Joins list of StringTables end to end without decoding strings """
+        shifts = np.cumsum([0] + [len(table.data) for table in tables])
+        data = np.concatenate([np.zeros(shape=0, dtype=np.uint8)]
+                              + [table.data for table in tables])
+        offsets = np.concatenate([np.zeros(shape=1, dtype=np.int64)]
+                                 + [(table.offsets[1:] + shift)
+                                    for table, shift in zip(tables, shifts)])
+        return cls(data, offsets)
+
+    # save/load methods
+    def save(self, path, name):
+        """ Saves StringTable as arrays named name in folder at path """
+        np.save(f'{path}/{name}Data.npy', self.data)
+        np.save(f'{path}/{name}Offsets.npy', self.offsets)
+        return True
+
+    @classmethod
+    def load(cls, path, name, mmapMode='r'):
+        """ Loads StringTable named name from folder at path """
+        data = np.load(f'{path}/{name}Data.npy', mmap_mode=mmapMode)
+        offsets = np.load(f'{path}/{name}Offsets.npy', mmap_mode=mmapMode)
+        return cls(data, offsets)
+
+
+def string_hashes(table):
+    """ Returns int64 array of crc32 hash of utf-8 bytes of every string """
+    rawBytes = table.data.tobytes()
+    offsetList = table.offsets.tolist()
+    return np.fromiter((zlib.crc32(rawBytes[start:end]) for start, end
+                        in zip(offsetList[:-1], offsetList[1:])),
+                       dtype=np.int64, count=len(table))
+
+
+class StringIndex(object):
+    """
+    Read-only dict mapping every string of a StringTable to its position, or
+    to the entry of values at its position if values are given. Positions
+    are held in an open-addressing hash table of slots, at most half full,
+    where a string hashing to slot h is stored in the first empty slot from
+    h on and empty slots hold -1. Slots save as an array that loads
+    memory-mapped, so lookups need no per-string setup.
+    """
+    def __init__(self, table, slots, values=None):
+        assert (len(slots) > 0) and ((len(slots) & (len(slots) - 1)) == 0), \
+                ('slots must have a power of two length.')
+        self.table = table
+        self.slots = slots
+        self.values = values
+        self.mask = len(slots) - 1
+
+    def __str__(self):
+        return (f'<StringIndex Object: STRINGS={len(self)} | ' \
+                f'SLOTS={len(self.slots)}>')
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        return iter(self.table.to_list())
+
+    def __contains__(self, string):
+        return (self.locate(string) >= 0)
+
+    def __getitem__(self, string):
+        loc = self.locate(string)
+        if (loc < 0):
+            raise KeyError(string)
+        return loc if (self.values is None) else self.values[loc]
+
+    def locate(self, string):
+        """ Returns position of string in table or -1 if it isn't there """
+        if not isinstance(string, str):
+            return -1
+        encoded = string.encode('utf-8')
+        slot = zlib.crc32(encoded) & self.mask
+        data, offsets = self.table.data, self.table.offsets
+        while True:
+            loc = int(self.slots[slot])
+            if (loc < 0):
+                return -1
+            start, end = offsets[loc], offsets[loc + 1]
+            if ((end - start) == len(encoded)) and \
+                    (data[start:end].tobytes() == encoded):
+                return loc
+            slot = (slot + 1) & self.mask
+
+    def get(self, string, default=None):
+        """ Returns value of string, or default if string isn't there """
+        loc = self.locate(string)
+        if (loc < 0):
+            return default
+        return loc if (self.values is None) else self.values[loc]
+
+    def keys(self):
+        return self.table.to_list()
+
+    def values_list(self):
+        """ Returns list of values of all strings in table order """
+        if self.values is None:
+            return list(range(len(self)))
+        return np.asarray(self.values).tolist()
+
+    def items(self):
+        return zip(self.table.to_list(), self.values_list())
+
+    @classmethod
+    def from_table(cls, table, values=None):
+        """
+        Builds StringIndex of StringTable of unique strings, placing strings
+        by linear probing in rounds where each unplaced string tries its next
+        slot and the lowest position claiming a free slot wins it
+        """
+        slotNum = 1 << max(1, int(2 * len(table)).bit_length())
+        slots = np.full(shape=slotNum, fill_value=-1, dtype=np.int32)
+        probes = string_hashes(table) & (slotNum - 1)
+        unplaced = np.arange(len(table), dtype=np.int64)
+        while len(unplaced):
+            free = unplaced[slots[probes[unplaced]] < 0]
+            claimed, firstLocs = np.unique(probes[free], return_index=True)
+            slots[claimed] = free[firstLocs]
+            unplaced = unplaced[slots[probes[unplaced]] != unplaced]
+            probes[unplaced] = (probes[unplaced] + 1) & (slotNum - 1)
+        return cls(table, slots, values)
+
+    # save/load methods
+    def save(self, path, name):
+        """ Saves slots named name in folder at path next to its table """
+        np.save(f'{path}/{name}Slots.npy', self.slots)
+        return True
+
+    @classmethod
+    def load(cls, path, name, table, values=None, mmapMode='r'):
+        """ Loads slots named name from folder at path over table """
+        slots = np.load(f'{path}/{name}Slots.npy', mmap_mode=mmapMode)
+        return cls(table, slots, values)
@@ -3,16 +3,65 @@ Implements TokenGraph() object for storing and accesing
 relationships between tokens
 """
 
+import os
+import time
 import pickle
+import hashlib
 import numpy as np
 from tqdm import tqdm
-from operator import itemgetter
+from heapq import nlargest
 
 import utils as utils
-from structs.tokenizer import Tokenizer
+import structs.ingest as ingest
+import structs.checkpoint as checkpoint
+from structs.tokenizer import Tokenizer, WIKI_PATH
+from structs.neighborGraph import NeighborGraph, top_n_csr, top_n_dense
+from structs.rankCache import RankCache
+from structs.instrument import NULL_INSTRUMENT
+from structs.corrAccumulator import CorrAccumulator
+from structs.embeddingEdges import (load_embeddings, top_n_cosine, top_n_lsh,
+                                    blend_graphs)
+from structs.propagate import (coo_matvec, block_sums, power_iterate,
+                               personalized_pagerank)
 
 # tiny booster to prevent zero values in division
 ZERO_BOOSTER = 0.0000000001
+# version of on-disk TokenGraph format written by save
+FORMAT_VERSION = 2
+# unbounded single-hop candidate expansion used unless set_expansion is run
+DEFAULT_EXPANSION = {'maxCandidates' : None, 'minScore' : 0.0, 'hops' : 1,
+                     'decay' : 0.5, 'maxObserved' : None}
+
+
+def budget_keys(keys, priorities, vocabSize, budget=None):
+    """
+    Returns sorted unique (text, token) keys, keeping per text the budget
+    keys of highest priority, where a repeated key takes its max priority.
+    Keys of infinite priority are always kept. None budget keeps all keys.
+    """
+    if budget is None:
+        return np.unique(keys)
+    order = np.lexsort((priorities, keys))
+    sortedKeys = keys[order]
+    isLast = np.append((sortedKeys[1:] != sortedKeys[:-1]), True)
+    uniqueKeys = sortedKeys[isLast]
+    uniquePriorities = priorities[order][isLast]
+    # rank keys within each text by descending priority
+    keyTexts = uniqueKeys // vocabSize
+    order = np.lexsort((-uniquePriorities, keyTexts))
+    textStarts = np.searchsorted(keyTexts[order], keyTexts[order])
+    kept = (((np.arange(len(order)) - textStarts) < budget)
+            | np.isinf(uniquePriorities[order]))
+    return np.sort(uniqueKeys[order][kept])
+
+
+def sorted_locs(sortedKeys, keys):
+    """ Returns locs of keys in sortedKeys and mask of keys found there """
+    locs = np.searchsorted(sortedKeys, keys)
+    found = locs < len(sortedKeys)
+    found[found] = sortedKeys[locs[found]] == keys[found]
+    return locs, found
+
 
 class TokenGraph(object):
     """ Stores all methods for building and accessing token relationships """
@@ -28,141 +77,406 @@ class TokenGraph(object):
                                                     ' Tokenizer or None.')
         self.tokenizer = tokenizer
         self.corrMatrix = None
-        self.corrDict = None
+        self.corrGraph = None
+        self.corrCounts = None
+        self.pageRank = None
+        # optional caches of final rankings keyed by normalized text hash and
+        # of propagated subgraphs keyed by observed token ids
+        self.textCache = None
+        self.subgraphCache = None
+        # stage timers and counters, which are no-ops unless set
+        self.instrument = NULL_INSTRUMENT
+        # bounds on candidate subgraphs built when ranking
+        self.expansion = dict(DEFAULT_EXPANSION)
         self.initialized = False
 
     def __str__(self):
         return f'<TokenGraph Object: TOKENIZER={self.tokenizer}>'
 
     # save/load methods
-    def save(self, path):
-        """ Saves TokenGraph() to folder at path """
+    def save(self, path, overwrite=False):
+        """
+        Saves TokenGraph() to folder at path as versioned directory of .npy
+        arrays that load can memory-map
+        """
         assert isinstance(path, str), ('path expected type str, but found '\
                                         f'type {type(path)}.')
         assert self.tokenizer, ('TokenGraph must have valid tokenizer object '\
                                 'prior to saving.')
         assert self.initialized, 'TokenGraph must be initialized before saving.'
-        utils.safe_make_folder(path)
-        utils.save_obj(self.corrDict, f'{path}/corrDict.sav')
+        utils.make_folder(path, overwrite)
+        self.corrGraph.save(path)
+        if self.corrCounts is not None:
+            os.mkdir(f'{path}/counts')
+            self.corrCounts.save(f'{path}/counts')
+        if self.pageRank is not None:
+            np.save(f'{path}/pageRank.npy', self.pageRank)
         self.tokenizer.save(f'{path}/tokenizer')
+        utils.save_json({'format'   :   'TokenGraph',
+                         'version'  :   FORMAT_VERSION,
+                         'tokens'   :   len(self.corrGraph),
+                         'edges'    :   len(self.corrGraph.indices),
+                         'encoding' :   self.corrGraph.encoding},
+                        f'{path}/meta')
         return True
 
-    def load(self, path):
-        """ Loads TokenGraph() from folder at path """
+    def load(self, path, mmapMode='r'):
+        """
+        Loads TokenGraph() from folder at path. Graph arrays are memory-mapped
+        with mmapMode so forked or separately started workers share pages.
+        """
         utils.path_exists(path)
         assert not (self.initialized or self.tokenizer), ('TokenGraph file' \
                                                         "can't be loaded into "\
                                                         'an initialized '\
                                                         'TokenGraph.')
-        # self.corrMatrix = np.load(f'{path}/corrMatrix.npy')
-        self.corrDict = utils.load_obj(f'{path}/corrDict.sav')
+        if os.path.exists(f'{path}/meta.json'):
+            meta = utils.load_json(f'{path}/meta')
+            assert (meta['version'] <= FORMAT_VERSION), ('TokenGraph format '\
+                                                    f"version {meta['version']}"\
+                                                    ' is newer than supported.')
+            self.corrGraph = NeighborGraph.load(path, mmapMode)
+            if os.path.exists(f'{path}/counts'):
+                self.corrCounts = NeighborGraph.load(f'{path}/counts',
+                                                     mmapMode)
+            if os.path.exists(f'{path}/pageRank.npy'):
+                self.pageRank = np.load(f'{path}/pageRank.npy',
+                                        mmap_mode=mmapMode)
+        elif os.path.exists(f'{path}/corrGraph.sav'):
+            self.corrGraph = utils.load_obj(f'{path}/corrGraph')
+        else:
+            # convert legacy dict of (score, id) tuple lists
+            corrDict = utils.load_obj(f'{path}/corrDict.sav')
+            self.corrGraph = NeighborGraph.from_dict(corrDict)
+            del corrDict
         self.tokenizer = Tokenizer()
-        self.tokenizer.load(f'{path}/tokenizer')
+        self.tokenizer.load(f'{path}/tokenizer', mmapMode)
+        self.tokenizer.instrument = self.instrument
+        self.clear_cache()
         self.initialized = True
         return True
 
+    # instrumentation methods
+    def set_instrument(self, instrument=None):
+        """
+        Sets Instrument() timing stages and counting candidate set sizes of
+        ranking on graph and its tokenizer. None disables instrumentation.
+        """
+        self.instrument = instrument or NULL_INSTRUMENT
+        if self.tokenizer:
+            self.tokenizer.instrument = self.instrument
+        return True
+
+    # candidate expansion methods
+    def set_expansion(self, maxCandidates=None, minScore=0.0, hops=1,
+                      decay=0.5, maxObserved=None):
+        """
+        Sets how candidate subgraphs expand observed tokens when ranking so
+        miniCorr size per text stays bounded. Drops cached rankings.
+        Args:
+            maxCandidates:  Max candidates per text, filled by related tokens
+                            of highest edge score after kept observed tokens.
+                            None leaves candidate sets unbounded
+            minScore:       Edge score under which related tokens are pruned
+            hops:           Number of hops to expand from observed tokens
+            decay:          Factor edge scores are multiplied by for each hop
+                            past the first
+            maxObserved:    Max observed tokens per text kept as candidates,
+                            those of highest mechanical score. None caps them
+                            at maxCandidates, so candidate sets hold at most
+                            max(maxCandidates, maxObserved) tokens no matter
+                            how long texts are
+        """
+        assert (maxCandidates is None) or (maxCandidates > 0), ('maxCandidates'\
+                                    f' must be positive, but found '\
+                                    f'{maxCandidates}.')
+        assert (maxObserved is None) or (maxObserved > 0), ('maxObserved must '\
+                                    f'be positive, but found {maxObserved}.')
+        assert (hops >= 1), f'hops must be at least 1, but found {hops}.'
+        assert (0 < decay <= 1), f'decay must be in (0, 1], but found {decay}.'
+        self.expansion = {'maxCandidates'   :   maxCandidates,
+                          'minScore'        :   minScore,
+                          'hops'            :   hops,
+                          'decay'           :   decay,
+                          'maxObserved'     :   maxObserved}
+        self.clear_cache()
+        return True
+
+    # cache methods
+    def enable_cache(self, maxSize=10000, ttl=None, subgraphSize=None):
+        """
+        Enables two-level cache of DICT_graph_rank_texts results. Level one
+        maps hash of normalized text and tokenizer scoreVersion to final
+        ranking and level two maps set of observed token ids to propagated
+        subgraph ranking.
+        Args:
+            maxSize:        Max number of rankings in text cache
+            ttl:            Optional seconds after which entries expire
+            subgraphSize:   Max number of rankings in subgraph cache,
+                            defaulting to maxSize
+        """
+        self.textCache = RankCache(maxSize, ttl)
+        self.subgraphCache = RankCache((subgraphSize or maxSize), ttl)
+        return True
+
+    def disable_cache(self):
+        """ Disables and drops ranking caches """
+        self.textCache = None
+        self.subgraphCache = None
+        return True
+
+    def clear_cache(self):
+        """ Drops cached rankings, for use whenever graph changes """
+        if self.textCache is not None:
+            self.textCache.clear()
+            self.subgraphCache.clear()
+        return True
+
     # matrix initialization methods
-    # TODO: Corr matrix --> corr dict
     def build_corr_matrix_from_iterator(self, iterator, n):
         """
-        Builds corr matrix from file iterator using mechanical scores from
-        tokenizer and uses corr matrix to build dict of top related tokens for
-        each token. Sets initialized to True.
+        Builds sparse corr matrix from file iterator using mechanical scores
+        from tokenizer and uses corr matrix to build dict of top related tokens
+        for each token. Sets initialized to True.
         Args:
             iterator:       File iterator that returns generator of text strings
             n:              Number of tokens to include in each token's ranked
                             related token list
         """
-        # cache vars from tokenizer
-        vocabSize = self.tokenizer.vocabSize
-        # initialize matrix to store token-token correlations
-        corrMatrix = np.zeros(shape=(vocabSize, vocabSize), dtype=np.float32())
-        # get base count of texts in iterator for tqdm
-        textCount = len([None for _ in iterator()])
+        # initialize sparse accumulator to store token-token correlations
+        corrAccumulator = CorrAccumulator(self.tokenizer.vocabSize)
         # iterate over texts returned by iterator
-        for i, text in enumerate(tqdm(iterator(), total=textCount)):
-            if i > 1:
-                break
+        for text in tqdm(iterator()):
             # get mechanical scores of tokens in text
             tokenScores = self.tokenizer.single_mechanically_score_tokens(text)
-            # iterate over observed tokens, updating correlations
-            for id, score in tokenScores.items():
-                for relId, relScore in tokenScores.items():
-                    corrMatrix[id, relId] += (score * relScore)
-
-        def norm_sort_and_filter_row(rowVals):
-            """
-            Helper takes a single row from corr matrix and returns top n tokens
-            from row after norming.
-            """
-            # norm row to unit sum
-            rowSum = np.sum(rowVals)
-            if (rowSum == 0):
-                return []
-            normedVals = np.divide(rowVals, rowSum)
-            ## tag and grab top n tokens from normedVals as tuple (score, id) ##
-            topVals = [(val, id) for id, val in enumerate(normedVals[:n])]
-            minElt = min(topVals, key=itemgetter(1))
-            minVal, minLoc = minElt[0], minElt[1]
-            for id, val in enumerate(normedVals[n:]):
-                if val > minVal:
-                    _ = topVals.pop(minLoc)
-                    topVals.append((val, id + n))
-                    minElt = min(topVals, key=itemgetter(1))
-                    minVal, minLoc = minElt[0], minElt[1]
-            topVals.sort(reverse=True, key=itemgetter(1))
-            return topVals
-
-        # build corr dict from corr matrix
-        corrDict = {topId : norm_sort_and_filter_row(corrRow)
-                    for topId, corrRow in tqdm(enumerate(corrMatrix))}
+            # add outer product of observed token scores to correlations
+            corrAccumulator.add_scores(tokenScores)
+        return self.corr_dict_from_accumulator(corrAccumulator, n)
 
-        del corrMatrix
+    def build_corr_matrix_from_file(self, n, path=WIKI_PATH, workers=1,
+                                    checkpointPath=None):
+        """
+        Builds sparse corr matrix from wiki file at path by sharding file
+        across workers processes and merging partial cooccurrence blocks, then
+        builds dict of top n related tokens for each token. Sets initialized
+        to True. If checkpointPath is given, cooccurrence shards of each chunk
+        of file are saved there as they finish and a rerun resumes from the
+        last finished chunk. Shard scores are summed in a different order
+        than a serial build's, so they match it within float tolerance.
+        """
+        if checkpointPath:
+            return self.corr_dict_from_accumulator(
+                        checkpoint.checkpointed_corr(self.tokenizer, path,
+                                                     checkpointPath, workers),
+                        n)
+        if (workers == 1):
+            return self.build_corr_matrix_from_iterator(
+                            lambda : self.tokenizer.wiki_iterator(path), n)
+        corrAccumulator = CorrAccumulator(self.tokenizer.vocabSize)
+        shardResults = ingest.map_shards(ingest.corr_shard, path,
+                                         self.tokenizer, workers)
+        # reduce partial cooccurrence blocks from each shard
+        for shardKeys, shardVals in tqdm(shardResults):
+            corrAccumulator.merge_coo(shardKeys, shardVals)
+        return self.corr_dict_from_accumulator(corrAccumulator, n)
 
-        # update object
-        self.corrDict = corrDict
+    def corr_dict_from_accumulator(self, corrAccumulator, n):
+        """
+        Builds NeighborGraph of top n related tokens for each token from sparse
+        accumulated correlations. Sets initialized to True.
+        """
+        indptr, indices, data = corrAccumulator.to_csr()
+        del corrAccumulator
+        topIndptr, topIds, topScores = top_n_csr(indptr, indices, data,
+                                                 n)
+        # update object, keeping raw counts for incremental updates
+        self.corrGraph = NeighborGraph(topIndptr, topIds, topScores)
+        self.corrCounts = NeighborGraph(indptr, indices, data)
+        self.clear_cache()
         self.initialized = True
         return True
 
-    def TEMP_corr_matrix_to_dict(self, n):
-        corrMatrix = self.corrMatrix
+    def update_from_iterator(self, iterator, n, versionRoot=None):
+        """
+        Folds new texts into tokenizer freq stats and then into persisted
+        cooccurrence counts, scoring them with the updated freqs, and
+        recomputes top n related tokens only for rows that changed. Texts
+        are read twice, once for each pass. Persisted counts of earlier texts
+        keep the freqs they were scored with.
+        Args:
+            iterator:       File iterator that returns generator of new texts
+            n:              Number of tokens to include in each token's ranked
+                            related token list
+            versionRoot:    Optional folder under which updated graph is saved
+                            as the next numbered version
+        Returns:
+            Path of saved version if versionRoot is given, otherwise True
+        """
+        assert self.initialized, 'TokenGraph must be initialized to update.'
+        assert (self.corrCounts is not None), ('TokenGraph has no persisted '\
+                                               'cooccurrence counts to update.')
+        vocabSize = self.tokenizer.vocabSize
+        # fold new texts into freq stats first so they are scored with freqs
+        # that count them, as texts of a full build are
+        self.tokenizer.update_freq_stats(tqdm(iterator()))
+        newAccumulator = CorrAccumulator(vocabSize)
+        for text in tqdm(iterator()):
+            newAccumulator.add_scores(
+                        self.tokenizer.single_mechanically_score_tokens(text))
+        newKeys, _ = newAccumulator.merged()
+        changedIds = np.unique(newKeys // vocabSize)
+        # merge new counts into persisted counts
+        newAccumulator.merge_csr(self.corrCounts.indptr,
+                                 self.corrCounts.indices,
+                                 self.corrCounts.scores)
+        self.corrCounts = NeighborGraph(*newAccumulator.to_csr())
+        del newAccumulator
+        # rescore only changed rows and splice them into graph
+        topIndptr, topIds, topScores = top_n_csr(
+                                        *self.corrCounts.rows(changedIds), n)
+        self.corrGraph = self.corrGraph.replace_rows(changedIds, topIndptr,
+                                                     topIds, topScores)
+        # global ranks and cached rankings no longer match updated graph
+        self.pageRank = None
+        self.clear_cache()
+        if versionRoot:
+            versionPath = utils.next_version_path(versionRoot)
+            self.save(versionPath)
+            return versionPath
+        return True
+
+    def add_embedding_edges(self, embeddingPath, n, weight=0.5, lsh=False,
+                            tables=8, bits=16, maxBucket=64, seed=0):
+        """
+        Blends top n cosine neighbors of token embeddings into graph edges.
+        Rows updated later by update_from_iterator hold cooccurrence edges only
+        until this is run again.
+        Args:
+            embeddingPath:  Path to .npy matrix whose row i embeds token of
+                            id i in tokenizer idx
+            n:              Number of tokens to keep in each token's ranked
+                            related token list
+            weight:         Share of each edge score taken from embedding
+                            similarity rather than cooccurrence
+            lsh:            Whether to score only pairs sharing a bucket of
+                            random-projection LSH index instead of all pairs
+            tables, bits,
+            maxBucket, seed:
+                            LSH index settings as in top_n_lsh
+        """
+        assert self.initialized, ('TokenGraph must be initialized before '\
+                                  'adding embedding edges.')
+        embeddings = load_embeddings(embeddingPath, self.tokenizer.vocabSize)
+        if lsh:
+            embeddingGraph = NeighborGraph(*top_n_lsh(embeddings, n, tables,
+                                                      bits, maxBucket, seed))
+        else:
+            embeddingGraph = NeighborGraph(*top_n_cosine(embeddings, n))
+        del embeddings
+        self.corrGraph = blend_graphs(self.corrGraph, embeddingGraph, weight,
+                                      n)
+        # global ranks and cached rankings no longer match blended graph
+        self.pageRank = None
+        self.clear_cache()
+        return True
 
-        def norm_sort_and_filter_row(rowVals):
-            """
-            Helper takes a single row from corr matrix and returns top n tokens
-            from row after norming.
-            """
-            # norm row to unit sum
-            rowSum = np.sum(rowVals)
-            if (rowSum == 0):
-                return []
-            normedVals = np.divide(rowVals, rowSum)
-            ## tag and grab top n tokens from normedVals as tuple (score, id) ##
-            topVals = [(val, id) for id, val in enumerate(normedVals[:n])]
-            minElt = min(topVals, key=itemgetter(1))
-            minVal, minLoc = minElt[0], minElt[1]
-            for id, val in enumerate(normedVals[n:]):
-                if val > minVal:
-                    _ = topVals.pop(minLoc)
-                    topVals.append((val, id + n))
-                    minElt = min(topVals, key=itemgetter(1))
-                    minVal, minLoc = minElt[0], minElt[1]
-            topVals.sort(reverse=True, key=itemgetter(1))
-            return topVals
-
-        # build corr dict from corr matrix
-        corrDict = {topId : norm_sort_and_filter_row(corrRow)
-                    for topId, corrRow in tqdm(enumerate(corrMatrix))}
+    # compact encoding methods
+    def quantize(self, encoding='uint8', minScore=0.0):
+        """
+        Stores graph scores as encoding with narrow ids and edges scoring
+        under minScore pruned, as in NeighborGraph.quantize. Ranking decodes
+        scores of gathered edges on the fly.
+        """
+        assert self.initialized, ('TokenGraph must be initialized before '\
+                                  'quantizing.')
+        self.corrGraph = self.corrGraph.quantize(encoding, minScore)
+        # global ranks and cached rankings no longer match quantized graph
+        self.pageRank = None
+        self.clear_cache()
+        return True
 
-        del corrMatrix
+    def evaluate_encodings(self, texts, settings=None, k=10, iter=3,
+                           delta=0.001, repeat=3):
+        """
+        Ranks iterable of texts with graph quantized to each (encoding,
+        minScore) pair of settings and compares results against current
+        graph. Graph is left unchanged.
+        Returns:
+            List of dicts, one per setting after a first one for current
+            graph, holding encoding, minScore, graph bytes and edges, best
+            seconds per text over repeat runs, and overlap, the mean fraction
+            of each text's top k tokens also in its top k under current graph
+        """
+        if settings is None:
+            settings = [('float16', 0.0), ('uint8', 0.0), ('uint8', 0.001),
+                        ('uint8', 0.01)]
+        # texts may be a generator, so they are read once
+        observedLists = self.observed_token_lists(texts)
+        textNum = len(observedLists)
+        fullGraph = self.corrGraph
 
+        def top_k_sets(offsets, ids, scores):
+            """ Returns set of top k token ids of every text """
+            topSets = []
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                topLocs = np.argsort(-scores[start:end], kind='stable')[:k]
+                topSets.append(set(ids[start:end][topLocs].tolist()))
+            return topSets
+
+        def evaluate(graph, encoding, minScore):
+            self.corrGraph = graph
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                ranked = self.rank_observed(observedLists, iter, delta)
+                seconds.append(time.perf_counter() - start)
+            result = {'encoding'    :   encoding,
+                      'minScore'    :   minScore,
+                      'bytes'       :   int(graph.nbytes),
+                      'edges'       :   int(len(graph.indices)),
+                      'seconds'     :   min(seconds) / max(textNum, 1)}
+            return result, top_k_sets(*ranked)
+
+        try:
+            fullResult, fullSets = evaluate(fullGraph, fullGraph.encoding,
+                                            0.0)
+            fullResult['overlap'] = 1.0
+            results = [fullResult]
+            for encoding, minScore in settings:
+                result, topSets = evaluate(fullGraph.quantize(encoding,
+                                                              minScore),
+                                           encoding, minScore)
+                result['overlap'] = float(np.mean(
+                            [len(topSet & fullSet) / max(len(fullSet), 1)
+                             for topSet, fullSet in zip(topSets, fullSets)]))
+                results.append(result)
+        finally:
+            self.corrGraph = fullGraph
+        return results
+
+    def TEMP_corr_matrix_to_dict(self, n):
+        """
+        Converts dense corrMatrix into NeighborGraph of top n related tokens
+        for each token. Normalizes rows of corrMatrix in place before dropping it.
+        """
+        corrMatrix = self.corrMatrix
+        if not np.issubdtype(corrMatrix.dtype, np.floating):
+            corrMatrix = corrMatrix.astype(np.float32)
+        topIndptr, topIds, topScores = top_n_dense(corrMatrix, n)
+        del corrMatrix
         self.corrMatrix = None
-        self.corrDict = corrDict
+        self.corrGraph = NeighborGraph(topIndptr, topIds, topScores)
         self.initialized = True
         return True
 
-
     def graph_rank_text(self, text, iter=2, delta=0.001, n=5):
+        """
+        Ranks text over whole dense corrMatrix and returns top n tokens as
+        list of (token id, score) tuples. Falls back to personalized PageRank
+        over corr graph if no dense corrMatrix is loaded.
+        """
+        if self.corrMatrix is None:
+            return self.personal_rank_text(text, n=n)[0]
         # find token counts in text
         tokenFreqs = self.tokenizer.single_mechanically_score_tokens(text)
         # init numpy vector of tiny delta weights
@@ -172,75 +486,343 @@ class TokenGraph(object):
             rawWeights[tokenId] = tokenFreq
         # norm weight vector to unit sum
         weightSum = np.sum(rawWeights)
-        normedWeights = np.divide(rawWeights, weightSum)
-        # run graph ranking over normed weights for iter
-        iterMatrix = np.linalg.matrix_power(self.corrMatrix, n=iter)
-        scoreVec = np.dot(iterMatrix, normedWeights)
+        scoreVec = np.divide(rawWeights, weightSum)
+        # run graph ranking over normed weights for iter matrix-vector products
+        for _ in range(iter):
+            scoreVec = np.dot(self.corrMatrix, scoreVec)
         ## find location and score of top n tokens ##
-        # BUG: sorting method not completely effective
-        # initialize top token list with first n tokens of scoreVec
-        topTokens = list(zip((i for i in range(n)), scoreVec[:n]))
-        minTup = min(topTokens, key=itemgetter(1))
-        minLoc, minScore = minTup[0], minTup[1]
-        # search score vec for tokens with higher ranking than min top token
-        for id, score in tqdm(enumerate(scoreVec)):
-            if score > minScore:
-                topTokens.pop(minLoc)
-                topTokens.append((id, score))
-                minTup = min(topTokens, key=itemgetter(1))
-                minLoc, minScore = minTup[0], minTup[1]
-        topTokens.sort(key=itemgetter(1), reverse=True)
-        return topTokens
+        n = min(n, scoreVec.size)
+        if (n <= 0):
+            return []
+        topIds = np.argpartition(scoreVec, -n)[-n:]
+        topIds = topIds[np.argsort(-scoreVec[topIds], kind='stable')]
+        return list(zip(topIds.tolist(), scoreVec[topIds].tolist()))
+
+    def build_page_rank(self, alpha=0.85, maxIter=100, minDelta=0.00000001):
+        """
+        Computes global PageRank vector of corr graph used to warm start and
+        optionally normalize personalized ranking
+        """
+        tokenNum = len(self.corrGraph)
+        uniform = np.full(shape=tokenNum, fill_value=(1 / tokenNum))
+        self.pageRank, _ = personalized_pagerank(self.corrGraph.walk, uniform,
+                                                 alpha, maxIter, minDelta)
+        return True
+
+    def personal_rank_vector(self, tokenScores, alpha=0.85, maxIter=50,
+                             minDelta=0.000001, init=None):
+        """
+        Runs personalized PageRank over whole corr graph seeded by mechanical
+        token scores. Returns tuple (ranks, iterations) where ranks covers
+        every token in vocab.
+        Args:
+            tokenScores:    Dict mapping observed token ids to scores
+            alpha:          Probability of following an edge at each step
+            maxIter:        Max number of iterations to run
+            minDelta:       L1 change under which ranking has converged
+            init:           Optional warm start ranks such as those of a
+                            previous, similar text
+        """
+        tokenNum = len(self.corrGraph)
+        seed = np.zeros(shape=tokenNum, dtype=np.float64)
+        if not tokenScores:
+            return seed, 0
+        seed[list(tokenScores.keys())] = list(tokenScores.values())
+        seed /= seed.sum()
+        # warm start from global ranks after one step of restart if available
+        if (init is None) and (self.pageRank is not None):
+            init = ((1 - alpha) * seed) + (alpha * self.pageRank)
+        return personalized_pagerank(self.corrGraph.walk, seed, alpha,
+                                     maxIter, minDelta, init)
+
+    def personal_rank_text(self, text, n=20, alpha=0.85, maxIter=50,
+                           minDelta=0.000001, init=None, relative=False,
+                           shadowOnly=False):
+        """
+        Ranks all tokens in vocab against text with personalized PageRank,
+        surfacing multi-hop shadow tokens that do not appear in text.
+        Args:
+            text:           String of raw text to tag
+            n:              Number of top tokens to return
+            relative:       Whether to divide ranks by global PageRank so
+                            tokens central to the whole graph are demoted
+            shadowOnly:     Whether to drop tokens observed in text
+            See personal_rank_vector for remaining args
+        Returns:
+            Tuple (topTokens, iterations) where topTokens is list of
+            (token id, score) tuples sorted by score
+        """
+        tokenScores = self.tokenizer.single_mechanically_score_tokens(text)
+        ranks, iterations = self.personal_rank_vector(tokenScores, alpha,
+                                                      maxIter, minDelta, init)
+        if relative:
+            assert (self.pageRank is not None), ('build_page_rank must be run '\
+                                                 'before relative ranking.')
+            ranks = np.divide(ranks, (self.pageRank + ZERO_BOOSTER))
+        if shadowOnly:
+            ranks[list(tokenScores.keys())] = 0
+        n = min(n, len(ranks))
+        if (n <= 0):
+            return [], iterations
+        topIds = np.argpartition(ranks, -n)[-n:]
+        topIds = topIds[np.argsort(-ranks[topIds], kind='stable')]
+        topIds = topIds[ranks[topIds] > 0]
+        return list(zip(topIds.tolist(), ranks[topIds].tolist())), iterations
 
     def DICT_graph_rank_text(self, text, iter, delta):
         """
-        Ranks text using corr dict of top related tokens for each token found
+        Ranks text using corr graph of top related tokens for each token found
         Args:
             text:       String of raw text to tag
             iter:       Number of iterations over which to approximate ranking
             delta:      Initial score to assign shadow token candidates
         """
-        # find token counts in text
-        tokenFreqs = self.tokenizer.single_mechanically_score_tokens(text)
-        # find all related tokens of those found
-        relatedTokens = {token : self.corrDict[token]
-                            for token in tokenFreqs.keys()}
-        # build a dict of candidates for scoring and new id in miniCorr
-        candidateSet = set()
-        for token in relatedTokens.keys():
-            candidateSet.add(token)
-        for tokenList in relatedTokens.values():
-            for _, token in tokenList:
-                candidateSet.add(token)
-        candidateTokens = {oldId : newId for newId, oldId
-                            in enumerate(candidateSet)}
-        del candidateSet
-        # miniCorr matrix has dims equal to cardinality of candidate dict
-        candidateNum = len(candidateTokens)
-        miniCorr = np.zeros(shape=(candidateNum, candidateNum)) + ZERO_BOOSTER
-        # update correlation pointers in minCorr matrix
-        for baseToken, curRelated in relatedTokens.items():
-            # find new id of baseToken
-            baseId = candidateTokens[baseToken]
-            # add all pointer from baseId
-            for relatedScore, relatedToken in curRelated:
-                relatedId = candidateTokens[relatedToken]
-                miniCorr[baseId, relatedId] += relatedScore
-                miniCorr[relatedId, baseId] += relatedScore
-        # approximate graph ranking over miniCorr for iter iterations
-        iterCorr = np.linalg.matrix_power(miniCorr, n=iter)
-        # build initial weight vector of all candidate tokens
-        rawWeights = np.tile([delta], reps=candidateNum)
-        # update weights of those tokens actually present
-        for token, freq in tokenFreqs.items():
-            rawWeights[candidateTokens[token]] += 1
-        # norm weight vector to unit
-        normedWeights = np.divide(rawWeights, (sum(rawWeights) + ZERO_BOOSTER))
-        # pass normed weight vector through ranked matrix
-        convergedWeights = np.dot(iterCorr, normedWeights)
-        # build reverse index to access original token id from mini id
-        reverseCandidateIdx = {newId : oldId for oldId, newId
-                                in candidateTokens.items()}
+        _, rankedIds, rankedScores = self.DICT_graph_rank_texts([text], iter,
+                                                                delta)
         # return dict mapping tokens to their ranked weights
-        return {reverseCandidateIdx[newId] : weight
-                for newId, weight in enumerate(convergedWeights)}
+        with self.instrument.stage('results'):
+            return dict(zip(rankedIds.tolist(), rankedScores.tolist()))
+
+    def DICT_graph_rank_texts(self, texts, iter, delta):
+        """
+        Ranks many texts at once. Candidate subgraphs of all texts are packed
+        into one block-diagonal sparse matrix so ranking runs as a single
+        vectorized propagation over the whole batch.
+        Args:
+            texts:      Iterable of raw text strings to tag
+            iter:       Number of iterations over which to approximate ranking
+            delta:      Initial score to assign shadow token candidates
+        Returns:
+            Tuple (offsets, ids, scores) of aligned arrays where ranked tokens
+            of text i are ids[offsets[i]:offsets[i+1]] with weights in scores
+        """
+        with self.instrument.stage('rank_texts'):
+            if self.textCache is None:
+                return self.rank_observed(self.observed_token_lists(texts),
+                                          iter, delta)
+            return self.cached_rank_texts(texts, iter, delta)
+
+    def rank_observed(self, observedLists, iter, delta):
+        """
+        Ranks candidate subgraphs built from list of observed token id lists
+        as in DICT_graph_rank_texts
+        """
+        (offsets, candidateIds, candidateTexts,
+         rows, cols, vals, weights) = self.candidate_subgraphs(observedLists,
+                                                               delta)
+        textNum = len(offsets) - 1
+        # approximate graph ranking over miniCorr blocks for iter iterations,
+        # where ZERO_BOOSTER fills every cell of each dense block
+        with self.instrument.stage('propagate'):
+            for _ in range(iter):
+                weights = (coo_matvec(rows, cols, vals, weights)
+                           + (ZERO_BOOSTER
+                              * block_sums(weights, candidateTexts, textNum)))
+        return offsets, candidateIds, weights
+
+    def cached_rank_texts(self, texts, iter, delta):
+        """
+        Ranks texts as in DICT_graph_rank_texts, serving repeated texts from
+        textCache and repeated sets of observed tokens from subgraphCache and
+        only ranking the rest as a batch
+        """
+        texts = list(texts)
+        rankings = [None] * len(texts)
+        missLocs, missObserved, missKeys = [], [], []
+        for loc, text in enumerate(texts):
+            cleanText, wordNum = self.tokenizer.normalize(text)
+            textHash = hashlib.blake2b(cleanText.encode('utf-8'),
+                                       digest_size=16).digest()
+            # text rankings depend on token scoring, while subgraph rankings
+            # depend only on observed ids
+            textKey = (textHash, self.tokenizer.scoreVersion, iter, delta)
+            ranking = self.textCache.get(textKey)
+            if ranking is None:
+                observed = self.top_observed(
+                        self.tokenizer.score_clean_tokens(cleanText, wordNum))
+                subgraphKey = (frozenset(observed), iter, delta)
+                ranking = self.subgraphCache.get(subgraphKey)
+                if ranking is None:
+                    missLocs.append(loc)
+                    missObserved.append(observed)
+                    missKeys.append((textKey, subgraphKey))
+                    continue
+                self.textCache.put(textKey, ranking)
+            rankings[loc] = ranking
+        if missObserved:
+            offsets, ids, scores = self.rank_observed(missObserved, iter, delta)
+            for i, (loc, (textKey, subgraphKey)) in enumerate(zip(missLocs,
+                                                                 missKeys)):
+                # copy so cached entries don't pin the whole batch in memory
+                ranking = (ids[offsets[i]:offsets[i + 1]].copy(),
+                           scores[offsets[i]:offsets[i + 1]].copy())
+                self.textCache.put(textKey, ranking)
+                self.subgraphCache.put(subgraphKey, ranking)
+                rankings[loc] = ranking
+        with self.instrument.stage('results'):
+            offsets = np.zeros(shape=(len(texts) + 1), dtype=np.int64)
+            np.cumsum([len(ranking[0]) for ranking in rankings],
+                      out=offsets[1:])
+            if not rankings:
+                return (offsets, np.zeros(shape=0, dtype=np.int64),
+                        np.zeros(shape=0, dtype=np.float64))
+            return (offsets,
+                    np.concatenate([ranking[0] for ranking in rankings]),
+                    np.concatenate([ranking[1] for ranking in rankings]))
+
+    def converge_rank_texts(self, texts, maxIter, minDelta, delta=0.001,
+                            damping=0.85):
+        """
+        Ranks many texts by damped power iteration over their candidate
+        subgraphs until the L1 change of each text's weights drops below
+        minDelta or maxIter iterations have run.
+        Args:
+            texts:      Iterable of raw text strings to tag
+            maxIter:    Max number of iterations to run
+            minDelta:   L1 change under which a text counts as converged
+            delta:      Initial score to assign shadow token candidates
+            damping:    Fraction of weight propagated along edges each step
+        Returns:
+            Tuple (offsets, ids, scores, iterations) where iterations holds
+            the number of iterations each text took to converge
+        """
+        (offsets, candidateIds, candidateTexts,
+         rows, cols, vals, weights) = self.candidate_subgraphs(
+                                    self.observed_token_lists(texts), delta)
+        matvec = lambda vec : coo_matvec(rows, cols, vals, vec)
+        with self.instrument.stage('propagate'):
+            weights, iterations = power_iterate(matvec, weights,
+                                                candidateTexts,
+                                                (len(offsets) - 1), maxIter,
+                                                minDelta, damping)
+        if self.instrument.enabled:
+            self.instrument.count('iterations', iterations)
+        return offsets, candidateIds, weights, iterations
+
+    def observed_token_lists(self, texts):
+        """
+        Returns list of observed token ids of every text in texts, capped as
+        in top_observed
+        """
+        return [self.top_observed(
+                        self.tokenizer.single_mechanically_score_tokens(text))
+                for text in texts]
+
+    def top_observed(self, tokenScores):
+        """
+        Returns list of ids of dict mapping observed token ids to mechanical
+        scores, keeping only the maxObserved highest scoring tokens, or
+        maxCandidates if maxObserved isn't set, in dict order
+        """
+        maxObserved = (self.expansion['maxObserved']
+                       or self.expansion['maxCandidates'])
+        if (maxObserved is None) or (len(tokenScores) <= maxObserved):
+            return list(tokenScores)
+        keptIds = set(nlargest(maxObserved, tokenScores, key=tokenScores.get))
+        return [tokenId for tokenId in tokenScores if tokenId in keptIds]
+
+    def candidate_subgraphs(self, observedLists, delta):
+        """
+        Builds candidate subgraphs of observed tokens and their related tokens
+        for every list of observed token ids in observedLists as blocks of one
+        block-diagonal sparse miniCorr, expanding and pruning candidates as
+        set by set_expansion.
+        Returns tuple (offsets, candidateIds, candidateTexts, rows, cols, vals,
+        weights) where candidates of text i span offsets[i]:offsets[i+1],
+        (rows, cols, vals) are COO arrays of miniCorr and weights are initial
+        candidate weights normed to unit sum within each text.
+        """
+        maxCandidates = self.expansion['maxCandidates']
+        minScore = self.expansion['minScore']
+        vocabSize = self.tokenizer.vocabSize
+        textNum = len(observedLists)
+        observedLens = [len(observed) for observed in observedLists]
+        with self.instrument.stage('candidates'):
+            observedIds = np.fromiter((token for observed in observedLists
+                                       for token in observed),
+                                      dtype=np.int64, count=sum(observedLens))
+            observedTexts = np.repeat(np.arange(textNum), observedLens)
+            # candidates are keyed by (text, token) so each text gets own block
+            observedKeys = observedTexts * vocabSize + observedIds
+            observedPriorities = np.full(shape=len(observedKeys),
+                                         fill_value=np.inf)
+            # expand frontier of newly added candidates one hop at a time
+            hopEdges = []
+            frontierKeys, hopWeight = observedKeys, 1.0
+            candidateKeys = np.unique(observedKeys)
+            for hop in range(self.expansion['hops']):
+                hopEdges.append(self.expand_keys(frontierKeys, hopWeight,
+                                                 minScore))
+                if (hop + 1 == self.expansion['hops']):
+                    break
+                # bound frontier by budget before gathering next hop
+                relatedKeys, edgeScores = hopEdges[-1][1:]
+                hopKeys = budget_keys(
+                            np.concatenate((candidateKeys, relatedKeys)),
+                            np.concatenate((np.full(shape=len(candidateKeys),
+                                                    fill_value=np.inf),
+                                            edgeScores)),
+                            vocabSize, maxCandidates)
+                frontierKeys = np.setdiff1d(hopKeys, candidateKeys,
+                                            assume_unique=True)
+                candidateKeys = hopKeys
+                hopWeight *= self.expansion['decay']
+            baseKeys, relatedKeys, edgeScores = (np.concatenate(part)
+                                                 for part in zip(*hopEdges))
+            # keep observed tokens and related tokens of highest edge score
+            candidateKeys = budget_keys(
+                                np.concatenate((observedKeys, relatedKeys)),
+                                np.concatenate((observedPriorities,
+                                                edgeScores)),
+                                vocabSize, maxCandidates)
+            candidateTexts = candidateKeys // vocabSize
+            candidateNum = len(candidateKeys)
+            offsets = np.searchsorted(candidateTexts, np.arange(textNum + 1))
+        with self.instrument.stage('subgraph'):
+            # drop edges to candidates cut by budget
+            baseLocs, baseFound = sorted_locs(candidateKeys, baseKeys)
+            relatedLocs, relatedFound = sorted_locs(candidateKeys,
+                                                    relatedKeys)
+            kept = baseFound & relatedFound
+            baseLocs, relatedLocs = baseLocs[kept], relatedLocs[kept]
+            edgeScores = edgeScores[kept]
+            # block-diagonal miniCorr pointers in both directions as COO arrays
+            rows = np.concatenate((baseLocs, relatedLocs))
+            cols = np.concatenate((relatedLocs, baseLocs))
+            vals = np.concatenate((edgeScores, edgeScores)).astype(np.float64)
+            # build initial weight vector of all candidate tokens
+            rawWeights = np.tile([delta], reps=candidateNum)
+            # update weights of those tokens actually present
+            rawWeights[np.searchsorted(candidateKeys, observedKeys)] += 1
+            # norm weight vector of each text to unit
+            textWeights = block_sums(rawWeights, candidateTexts, textNum)
+            weights = np.divide(rawWeights, (textWeights + ZERO_BOOSTER))
+        if self.instrument.enabled:
+            # sizes of each text's candidate set and miniCorr block
+            self.instrument.count('observed_tokens', observedLens)
+            self.instrument.count('subgraph_dim', np.diff(offsets))
+            self.instrument.count('subgraph_edges',
+                                  2 * np.bincount(candidateTexts[baseLocs],
+                                                  minlength=textNum))
+        return (offsets, (candidateKeys % vocabSize), candidateTexts,
+                rows, cols, vals, weights)
+
+    def expand_keys(self, keys, weight, minScore):
+        """
+        Gathers related tokens of every (text, token) key in keys. Returns
+        tuple (baseKeys, relatedKeys, scores) of edges tagged by text, with
+        scores multiplied by weight and edges scoring under minScore pruned.
+        """
+        vocabSize = self.tokenizer.vocabSize
+        tokenIds = keys % vocabSize
+        baseIds, relatedIds, scores = self.corrGraph.gather(tokenIds)
+        edgeTexts = np.repeat(keys // vocabSize,
+                              (self.corrGraph.indptr[tokenIds + 1]
+                               - self.corrGraph.indptr[tokenIds]))
+        scores = scores * weight if (weight != 1) else scores
+        if (minScore > 0):
+            kept = scores >= minScore
+            baseIds, relatedIds = baseIds[kept], relatedIds[kept]
+            edgeTexts, scores = edgeTexts[kept], scores[kept]
+        return ((edgeTexts * vocabSize + baseIds),
+                (edgeTexts * vocabSize + relatedIds), scores)
@@ -3,63 +3,178 @@ Implements Tokenizer() class for preprocessing and tokenizing raw-text and
 Language() class for storing metrics about the language used.
 """
 
-import re
+import os
 import pickle
+import numpy as np
 from tqdm import tqdm
 from numpy import log, mean
 from unidecode import unidecode
+from heapq import nlargest
+from itertools import repeat
+from functools import partial
 from collections import Counter
 from flashtext import KeywordProcessor
 
 import utils as utils
+import structs.ingest as ingest
+import structs.checkpoint as checkpoint
+from structs.stringTable import StringTable, StringIndex
+from structs.wikiReader import WikiReader
+from structs.instrument import NULL_INSTRUMENT
+from structs.heavyHitters import TokenSketch, sketch_params
+from structs.phraseAutomaton import PhraseAutomaton, greedy_matches
+
+# default location of wiki article csv
+WIKI_PATH = 'data/inData/wikiArticles.csv'
+# version of on-disk Tokenizer format written by save
+FORMAT_VERSION = 2
+# ascii chars replaced by a single space when cleaning text, including the
+# separators \x1c to \x1f that python counts as whitespace
+SPACE_CHARS = ' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f_.?!:;/<>*&^%$#@()"~`+-'
+# backends for finding tokens in cleaned text
+BACKENDS = ('unigram', 'flashtext')
+
+
+def build_clean_table(lower):
+    """
+    Builds str.translate table over ascii mapping alphanumeric chars to
+    themselves (lowercased if lower), SPACE_CHARS to a space, and deleting
+    every other char
+    """
+    cleanTable = {}
+    for code in range(128):
+        char = chr(code)
+        if char.isalnum():
+            cleanTable[code] = char.lower() if lower else char
+        elif char in SPACE_CHARS:
+            cleanTable[code] = ' '
+        else:
+            cleanTable[code] = None
+    return cleanTable
 
 
 class Tokenizer(object):
     """ Stores all methods for working with text """
     # base methods
-    def __init__(self, lower=True):
+    def __init__(self, lower=True, backend='unigram'):
         assert isinstance(lower, bool), ('lower expected type bool, but found '
                                         f'type {type(lower)}.')
+        assert (backend in BACKENDS), (f'backend must be one of {BACKENDS}, '\
+                                       f'but found {backend}.')
         self.lower = lower
+        self.backend = backend
         # low level attributes to be abstracted
         self.vocabSize  =   0
         self.freqDict   =   None
         self.idx        =   None
         self.reverseIdx =   None
-        self.tokenizer  =   KeywordProcessor()
+        self.tokenizer  =   None
+        # unigram fast path lookups, built with idx or on first use
+        self.wordIdx    =   None
+        self.freqs      =   None
+        self.phraseTokenizer = None
+        # automaton finding nested tokens, built on first use, and max words
+        # of nested tokens credited when scoring, where 0 credits none
+        self.phraseAutomaton = None
+        self.knowledgeChunkSize = 0
+        # bumped whenever token scoring changes, so rankings cached under an
+        # older version are never served
+        self.scoreVersion = 0
+        # corpus counts kept so freq stats can be updated incrementally
+        self.tokenStats =   None
+        self.termCounts =   None
+        self.docCounts  =   None
+        self.totalLength =  0
+        self.textCount  =   0
         # high level attribute to indicate initialization
         self.initialized = False
-        # matches non-alphanumeric, space, or sentence-ending punctuation
-        self.STRIP = re.compile(r'[^0-9a-zA-Z\t\n\s_.?!:;/<>*&^%$#@()"~`+-]')
-        # matches sequence of tabs, newlines, spaces, underscores, and dashes
-        self.SPACE = re.compile(r'[\t\n\s_.?!:;/<>*&^%$#@()"~`+-]+')
+        # translate table doing stripping, spacing and case folding at once
+        self.CLEAN_TABLE = build_clean_table(lower)
+        # stage timers and counters, which are no-ops unless set
+        self.instrument = NULL_INSTRUMENT
 
     def __str__(self):
         return (f'<Tokenizer Object: VOCAB_SIZE={self.vocabSize} | ' \
                 f'LOWER={self.lower}>')
 
     # save/load methods
-    def save(self, path):
-        """ Saves Tokenizer() to folder at path """
+    def save(self, path, overwrite=False):
+        """
+        Saves Tokenizer() to folder at path as versioned directory of flat
+        arrays. Vocab is stored as a string table ordered by idx, with the
+        hash slots of its StringIndex so loading needn't rebuild idx.
+        """
         assert isinstance(path, str), ('path expected type str, but found '\
                                         f'type {type(path)}.')
         assert self.initialized, 'Tokenizer must be initialized before saving.'
-        utils.safe_make_folder(path)
+        utils.make_folder(path, overwrite)
         # save neccessary attributes for lossless reconstruction
-        utils.save_obj(self.freqDict, f'{path}/freqDict')
-        utils.save_obj(self.idx, f'{path}/idx')
-        utils.save_obj(self.tokenizer, f'{path}/tokenizer')
-        with open(f'{path}/lower.sav', 'w+') as lowerFile:
-            lowerStr = 't' if self.lower else 'f'
-            lowerFile.write(lowerStr)
+        if isinstance(self.idx, StringIndex):
+            vocabIdx = self.idx
+        else:
+            vocabIdx = StringIndex.from_table(StringTable.from_list(
+                                                            self.vocab_list()))
+        vocabIdx.table.save(path, 'vocab')
+        vocabIdx.save(path, 'vocab')
+        if self.freqs is None:
+            self.build_freqs()
+        np.save(f'{path}/freqs.npy', np.asarray(self.freqs, dtype=np.float64))
+        if self.termCounts is not None:
+            np.save(f'{path}/termCounts.npy', self.termCounts)
+            np.save(f'{path}/docCounts.npy', self.docCounts)
+        utils.save_json({'format'               :   'Tokenizer',
+                         'version'              :   FORMAT_VERSION,
+                         'vocabSize'            :   len(vocabIdx),
+                         'lower'                :   self.lower,
+                         'knowledgeChunkSize'   :   self.knowledgeChunkSize,
+                         'totalLength'          :   self.totalLength,
+                         'textCount'            :   self.textCount},
+                        f'{path}/meta')
         return True
 
-    def load(self, path):
-        """ Loads Tokenizer() from folder at path """
+    def load(self, path, mmapMode='r'):
+        """
+        Loads Tokenizer() from folder at path. Arrays are memory-mapped with
+        mmapMode so separate processes share pages through the OS cache.
+        idx and freqDict look tokens up in the memory-mapped vocab through
+        its hash slots, and the lookups of the extraction backends are built
+        on first use, so loading does no per-token work.
+        """
         utils.path_exists(path)
         assert not self.initialized, ("Tokenizer file can't be loaded into an "\
                                         "initialized Tokenizer.")
+        if not os.path.exists(f'{path}/meta.json'):
+            return self.load_pickled(path)
+        meta = utils.load_json(f'{path}/meta')
+        assert (meta['version'] <= FORMAT_VERSION), ('Tokenizer format version'\
+                                                    f" {meta['version']} is "\
+                                                    'newer than supported.')
+        vocabTable = StringTable.load(path, 'vocab', mmapMode)
+        self.freqs = np.load(f'{path}/freqs.npy', mmap_mode=mmapMode)
+        # format 1 saved no hash slots, so they are built from vocab
+        if os.path.exists(f'{path}/vocabSlots.npy'):
+            self.idx = StringIndex.load(path, 'vocab', vocabTable,
+                                        mmapMode=mmapMode)
+        else:
+            self.idx = StringIndex.from_table(vocabTable)
+        self.freqDict = StringIndex(vocabTable, self.idx.slots, self.freqs)
+        self.reverseIdx = vocabTable
+        self.lower = meta['lower']
+        self.knowledgeChunkSize = meta.get('knowledgeChunkSize', 0)
+        self.CLEAN_TABLE = build_clean_table(self.lower)
+        self.vocabSize = len(vocabTable)
+        if os.path.exists(f'{path}/termCounts.npy'):
+            self.termCounts = np.load(f'{path}/termCounts.npy',
+                                      mmap_mode=mmapMode)
+            self.docCounts = np.load(f'{path}/docCounts.npy',
+                                     mmap_mode=mmapMode)
+            self.totalLength = meta['totalLength']
+            self.textCount = meta['textCount']
+        self.initialized = True
+        return True
 
+    def load_pickled(self, path):
+        """ Loads Tokenizer() from legacy folder of pickled attributes """
         # load pickled objects
         self.freqDict = utils.load_obj(f'{path}/freqDict')
         self.idx = utils.load_obj(f'{path}/idx')
@@ -68,41 +183,48 @@ class Tokenizer(object):
         with open(f'{path}/lower.sav', 'r') as lowerFile:
             lowerStr = lowerFile.read()
         self.lower = True if (lowerStr=='t') else False
+        self.CLEAN_TABLE = build_clean_table(self.lower)
         # extrapolate from loaded objects
         self.build_reverse_idx()
+        self.build_freqs()
+        self.build_unigram_idx()
         self.vocabSize = len(self.freqDict)
         self.initialized = True
         return True
 
     # common file iterators
-    def wiki_iterator(self, path='data/inData/wikiArticles.csv'):
-        """ Iterates over wiki csv, yielding raw article text """
-        with open(path, 'r') as wikiFile:
-            for line in wikiFile:
-                commaLoc = line.find(',')
-                articleText = line[commaLoc+3:-3]
-                yield articleText
+    def wiki_iterator(self, path=WIKI_PATH, start=0, end=None):
+        """
+        Iterates over wiki csv, yielding raw article text. If start or end are
+        given, only yields records beginning in the byte range [start, end).
+        """
+        return WikiReader(path).iter_texts(start, end)
 
     # methods for preprocessing text
     def to_lower(self, rawString):
         """ Lowercases string """
         return rawString.lower()
 
+    def normalize(self, rawString):
+        """
+        Cleans rawString in one pass by transliterating non-ascii chars,
+        replacing space and punctuation chars with a single space, removing
+        other non-alphanumeric chars, and lowercasing alpha chars. Returns
+        tuple of (cleanedString, wordCount).
+        """
+        with self.instrument.stage('clean'):
+            # ascii strings skip transliteration
+            if not rawString.isascii():
+                rawString = unidecode(rawString)
+            words = rawString.translate(self.CLEAN_TABLE).split()
+            return ' '.join(words), len(words)
+
     def clean(self, rawString):
         """
         Cleans rawString by replacing spaceMatcher and tagMatcher with a single
         space, removing non-alpha chars, and lowercasing alpha chars
         """
-        unicodedString = unidecode(rawString)
-        # replace STRIP Matcher with ""
-        cleanedString = re.sub(self.STRIP, "", rawString)
-        # replace SPACE Matcher with " " and strip surround whitespace
-        spacedString = re.sub(self.SPACE, " ", cleanedString)
-        # lowercase the alpha chars that remain
-        if self.lower:
-            return self.to_lower(spacedString)
-        else:
-            return spacedString
+        return self.normalize(rawString)[0]
 
     # methods for gathering language data
     def calc_tf_idf(self, termFreq, docFreq):
@@ -110,55 +232,144 @@ class Tokenizer(object):
         # DEBUG: TF IDF SEEMS OFF
         return 1 + log(termFreq * docFreq)
 
-    def freq_dict_from_file_iterator(self, iterator):
-        """ Builds freq dict from file iterator. Updates vocabSize """
+    def count_tokens(self, texts):
+        """
+        Counts token stats over iterable of raw texts. Returns tuple of
+        (tokenCounts, tokenAppearances, totalLength, textCount).
+        """
         # initialize counter to map tokens to raw number of occurences
         tokenCounts = Counter()
         # initialize counter to map tokens to number of docs they appear in
         tokenAppearances = Counter()
-        # initialize variable to count total number of words used
+        # initialize variables to count total number of words and texts used
         totalLength = 0
-        # get base count of article num for tqdm
-        articleCount = len([None for _ in iterator()])
-        # iterate over wiki file
-        for i, text in enumerate(tqdm(iterator(), total=articleCount)):
+        textCount = 0
+        for text in texts:
             # find tokens in text
             cleanText = self.clean(text)
             tokenList = cleanText.split()
             # count number of times each token appears
             currentCounts = Counter(tokenList)
-            # get total length of text
-            wordCount = len(tokenList)
             # add tokens counts to tokenCounts counter
             tokenCounts.update(currentCounts)
             # add single appearance for each token found
-            tokenAppearances.update(set(currentCounts))
+            tokenAppearances.update(currentCounts.keys())
             # add number of words in current file to totalLength
-            totalLength += wordCount
+            totalLength += len(tokenList)
+            textCount += 1
+        return tokenCounts, tokenAppearances, totalLength, textCount
+
+    def freq_dict_from_counts(self, tokenCounts, tokenAppearances,
+                              totalLength, textCount):
+        """ Builds freq dict from token stats. Updates vocabSize """
         # lambdas for calculating termFreq and docFreq
         calc_termFreq = lambda tokenCount : tokenCount / totalLength
-        calc_docFreq = lambda tokenAppearance : log(float(i) / tokenAppearance)
+        calc_docFreq = lambda tokenAppearance : log(float(textCount)
+                                                    / tokenAppearance)
         # use total num to norm tokenCounts and find frequency for each token
         freqDict = {token : self.calc_tf_idf(calc_termFreq(rawCount),
                             calc_docFreq(tokenAppearances[token]))
                     for token, rawCount in tokenCounts.items()}
-        meanScore = mean([elt for elt in freqDict.values()])
         self.freqDict = freqDict
         self.vocabSize = len(freqDict)
+        # keep raw counts until idx is built to align them with token ids
+        self.tokenStats = (tokenCounts, tokenAppearances)
+        self.totalLength = totalLength
+        self.textCount = textCount
         return True
 
+    def sketch_tokens(self, texts, sketchParams):
+        """
+        Counts token stats over iterable of raw texts into TokenSketch of
+        sketchParams (capacity, width, depth), keeping memory bounded no
+        matter how many distinct tokens texts hold
+        """
+        tokenSketch = TokenSketch(*sketchParams)
+        for text in texts:
+            tokenSketch.add_text(self.clean(text).split())
+        return tokenSketch
+
+    def freq_dict_from_file_iterator(self, iterator, memoryBytes=None,
+                                     errorRate=None):
+        """
+        Builds freq dict from file iterator. Updates vocabSize. If
+        memoryBytes or errorRate is given, counts are approximated by a
+        TokenSketch as in sketch_params, keeping only frequent tokens.
+        """
+        if (memoryBytes or errorRate):
+            tokenSketch = self.sketch_tokens(tqdm(iterator()),
+                                             sketch_params(memoryBytes,
+                                                           errorRate))
+            return self.freq_dict_from_counts(*tokenSketch.token_stats())
+        tokenStats = self.count_tokens(tqdm(iterator()))
+        return self.freq_dict_from_counts(*tokenStats)
+
+    def freq_dict_from_file(self, path=WIKI_PATH, workers=1,
+                            checkpointPath=None, memoryBytes=None,
+                            errorRate=None):
+        """
+        Builds freq dict from wiki file at path by sharding file across
+        workers processes and merging partial counts. Updates vocabSize. If
+        checkpointPath is given, counts of each chunk of file are saved there
+        as they finish and a rerun resumes from the last finished chunk. If
+        memoryBytes or errorRate is given, counts of each worker are bounded
+        TokenSketch summaries as in freq_dict_from_file_iterator.
+        """
+        if (memoryBytes or errorRate):
+            assert not checkpointPath, ('Checkpointed counts are exact and '\
+                                        "can't be bounded by memoryBytes or "\
+                                        'errorRate.')
+            if (workers == 1):
+                return self.freq_dict_from_file_iterator(
+                                        lambda : self.wiki_iterator(path),
+                                        memoryBytes, errorRate)
+            sketchParams = sketch_params(memoryBytes, errorRate)
+            tokenSketch = TokenSketch(*sketchParams)
+            shardResults = ingest.map_shards(partial(ingest.sketch_shard,
+                                                     sketchParams),
+                                             path, self, workers)
+            # merge bounded summaries from each shard
+            for shardSketch in tqdm(shardResults):
+                tokenSketch.merge(shardSketch)
+            return self.freq_dict_from_counts(*tokenSketch.token_stats())
+        if checkpointPath:
+            return self.freq_dict_from_counts(*checkpoint.checkpointed_counts(
+                                        self, path, checkpointPath, workers))
+        if (workers == 1):
+            return self.freq_dict_from_file_iterator(
+                                        lambda : self.wiki_iterator(path))
+        tokenCounts, tokenAppearances = Counter(), Counter()
+        totalLength, textCount = 0, 0
+        shardResults = ingest.map_shards(ingest.count_shard, path, self,
+                                         workers)
+        # reduce partial counts from each shard
+        for shardStats in tqdm(shardResults):
+            tokenCounts.update(shardStats[0])
+            tokenAppearances.update(shardStats[1])
+            totalLength += shardStats[2]
+            textCount += shardStats[3]
+        return self.freq_dict_from_counts(tokenCounts, tokenAppearances,
+                                          totalLength, textCount)
+
     def filter_freq_dict(self, minFreq=0, maxFreq=1, tokenNum=50000):
         """
-        Filters freq dict to tokenNum tokens between min and maxFreq. Updates
-        vocab size in conjunction.
+        Filters freq dict to the tokenNum highest scoring tokens between min
+        and maxFreq, with ties broken by dict order. Kept tokens stay in dict
+        order so ids built from them don't depend on scores. Updates vocab
+        size in conjunction.
         """
         assert (tokenNum > 0), f'Filtering to tokenNum={tokenNum} would result'\
                                 'in empty freqDict.'
         qualifies = lambda freq : (maxFreq > freq > minFreq)
+        keptTokens = set(token for token, _
+                         in nlargest(tokenNum,
+                                     ((token, freq) for token, freq
+                                      in self.freqDict.items()
+                                      if qualifies(freq)),
+                                     key=(lambda item : item[1])))
         filteredFreqDict = {token : freq
-                            for i, (token, freq)
-                            in enumerate(self.freqDict.items())
-                            if (qualifies(freq) and (i < tokenNum))}
+                            for token, freq in self.freqDict.items()
+                            if token in keptTokens}
         assert (filteredFreqDict != dict()), ('Filtering removed all elements '\
                                             'from freqDict. Try chaning min '\
                                             'or max frequency parameters.')
@@ -170,25 +381,160 @@ class Tokenizer(object):
     def build_tokenizer(self):
         """ Builds flashtext tokenizer from freq dict """
         assert (self.freqDict), f'freqDict must be built before tokenizer.'
+        if self.tokenizer is None:
+            self.tokenizer = KeywordProcessor()
         self.tokenizer.add_keywords_from_list(list(self.freqDict.keys()))
         return True
 
+    def extract_keywords(self, cleanText):
+        """
+        Returns list of tokens found in cleaned text by flashtext tokenizer,
+        building tokenizer on first use
+        """
+        if self.tokenizer is None:
+            self.build_tokenizer()
+        return self.tokenizer.extract_keywords(cleanText)
+
     # methods for idx modification
     def build_idx(self):
         assert (self.freqDict), f'freqDict must be built before idx.'
         self.idx = {word : i for i, word in enumerate(self.freqDict)}
+        if self.tokenStats:
+            self.build_count_arrays()
+        self.build_freqs()
+        self.build_unigram_idx()
+
+    def vocab_list(self):
+        """ Returns list of vocab tokens ordered by idx """
+        if isinstance(self.idx, StringIndex):
+            return self.idx.keys()
+        return sorted(self.idx, key=self.idx.get)
+
+    def build_freqs(self):
+        """ Builds freqs array of freqDict aligned with idx """
+        assert (self.idx), f'idx must be built before freqs.'
+        self.freqs = np.array([self.freqDict[token]
+                               for token in self.vocab_list()],
+                              dtype=np.float64)
+        return True
+
+    def build_unigram_idx(self):
+        """
+        Builds lookups of unigram backend from idx: wordIdx mapping each
+        lowered single-word token and each multi-word token to its id, and
+        flashtext phraseTokenizer holding only multi-word tokens, which is
+        None if all tokens are single words. Later tokens win lowered
+        collisions as they do in flashtext.
+        """
+        self.phraseAutomaton = None
+        if (self.backend != 'unigram'):
+            self.wordIdx, self.phraseTokenizer = None, None
+            return False
+        assert (self.idx), f'idx must be built before unigram idx.'
+        vocab = self.vocab_list()
+        self.wordIdx = {}
+        phrases = []
+        for i, token in enumerate(vocab):
+            if (' ' in token):
+                phrases.append(token)
+                self.wordIdx[token] = i
+            else:
+                self.wordIdx[token.lower()] = i
+        self.phraseTokenizer = None
+        if phrases:
+            self.phraseTokenizer = KeywordProcessor()
+            self.phraseTokenizer.add_keywords_from_list(phrases)
+        return True
+
+    def build_phrase_automaton(self):
+        """
+        Builds PhraseAutomaton of lowered tokens from idx, where later tokens
+        win lowered collisions, and freqs array aligned with idx if missing
+        """
+        assert (self.idx), f'idx must be built before phrase automaton.'
+        vocab = self.vocab_list()
+        if self.freqs is None:
+            self.build_freqs()
+        self.phraseAutomaton = PhraseAutomaton({token.lower() : i
+                                                for i, token
+                                                in enumerate(vocab)})
+        return True
+
+    def build_count_arrays(self):
+        """
+        Converts raw corpus counters into term and doc count arrays aligned
+        with idx, dropping counts of tokens outside vocab
+        """
+        assert (self.idx), f'idx must be built before count arrays.'
+        tokenCounts, tokenAppearances = self.tokenStats
+        vocab = self.vocab_list()
+        self.termCounts = np.array([tokenCounts[token] for token in vocab],
+                                   dtype=np.int64)
+        self.docCounts = np.array([tokenAppearances[token] for token in vocab],
+                                  dtype=np.int64)
+        self.tokenStats = None
+        return True
 
     def build_reverse_idx(self):
         assert (self.idx), f'idx must be built before reverse idx.'
         self.reverseIdx = {i : word for word, i in self.idx.items()}
 
+    # methods for incremental updates
+    def update_freq_stats(self, texts):
+        """
+        Folds token counts of iterable of new texts into persisted term and doc
+        counts of vocab tokens and refreshes freqDict. Vocab is unchanged.
+        """
+        assert (self.termCounts is not None), ('Tokenizer has no persisted '\
+                                               'counts to update.')
+        tokenCounts, tokenAppearances, totalLength, textCount = \
+                                                    self.count_tokens(texts)
+        # copy counts out of any read-only memory map before updating
+        self.termCounts = np.array(self.termCounts)
+        self.docCounts = np.array(self.docCounts)
+        for token, count in tokenCounts.items():
+            tokenId = self.idx.get(token)
+            if tokenId is not None:
+                self.termCounts[tokenId] += count
+                self.docCounts[tokenId] += tokenAppearances[token]
+        self.totalLength += totalLength
+        self.textCount += textCount
+        return self.refresh_freq_dict()
+
+    def refresh_freq_dict(self):
+        """
+        Recomputes freqDict of vocab tokens from term and doc counts. Tokens
+        never counted keep their current freq rather than an infinite one.
+        """
+        if self.freqs is None:
+            self.build_freqs()
+        freqs = np.array(self.freqs, dtype=np.float64)
+        counted = (self.termCounts > 0) & (self.docCounts > 0)
+        termFreqs = self.termCounts[counted] / self.totalLength
+        docFreqs = np.log(self.textCount / self.docCounts[counted])
+        freqs[counted] = self.calc_tf_idf(termFreqs, docFreqs)
+        self.freqs = freqs
+        if isinstance(self.idx, StringIndex):
+            self.freqDict = StringIndex(self.idx.table, self.idx.slots, freqs)
+        else:
+            self.freqDict = dict(zip(self.vocab_list(), freqs.tolist()))
+        self.scoreVersion += 1
+        return True
+
     # higher level initialization methods
-    def language_from_wiki_file(self, minFreq, maxFreq, tokenNum):
+    def language_from_wiki_file(self, minFreq, maxFreq, tokenNum,
+                                path=WIKI_PATH, workers=1,
+                                checkpointPath=None, memoryBytes=None,
+                                errorRate=None):
         """
         Builds freqDict, vocabSize, tokenizer, idx, and reverse idx from wiki
-        file. Takes tokenNum tokens between minFreq and maxFreq.
+        file. Takes tokenNum highest scoring tokens between minFreq and
+        maxFreq. Counting is resumable if checkpointPath is given, or bounded
+        in memory if memoryBytes or errorRate is given.
         """
-        self.freq_dict_from_file_iterator(iterator=self.wiki_iterator)
+        self.freq_dict_from_file(path=path, workers=workers,
+                                 checkpointPath=checkpointPath,
+                                 memoryBytes=memoryBytes, errorRate=errorRate)
         self.filter_freq_dict(minFreq, maxFreq, tokenNum)
         self.build_tokenizer()
         self.build_idx()
@@ -199,7 +545,55 @@ class Tokenizer(object):
     # tokenization methods
     def clean_and_tokenize(self, text):
         """ Returns Counter() of recognized tokens in raw text """
-        return Counter(self.tokenizer.extract_keywords(self.clean(text)))
+        return self.clean_and_count(text)[0]
+
+    def clean_and_count(self, text):
+        """
+        Returns tuple of Counter() of recognized tokens in raw text and number
+        of words in cleaned text
+        """
+        cleanText, wordCount = self.normalize(text)
+        with self.instrument.stage('extract'):
+            if (self.backend != 'unigram'):
+                tokenCounts = Counter(self.extract_keywords(cleanText))
+            else:
+                ids, counts = self.extract_ids(cleanText)
+                tokenCounts = Counter(dict(zip((self.reverseIdx[i]
+                                                for i in ids.tolist()),
+                                               counts.tolist())))
+        return tokenCounts, wordCount
+
+    def extract_ids(self, cleanText):
+        """
+        Finds tokens in cleaned text with unigram backend by looking up split
+        words in wordIdx, matching only multi-word tokens with flashtext.
+        Returns tuple (ids, counts) of int64 arrays of token ids found and
+        number of times each was found.
+        """
+        if self.wordIdx is None:
+            self.build_unigram_idx()
+        if not self.lower:
+            # flashtext matches case-insensitively
+            cleanText = cleanText.lower()
+        if self.phraseTokenizer is None:
+            wordCounts = Counter(cleanText.split())
+        else:
+            # phrases take precedence over words they span, as in flashtext
+            wordCounts = Counter()
+            prevEnd = 0
+            for phrase, start, end in self.phraseTokenizer.extract_keywords(
+                                                cleanText, span_info=True):
+                wordCounts.update(cleanText[prevEnd:start].split())
+                wordCounts[phrase] += 1
+                prevEnd = end
+            wordCounts.update(cleanText[prevEnd:].split())
+        wordNum = len(wordCounts)
+        ids = np.fromiter(map(self.wordIdx.get, wordCounts, repeat(-1)),
+                          dtype=np.int64, count=wordNum)
+        counts = np.fromiter(wordCounts.values(), dtype=np.int64,
+                             count=wordNum)
+        found = ids >= 0
+        return ids[found], counts[found]
 
     # mechanical token ranking in text
     def score_single_token(self, token, observedFreq):
@@ -209,45 +603,122 @@ class Tokenizer(object):
             return None
         return round(freqDiff, 4)
 
+    def set_knowledge(self, maxChunkSize=5):
+        """
+        Sets scoring of all texts, and so graph building and ranking, to
+        credit tokens nested in multi-word tokens of up to maxChunkSize words
+        as in KNOWLEDGE_mechanically_score_tokens. None or 0 turns it off.
+        Graphs must be built and ranked with the same setting, which is saved
+        with the tokenizer.
+        """
+        assert (not maxChunkSize) or (maxChunkSize > 0), ('maxChunkSize must '\
+                                    f'be positive, but found {maxChunkSize}.')
+        self.knowledgeChunkSize = maxChunkSize or 0
+        self.scoreVersion += 1
+        return True
+
     def single_mechanically_score_tokens(self, text):
         """
-        Ranks token scores in text using freqDict and assuming no subtokens
-        and converts token names to idx number
-        """
-        tokenCounts = self.clean_and_tokenize(text)
-        wordNum = len(text.split())
-        tokenScores =  {token : self.score_single_token(token,
-                                                        (count/wordNum))
-                        for token, count in tokenCounts.items()}
-        return {self.idx[token] : score for token, score in tokenScores.items()
-                if ((score != None) and (token in self.idx))}
-
-    # def KNOWLEDGE_mechanically_score_tokens(self, text, maxChunkSize=5):
-    #     """ Ranks tokenes according to freqDict and observed freq in text """
-    #     # find counter of greedy tokens in text
-    #     greedyTokens = self.clean_and_tokenize(test)
-    #     subTokens = Counter()
-    #     # iterate over greedy counter
-    #     for greedyToken, greedyCount in greedyTokens.items():
-    #         greedyWords = greedyToken.split()
-    #         wordNum = len(greedyWords)
-    #         # if multiple words in cur topToken, recursively look for sub tokens
-    #         if wordNum > 1:
-    #             # init chunk is 1 smaller than wordNum but capped at maxChunkSize
-    #             chunkSize = min(maxChunkSize, (wordNum - 1))
-    #             # iterate over greedy tokens, analyzing smaller chunks at a time
-    #             while chunkSize > 0:
-    #                 for i in range(wordNum):
-    #                     chunkWords = greedyWords[i : i+chunkSize]
-    #                     textChunk = ' '.join(chunkWords)
-    #                     # if the chunk is a token in the tokenizer,
-    #                     # add its count tokenCounts after norming by fraction
-    #                     # of larger token and multiplying by larger token's count
-    #                     # (becuase you're iterating over a set)
-    #                     if textChunk in knowledgeProcessor:
-    #                         subTokens.update({textChunk :
-    #                                             (greedyCount * (len(chunkWords)
-    #                                                             / wordNum))})
-    #                 chunkSize -= 1
-    #     greedyTokens.update(subTokens)
-    #     return greedyTokens
+        Ranks token scores in text using freqDict and assuming no subtokens,
+        unless set_knowledge is on, and converts token names to idx number
+        """
+        return self.score_clean_tokens(*self.normalize(text))
+
+    def score_clean_tokens(self, cleanText, wordNum):
+        """
+        Ranks token scores in already cleaned text of wordNum words and
+        converts token names to idx number
+        """
+        if self.knowledgeChunkSize:
+            return self.score_clean_knowledge(cleanText, wordNum,
+                                              self.knowledgeChunkSize)
+        if (self.backend == 'unigram'):
+            return self.score_clean_ids(cleanText, wordNum)
+        with self.instrument.stage('extract'):
+            tokenCounts = Counter(self.extract_keywords(cleanText))
+        with self.instrument.stage('score'):
+            tokenScores =  {token : self.score_single_token(token,
+                                                            (count/wordNum))
+                            for token, count in tokenCounts.items()}
+            return {self.idx[token] : score
+                    for token, score in tokenScores.items()
+                    if ((score != None) and (token in self.idx))}
+
+    def score_clean_ids(self, cleanText, wordNum):
+        """
+        Scores tokens in already cleaned text as in score_clean_tokens, using
+        unigram backend and scoring all found tokens at once
+        """
+        with self.instrument.stage('extract'):
+            ids, counts = self.extract_ids(cleanText)
+        with self.instrument.stage('score'):
+            return self.score_counts(ids, counts, wordNum)
+
+    def score_counts(self, ids, counts, wordNum):
+        """
+        Scores arrays of token ids and their counts in text of wordNum words
+        at once, returning dict mapping ids of tokens scoring above zero to
+        their scores
+        """
+        freqDiffs = self.calc_tf_idf((counts / max(wordNum, 1)), 1) \
+                    - self.freqs[ids]
+        scored = freqDiffs > 0
+        return dict(zip(ids[scored].tolist(),
+                        np.round(freqDiffs[scored], 4).tolist()))
+
+    def knowledge_counts(self, cleanText, maxChunkSize=5):
+        """
+        Counts tokens in cleaned text, crediting each greedy leftmost-longest
+        token match with one count and every token nested in a multi-word
+        greedy match, of at most maxChunkSize words, with the fraction of the
+        match's words it spans. All matches come from a single pass of the
+        phrase automaton. Returns tuple (ids, counts) of token ids found and
+        their float64 credited counts.
+        Each nested occurence is credited once. The chunk loops of the old
+        draft also credited the chunks truncated at the end of a greedy match
+        once per chunk size, so 'c' of greedy token 'a b c' got 1/3 at chunk
+        sizes 2 and 1. That double credit is intentionally dropped.
+        """
+        if self.phraseAutomaton is None:
+            self.build_phrase_automaton()
+        if not self.lower:
+            # tokens are matched case-insensitively, as in flashtext
+            cleanText = cleanText.lower()
+        words = cleanText.split()
+        starts, lengths, ids = self.phraseAutomaton.scan(words)
+        if (len(ids) == 0):
+            return ids, np.zeros(shape=0, dtype=np.float64)
+        picked, coverStarts, coverLengths = greedy_matches(starts, lengths,
+                                                           len(words))
+        # nested matches lie inside, and are shorter than, greedy match
+        # covering their first word
+        coverEnds = coverStarts[starts] + coverLengths[starts]
+        nested = ((lengths < coverLengths[starts])
+                  & (lengths <= maxChunkSize)
+                  & ((starts + lengths) <= coverEnds))
+        credits = np.zeros(shape=len(ids), dtype=np.float64)
+        credits[picked] = 1
+        credits[nested] = lengths[nested] / coverLengths[starts[nested]]
+        tokenIds, tokenLocs = np.unique(ids, return_inverse=True)
+        counts = np.bincount(tokenLocs, weights=credits,
+                             minlength=len(tokenIds))
+        found = counts > 0
+        return tokenIds[found], counts[found]
+
+    def KNOWLEDGE_mechanically_score_tokens(self, text, maxChunkSize=5):
+        """
+        Ranks tokens according to freqDict and observed freq in text, where
+        observed counts also credit tokens nested in multi-word tokens as in
+        knowledge_counts, and converts token names to idx number
+        """
+        return self.score_clean_knowledge(*self.normalize(text), maxChunkSize)
+
+    def score_clean_knowledge(self, cleanText, wordNum, maxChunkSize=5):
+        """
+        Scores tokens in already cleaned text as in
+        KNOWLEDGE_mechanically_score_tokens
+        """
+        with self.instrument.stage('extract'):
+            ids, counts = self.knowledge_counts(cleanText, maxChunkSize)
+        with self.instrument.stage('score'):
+            return self.score_counts(ids, counts, wordNum)
@@ -0,0 +1,213 @@
+"""
+Implements WikiReader() object for streaming article texts out of wiki csv
+files with large buffered reads and proper csv parsing, yielding single texts
+or batches, and sharding by byte offset using an on-disk index of records
+"""
+
+import os
+import csv
+import numpy as np
+
+import utils as utils
+
+# default number of bytes buffered per read
+BUFFER_SIZE = 2 ** 24
+# articles can be far longer than the default csv field size limit
+csv.field_size_limit(2 ** 31 - 1)
+
+
+def parse_record(lines, quoteNum):
+    """
+    Parses fields of csv record spanning lines, which hold quoteNum quote
+    chars in total. Single-line records whose only quotes wrap the last field
+    are split directly rather than through the csv parser. CRLF line ends are
+    read as in text mode, so texts spanning lines hold only LF.
+    """
+    if (len(lines) == 1) and (quoteNum == 2):
+        line = lines[0].rstrip('\r\n')
+        commaLoc = line.find(',')
+        if ((line[commaLoc + 1:commaLoc + 2] == '"') and line.endswith('"')
+                and (len(line) > commaLoc + 2)):
+            return [line[:commaLoc], line[commaLoc + 2:-1]]
+    lines = [(line[:-2] + '\n') if line.endswith('\r\n') else line
+             for line in lines]
+    return next(csv.reader(lines), [])
+
+
+def slice_text(line):
+    """
+    Returns text of raw record line of form id,"'text'" sliced straight out
+    of its bytes as parse_record would split it, or None if line has any
+    other form and needs the csv parser
+    """
+    if not line.endswith((b'\'"\n', b'\'"\r\n')):
+        return None
+    textEnd = len(line) - (4 if (line[-2] == 13) else 3)
+    commaLoc = line.find(b',')
+    textStart = commaLoc + 3
+    # first quote must open field right after comma and no other quote may
+    # come before the one closing it
+    if ((commaLoc < 0) or (textStart > textEnd)
+            or (line.find(b'"') != (commaLoc + 1)) or (line[commaLoc + 2] != 39)
+            or (line.find(b'"', textStart, textEnd) >= 0)):
+        return None
+    return line[textStart:textEnd].decode('utf-8')
+
+
+class WikiReader(object):
+    """
+    Reads wiki csv of (id, 'text') records, whose quoted text may span lines.
+    Byte offsets of record starts can be cached in an index file next to the
+    csv so readers seek straight to whole records and count records without
+    reading the csv.
+    """
+    def __init__(self, path, bufferSize=BUFFER_SIZE):
+        utils.path_exists(path)
+        self.path = path
+        self.bufferSize = bufferSize
+        self.indexPath = f'{path}.index.npy'
+        self.index = None
+
+    def __str__(self):
+        return f'<WikiReader Object: PATH={self.path}>'
+
+    def __len__(self):
+        """ Returns number of records, building index if needed """
+        return len(self.load_index(build=True)) - 1
+
+    # index methods
+    def index_is_fresh(self):
+        """ Returns whether index file exists and is newer than csv """
+        return (os.path.exists(self.indexPath)
+                and (os.path.getmtime(self.indexPath)
+                     >= os.path.getmtime(self.path)))
+
+    def build_index(self):
+        """
+        Scans csv once and saves array of byte offsets of every record
+        followed by file size
+        """
+        self.index = None
+        offsets = [offset for offset, _ in self.read_records(useIndex=False)]
+        offsets.append(os.path.getsize(self.path))
+        index = np.array(offsets, dtype=np.int64)
+        # write through temp file so readers never see partial index
+        tempPath = f'{self.path}.indexTemp.npy'
+        np.save(tempPath, index)
+        os.replace(tempPath, self.indexPath)
+        self.index = index
+        return True
+
+    def load_index(self, build=False):
+        """
+        Returns memory-mapped index if fresh, building it first if build is
+        set, or None otherwise
+        """
+        if self.index is None:
+            if self.index_is_fresh():
+                self.index = np.load(self.indexPath, mmap_mode='r')
+            elif build:
+                self.build_index()
+        return self.index
+
+    def shard(self, shardNum):
+        """
+        Splits csv into at most shardNum contiguous byte ranges of similar
+        size aligned to record starts, as list of (start, end) tuples
+        """
+        assert (shardNum > 0), ('shardNum must be positive, but found '\
+                                f'{shardNum}.')
+        index = self.load_index(build=True)
+        targets = (index[-1] * np.arange(shardNum + 1)) // shardNum
+        bounds = np.unique(index[np.searchsorted(index, targets)]).tolist()
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    # read methods
+    def align(self, wikiFile, start, index):
+        """
+        Seeks wikiFile to first record start at or after byte start, using
+        index if given and next line start otherwise. Returns aligned start.
+        """
+        if index is not None:
+            start = int(index[min(np.searchsorted(index, start),
+                                  (len(index) - 1))])
+        elif (start > 0):
+            wikiFile.seek(start - 1)
+            wikiFile.readline()
+            start = wikiFile.tell()
+        wikiFile.seek(start)
+        return start
+
+    def read_records(self, start=0, end=None, useIndex=True):
+        """
+        Yields tuples (offset, row) of byte offset and parsed fields of every
+        record beginning in byte range [start, end). start is aligned to the
+        next record start using index if fresh, else to the next line.
+        """
+        index = self.load_index() if useIndex else None
+        with open(self.path, 'rb', buffering=self.bufferSize) as wikiFile:
+            linePos = self.align(wikiFile, start, index)
+            recordPos = linePos
+            # lines of current record and count of quotes seen in them
+            lines, quoteNum = [], 0
+            for line in wikiFile:
+                if not lines:
+                    if (end is not None) and (linePos >= end):
+                        break
+                    recordPos = linePos
+                linePos += len(line)
+                lines.append(line.decode('utf-8'))
+                quoteNum += lines[-1].count('"')
+                # record ends at first line leaving its quotes balanced
+                if (quoteNum % 2 == 0):
+                    yield recordPos, parse_record(lines, quoteNum)
+                    lines, quoteNum = [], 0
+            if lines:
+                yield recordPos, parse_record(lines, quoteNum)
+
+    def iter_texts(self, start=0, end=None):
+        """
+        Yields raw article text of every record beginning in byte range
+        [start, end), stripping the quotes wrapping each text. Single-line
+        records are sliced straight out of their bytes as the old
+        [commaLoc+3:-3] slice did, and only the rest are parsed as in
+        read_records.
+        """
+        index = self.load_index()
+        with open(self.path, 'rb', buffering=self.bufferSize) as wikiFile:
+            linePos = self.align(wikiFile, start, index)
+            lines, quoteNum = [], 0
+            for line in wikiFile:
+                if not lines:
+                    if (end is not None) and (linePos >= end):
+                        break
+                    text = slice_text(line)
+                    if text is not None:
+                        linePos += len(line)
+                        yield text
+                        continue
+                linePos += len(line)
+                lines.append(line.decode('utf-8'))
+                quoteNum += lines[-1].count('"')
+                if (quoteNum % 2 == 0):
+                    row = parse_record(lines, quoteNum)
+                    if (len(row) > 1):
+                        yield row[1][1:-1]
+                    lines, quoteNum = [], 0
+            if lines:
+                row = parse_record(lines, quoteNum)
+                if (len(row) > 1):
+                    yield row[1][1:-1]
+
+    def iter_batches(self, batchSize, start=0, end=None):
+        """ Yields lists of up to batchSize texts as in iter_texts """
+        assert (batchSize > 0), ('batchSize must be positive, but found '\
+                                 f'{batchSize}.')
+        batch = []
+        for text in self.iter_texts(start, end):
+            batch.append(text)
+            if (len(batch) >= batchSize):
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,78 @@
+"""
+Shared setup of tests, which run from repo root with python -m pytest
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+
+# modules import each other relative to repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structs.tokenizer import Tokenizer
+from structs.tokengraph import TokenGraph
+
+
+def toy_texts(textNum=60, wordNum=40, minLength=8, maxLength=30, seed=0):
+    """
+    Returns textNum texts of words w0 to w{wordNum - 1} drawn with Zipf
+    frequencies, so common words appear in most texts and rare ones in few
+    """
+    rng = np.random.default_rng(seed)
+    probs = 1.0 / np.arange(1, wordNum + 1)
+    probs /= probs.sum()
+    return [' '.join(f'w{i}' for i in rng.choice(wordNum, size=length,
+                                                 p=probs))
+            for length in rng.integers(minLength, maxLength + 1, textNum)]
+
+
+def toy_tokenizer(texts, phrases=(), backend='unigram', lower=True):
+    """
+    Builds initialized Tokenizer of all words of texts appearing in some but
+    not all texts, plus multi-word phrases scored as the mean of their words
+    """
+    tokenizer = Tokenizer(lower=lower, backend=backend)
+    # words in every text get infinite freqs, which filtering drops
+    with np.errstate(divide='ignore'):
+        tokenizer.freq_dict_from_file_iterator(lambda : iter(texts))
+    tokenizer.filter_freq_dict(-np.inf, np.inf, 10 ** 6)
+    for phrase in phrases:
+        tokenizer.freqDict[phrase] = np.mean([tokenizer.freqDict[word]
+                                              for word in phrase.split()])
+    tokenizer.vocabSize = len(tokenizer.freqDict)
+    tokenizer.build_tokenizer()
+    tokenizer.build_idx()
+    tokenizer.build_reverse_idx()
+    tokenizer.initialized = True
+    return tokenizer
+
+
+@pytest.fixture
+def texts():
+    return toy_texts()
+
+
+@pytest.fixture
+def tokenizer(texts):
+    return toy_tokenizer(texts)
+
+
+@pytest.fixture
+def graph(tokenizer, texts):
+    graphObj = TokenGraph(tokenizer)
+    graphObj.build_corr_matrix_from_iterator(lambda : iter(texts), 5)
+    return graphObj
+
+
+def write_wiki(path, texts):
+    """ Writes texts to wiki csv at path as records of form id,"'text'" """
+    with open(path, 'w') as wikiFile:
+        for i, text in enumerate(texts):
+            wikiFile.write(f'{i},"\'{text}\'"\n')
+    return str(path)
+
+
+@pytest.fixture
+def wikiPath(tmp_path, texts):
+    return write_wiki(tmp_path / 'wiki.csv', texts)
@@ -0,0 +1,43 @@
+"""
+Smoke tests benchmark harness on a tiny synthetic corpus
+"""
+
+import copy
+import numpy as np
+
+from benchmarks import bench
+
+
+def test_zipf_corpus_is_seeded():
+    texts = bench.zipf_corpus(50, 10, minLength=5, maxLength=9, seed=3)
+    assert (texts == bench.zipf_corpus(50, 10, minLength=5, maxLength=9,
+                                       seed=3))
+    assert all(5 <= len(text.split()) <= 9 for text in texts)
+
+
+def test_run_case_times_every_stage():
+    results = bench.run_case(vocabSize=200, neighbors=[3], textNum=40,
+                             queryNum=5, rankIter=2, delta=0.001, repeat=1,
+                             seed=0)
+    for stage in ('build_tokenizer', 'clean', 'score_tokens'):
+        assert (results[stage]['calls'] > 0)
+    for stage in ('build_corr_matrix', 'top_n_csr', 'rank_text',
+                  'rank_texts'):
+        assert (results['n=3'][stage]['calls'] > 0)
+    assert (results['n=3']['edges'] > 0)
+
+
+def test_compare_flags_only_regressions():
+    current = {'cases' : {'vocab=10' : {
+                    'clean' : bench.summarize([0.001] * 10),
+                    'n=5' : {'rank_text' : bench.summarize([0.002] * 10)}}}}
+    assert (bench.compare(current, current, 0.1) == [])
+    slower = copy.deepcopy(current)
+    slower['cases']['vocab=10']['n=5']['rank_text'] = bench.summarize(
+                                                            [0.004] * 10)
+    regressions = bench.compare(slower, current, 0.1)
+    assert ({(case, stage, metric)
+             for case, stage, metric, _ in regressions}
+            == {('vocab=10/n=5', 'rank_text', metric)
+                for metric in bench.COMPARED_METRICS})
+    assert np.isclose(regressions[0][3], 0.5)
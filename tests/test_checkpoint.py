@@ -0,0 +1,55 @@
+"""
+Tests checkpointed corpus processing against uncheckpointed builds
+"""
+
+import numpy as np
+
+import utils as utils
+from structs.tokenizer import Tokenizer
+from structs.tokengraph import TokenGraph
+from structs.checkpoint import checkpointed_counts, checkpointed_corr
+
+
+def drop_completed(checkpointPath):
+    """ Marks every other finished chunk of checkpoint as unfinished """
+    manifest = utils.load_json(f'{checkpointPath}/manifest')
+    manifest['completed'] = {chunkId : info for chunkId, info
+                             in manifest['completed'].items()
+                             if (int(chunkId) % 2)}
+    utils.save_json(manifest, f'{checkpointPath}/manifest')
+
+
+def test_checkpointed_counts_match_serial(texts, wikiPath, tmp_path):
+    tokenizer = Tokenizer()
+    expected = tokenizer.count_tokens(texts)
+    checkpointPath = str(tmp_path / 'checkpoint')
+    stats = checkpointed_counts(tokenizer, wikiPath, checkpointPath,
+                                chunkBytes=300)
+    assert (stats == expected)
+    # merged counts keep first-appearance order of tokens
+    assert (list(stats[0]) == list(expected[0]))
+    # resuming redoes only unfinished chunks
+    drop_completed(f'{checkpointPath}/counts')
+    assert (checkpointed_counts(tokenizer, wikiPath, checkpointPath,
+                                chunkBytes=300) == expected)
+
+
+def test_checkpointed_corr_matches_serial(graph, wikiPath, tmp_path):
+    checkpointPath = str(tmp_path / 'checkpoint')
+    checkpointed = TokenGraph(graph.tokenizer)
+    checkpointed.corr_dict_from_accumulator(
+            checkpointed_corr(graph.tokenizer, wikiPath, checkpointPath,
+                              chunkBytes=300), 5)
+    drop_completed(f'{checkpointPath}/corr')
+    resumed = TokenGraph(graph.tokenizer)
+    resumed.corr_dict_from_accumulator(
+            checkpointed_corr(graph.tokenizer, wikiPath, checkpointPath,
+                              chunkBytes=300), 5)
+    for built in (checkpointed, resumed):
+        # chunks sum scores in a different order, so match within tolerance
+        assert np.array_equal(built.corrCounts.indptr,
+                              graph.corrCounts.indptr)
+        assert np.array_equal(built.corrCounts.indices,
+                              graph.corrCounts.indices)
+        assert np.allclose(built.corrCounts.scores, graph.corrCounts.scores,
+                           rtol=1e-5)
@@ -0,0 +1,70 @@
+"""
+Tests CorrAccumulator() against the dense cooccurrence matrix of the original
+build_corr_matrix_from_iterator
+"""
+
+import numpy as np
+
+from structs.corrAccumulator import CorrAccumulator
+
+
+def dense_corr(tokenizer, texts):
+    """ Sums outer products of token scores of texts as the original loop """
+    vocabSize = tokenizer.vocabSize
+    corrMatrix = np.zeros(shape=(vocabSize, vocabSize), dtype=np.float32)
+    for text in texts:
+        tokenScores = tokenizer.single_mechanically_score_tokens(text)
+        for id, score in tokenScores.items():
+            for relId, relScore in tokenScores.items():
+                corrMatrix[id, relId] += (score * relScore)
+    return corrMatrix
+
+
+def csr_to_dense(indptr, indices, data, vocabSize):
+    matrix = np.zeros(shape=(vocabSize, vocabSize), dtype=np.float32)
+    rows = np.repeat(np.arange(vocabSize), np.diff(indptr))
+    matrix[rows, indices] = data
+    return matrix
+
+
+def test_accumulator_matches_dense(tokenizer, texts):
+    expected = dense_corr(tokenizer, texts)
+    # tiny batches force a flush every few texts and many run merges
+    for batchSize in (1, 50, 2000000):
+        corrAccumulator = CorrAccumulator(tokenizer.vocabSize, batchSize)
+        for text in texts:
+            corrAccumulator.add_scores(
+                        tokenizer.single_mechanically_score_tokens(text))
+            runSizes = np.array(corrAccumulator.runSizes)
+            assert (runSizes[:-1] > (2 * runSizes[1:])).all()
+        indptr, indices, data = corrAccumulator.to_csr()
+        assert (np.diff(indptr) >= 0).all()
+        assert np.allclose(csr_to_dense(indptr, indices, data,
+                                        tokenizer.vocabSize),
+                           expected, rtol=1e-5, atol=1e-6)
+
+
+def test_merges_match_dense(tokenizer, texts):
+    half = len(texts) // 2
+    expected = dense_corr(tokenizer, texts)
+    firstAccumulator = CorrAccumulator(tokenizer.vocabSize, batchSize=20)
+    secondAccumulator = CorrAccumulator(tokenizer.vocabSize, batchSize=20)
+    for text in texts[:half]:
+        firstAccumulator.add_scores(
+                        tokenizer.single_mechanically_score_tokens(text))
+    for text in texts[half:]:
+        secondAccumulator.add_scores(
+                        tokenizer.single_mechanically_score_tokens(text))
+    # shards merge as COO runs and persisted counts merge as CSR arrays
+    mergedAccumulator = CorrAccumulator(tokenizer.vocabSize, batchSize=20)
+    mergedAccumulator.merge_coo(*firstAccumulator.merged())
+    mergedAccumulator.merge_csr(*secondAccumulator.to_csr())
+    assert np.allclose(csr_to_dense(*mergedAccumulator.to_csr(),
+                                    tokenizer.vocabSize),
+                       expected, rtol=1e-5, atol=1e-6)
+
+
+def test_empty_accumulator():
+    indptr, indices, data = CorrAccumulator(4).to_csr()
+    assert (indptr.tolist() == [0, 0, 0, 0, 0])
+    assert (len(indices) == len(data) == 0)
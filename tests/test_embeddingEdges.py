@@ -0,0 +1,123 @@
+"""
+Tests embedding edge kernels against brute-force cosine similarity and
+dense blending of edge scores
+"""
+
+import numpy as np
+from scipy.sparse import random as sparse_random
+
+from structs.neighborGraph import NeighborGraph, top_n_csr
+from structs.embeddingEdges import (blend_graphs, top_n_cosine, top_n_lsh,
+                                    top_n_rows)
+
+
+def csr_rows(indptr, ids, scores):
+    """ Returns list of (id, score) lists of every row of CSR arrays """
+    return [list(zip(ids[start:end].tolist(), scores[start:end].tolist()))
+            for start, end in zip(indptr[:-1], indptr[1:])]
+
+
+def assert_rows_match(rows, expectedRows):
+    assert (len(rows) == len(expectedRows))
+    for row, expected in zip(rows, expectedRows):
+        assert ([i for i, _ in row] == [i for i, _ in expected])
+        assert np.allclose([s for _, s in row], [s for _, s in expected],
+                           atol=1e-6)
+
+
+def brute_force_cosine(embeddings, n):
+    """
+    Returns rows of top n positive cosine similarities of every embedding to
+    the others, found with argsort and scaled to unit sum
+    """
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    units = embeddings / np.where((norms == 0), 1, norms)
+    sims = units @ units.T
+    np.fill_diagonal(sims, 0)
+    rows = []
+    for rowSims in sims:
+        topIds = [i for i in np.argsort(-rowSims, kind='stable')[:n]
+                  if rowSims[i] > 0]
+        rowSum = rowSims[topIds].sum()
+        rows.append([(i, rowSims[i] / rowSum) for i in topIds])
+    return rows
+
+
+def test_top_n_cosine_matches_brute_force():
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal(size=(40, 8)).astype(np.float32)
+    embeddings[7] = 0
+    for n, blockRows in ((1, None), (5, 3), (50, 7)):
+        rows = csr_rows(*top_n_cosine(embeddings, n, blockRows))
+        assert_rows_match(rows, brute_force_cosine(embeddings, n))
+    assert (rows[7] == [])
+
+
+def test_top_n_rows_matches_python():
+    matrix = sparse_random(20, 20, density=0.4, format='csr',
+                           dtype=np.float32, random_state=5)
+    rows = csr_rows(*top_n_rows(matrix.indptr, matrix.indices, matrix.data,
+                                3))
+    expectedRows = []
+    for row in matrix.toarray():
+        nonzero = [(i, val) for i, val in enumerate(row.tolist()) if val > 0]
+        expectedRows.append(sorted(nonzero, key=lambda x : -x[1])[:3])
+    assert_rows_match(rows, expectedRows)
+
+
+def test_lsh_recalls_planted_neighbors():
+    # clusters of 5 noisy copies of random centers, whose true neighbors
+    # are the other copies of their center
+    rng = np.random.default_rng(1)
+    centers = rng.standard_normal(size=(60, 32))
+    embeddings = (np.repeat(centers, 5, axis=0)
+                  + (0.05 * rng.standard_normal(size=(300, 32))))
+    indptr, ids, scores = top_n_lsh(embeddings, 4, tables=8, bits=8)
+    found = planted = 0
+    for tokenId, row in enumerate(csr_rows(indptr, ids, scores)):
+        mates = set(range((tokenId // 5) * 5, (tokenId // 5 + 1) * 5))
+        mates.discard(tokenId)
+        found += len(mates & {i for i, _ in row})
+        planted += len(mates)
+        if row:
+            assert np.isclose(sum(s for _, s in row), 1, atol=1e-6)
+    assert ((found / planted) >= 0.95)
+    # nearest neighbors found are mostly the exact nearest neighbors
+    rows = csr_rows(indptr, ids, scores)
+    exactRows = brute_force_cosine(embeddings, 4)
+    hits = sum((rows[tokenId][0][0] == exactRows[tokenId][0][0])
+               for tokenId in range(300) if rows[tokenId])
+    assert (hits >= 270)
+
+
+def dense_scores(graph):
+    """ Returns dense matrix of decoded edge scores of graph """
+    matrix = np.zeros(shape=(len(graph), len(graph)))
+    for tokenId in range(len(graph)):
+        relatedIds, relatedScores = graph[tokenId]
+        matrix[tokenId, relatedIds] = relatedScores
+    return matrix
+
+
+def test_blend_matches_dense_weighted_sum():
+    graphs = [NeighborGraph(*top_n_csr(matrix.indptr.astype(np.int64),
+                                       matrix.indices, matrix.data, 6))
+              for matrix in (sparse_random(30, 30, density=0.3,
+                                           format='csr', dtype=np.float32,
+                                           random_state=seed)
+                             for seed in (6, 7))]
+    graph, otherGraph = graphs
+    for weight in (0, 0.3, 1):
+        blended = dense_scores(blend_graphs(graph, otherGraph, weight, 4))
+        expected = (((1 - weight) * dense_scores(graph))
+                    + (weight * dense_scores(otherGraph)))
+        for row, expectedRow in zip(blended, expected):
+            keptIds = np.flatnonzero(row)
+            assert (len(keptIds) == min(4, np.count_nonzero(expectedRow)))
+            assert np.allclose(row[keptIds], expectedRow[keptIds], atol=1e-6)
+            # kept edges are the highest scores of the weighted sum
+            assert (row[keptIds].min()
+                    >= np.sort(expectedRow)[-len(keptIds)] - 1e-6)
+    # zero weight keeps the top edges of graph unchanged
+    assert np.allclose(dense_scores(blend_graphs(graph, otherGraph, 0, 6)),
+                       dense_scores(graph), atol=1e-6)
@@ -0,0 +1,85 @@
+"""
+Tests streaming token summaries against exact python counts
+"""
+
+import numpy as np
+from collections import Counter
+
+from conftest import toy_texts
+from structs.tokenizer import Tokenizer
+from structs.heavyHitters import MisraGries, CountMinSketch, TokenSketch
+
+
+def toy_token_lists(textNum=200, seed=0):
+    return [text.split() for text in toy_texts(textNum=textNum, wordNum=300,
+                                               seed=seed)]
+
+
+def test_misra_gries_bounds():
+    tokenLists = toy_token_lists()
+    trueCounts = Counter(token for tokens in tokenLists for token in tokens)
+    summary, firstHalf, secondHalf = MisraGries(20), MisraGries(20), \
+                                     MisraGries(20)
+    for i, tokens in enumerate(tokenLists):
+        summary.update(Counter(tokens))
+        (firstHalf if (i % 2) else secondHalf).update(Counter(tokens))
+    firstHalf.merge(secondHalf)
+    total = sum(trueCounts.values())
+    for counted in (summary, firstHalf):
+        counted.prune()
+        assert (len(counted) <= 20)
+        assert (counted.total == total)
+        assert (counted.decrement <= total / 21)
+        for token, count in trueCounts.items():
+            assert ((count - counted.decrement) <= counted.counts[token]
+                    <= count)
+
+
+def test_count_min_bounds_and_merge():
+    tokenLists = toy_token_lists()
+    docCounts = Counter(token for tokens in tokenLists
+                        for token in set(tokens))
+    sketch, otherSketch = CountMinSketch(64, 4, batchSize=50), \
+                          CountMinSketch(64, 4, batchSize=50)
+    for i, tokens in enumerate(tokenLists):
+        (sketch if (i % 2) else otherSketch).add(set(tokens))
+    sketch.merge(otherSketch)
+    wholeSketch = CountMinSketch(64, 4)
+    for tokens in tokenLists:
+        wholeSketch.add(set(tokens))
+    wholeSketch.flush()
+    assert (sketch.table.dtype == np.uint64)
+    assert np.array_equal(sketch.table, wholeSketch.table)
+    tokens = list(docCounts)
+    estimates = sketch.query(tokens)
+    trueCounts = np.array([docCounts[token] for token in tokens])
+    assert (estimates >= trueCounts).all()
+    assert (sketch.total == trueCounts.sum())
+
+
+def test_token_sketch_holds_exact_counts_when_large():
+    tokenLists = toy_token_lists(textNum=50)
+    tokenizer = Tokenizer()
+    expected = tokenizer.count_tokens(' '.join(tokens)
+                                      for tokens in tokenLists)
+    tokenSketch = TokenSketch(capacity=1000, width=(2 ** 16), depth=3)
+    for tokens in tokenLists:
+        tokenSketch.add_text(tokens)
+    assert (tokenSketch.token_stats() == expected)
+    assert (tokenSketch.error_bounds()[0] == 0)
+
+
+def test_filter_freq_dict_keeps_top_tokens_in_order():
+    tokenizer = Tokenizer()
+    freqDict = {f't{i}' : freq for i, freq
+                in enumerate([0.3, -2.0, 0.9, 0.1, 0.9, 0.5, 5.0, 0.7])}
+    tokenizer.freqDict = dict(freqDict)
+    tokenizer.filter_freq_dict(minFreq=0, maxFreq=1, tokenNum=3)
+    # python top 3 of qualifying freqs, ties broken by dict order
+    qualifying = [(token, freq) for token, freq in freqDict.items()
+                  if (1 > freq > 0)]
+    kept = set(token for token, _ in sorted(qualifying,
+                                            key=lambda x : -x[1])[:3])
+    assert (list(tokenizer.freqDict)
+            == [token for token in freqDict if token in kept])
+    assert (tokenizer.vocabSize == 3)
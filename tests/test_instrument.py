@@ -0,0 +1,55 @@
+"""
+Tests Instrument() sinks and stage instrumentation of ranking
+"""
+
+import numpy as np
+from bisect import bisect_left
+
+from structs.instrument import (Instrument, HistogramSink, PrometheusSink,
+                                NULL_INSTRUMENT)
+
+
+def test_histogram_matches_python_buckets():
+    bounds = [1.0, 2.0, 4.0]
+    values = [0.5, 1.0, 1.5, 4.0, 9.0, 2.0]
+    sink = HistogramSink(countBounds=bounds)
+    # scalars and arrays bucket alike
+    for value in values[:3]:
+        sink.observe('count', 'size', value)
+    sink.observe('count', 'size', np.array(values[3:]))
+    expected = [0] * (len(bounds) + 1)
+    for value in values:
+        expected[bisect_left(bounds, value)] += 1
+    bucketCounts, count, total, minValue, maxValue = \
+                                            sink.histograms[('count', 'size')]
+    assert (bucketCounts.tolist() == expected)
+    assert ((count, total, minValue, maxValue)
+            == (len(values), sum(values), min(values), max(values)))
+    assert (sink.quantile('count', 'size', 0.5) == 2.0)
+    assert (sink.quantile('count', 'size', 1.0) == 9.0)
+
+
+def test_prometheus_buckets_are_cumulative():
+    sink = PrometheusSink(prefix='tg', countBounds=[1.0, 2.0])
+    sink.observe('count', 'size', np.array([1.0, 2.0, 3.0]))
+    lines = sink.render().splitlines()
+    assert ('tg_size_bucket{le="1"} 1' in lines)
+    assert ('tg_size_bucket{le="2"} 2' in lines)
+    assert ('tg_size_bucket{le="+Inf"} 3' in lines)
+    assert ('tg_size_count 3' in lines)
+
+
+def test_instrumented_ranking_is_unchanged(graph, texts):
+    expected = graph.DICT_graph_rank_texts(texts[:10], 2, 0.001)
+    sink = HistogramSink()
+    graph.set_instrument(Instrument([sink]))
+    ranked = graph.DICT_graph_rank_texts(texts[:10], 2, 0.001)
+    for array, expectedArray in zip(ranked, expected):
+        assert np.array_equal(array, expectedArray)
+    summary = sink.summary()
+    for stage in ('clean', 'extract', 'score', 'candidates', 'propagate',
+                  'rank_texts'):
+        assert (summary['timer'][stage]['count'] > 0)
+    assert (summary['count']['observed_tokens']['count'] == 10)
+    graph.set_instrument(None)
+    assert (graph.tokenizer.instrument is NULL_INSTRUMENT)
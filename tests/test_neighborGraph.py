@@ -0,0 +1,166 @@
+"""
+Tests NeighborGraph() and its top n kernels against plain python versions on
+toy inputs
+"""
+
+import numpy as np
+from scipy.sparse import random as sparse_random
+
+from structs.neighborGraph import NeighborGraph, top_n_csr, top_n_dense
+
+
+def python_top_n(rowVals, n):
+    """
+    Returns list of (id, score) of top n nonzero scores of row normed to unit
+    sum, by descending score with ties broken by id
+    """
+    rowSum = sum(rowVals)
+    if (rowSum == 0):
+        return []
+    normed = [(i, val / rowSum) for i, val in enumerate(rowVals) if val > 0]
+    return sorted(normed, key=lambda x : (-x[1], x[0]))[:n]
+
+
+def csr_rows(indptr, ids, scores):
+    """ Returns list of (id, score) lists of every row of CSR arrays """
+    return [list(zip(ids[start:end].tolist(), scores[start:end].tolist()))
+            for start, end in zip(indptr[:-1], indptr[1:])]
+
+
+def assert_rows_match(rows, expectedRows):
+    assert (len(rows) == len(expectedRows))
+    for row, expected in zip(rows, expectedRows):
+        assert ([i for i, _ in row] == [i for i, _ in expected])
+        assert np.allclose([s for _, s in row], [s for _, s in expected],
+                           atol=1e-6)
+
+
+def test_top_n_csr_matches_python():
+    matrix = sparse_random(40, 30, density=0.3, format='csr',
+                           dtype=np.float32, random_state=0)
+    for n in (1, 3, 30):
+        rows = csr_rows(*top_n_csr(matrix.indptr.astype(np.int64),
+                                   matrix.indices, matrix.data, n))
+        assert_rows_match(rows, [python_top_n(row.tolist(), n)
+                                 for row in matrix.toarray()])
+
+
+def test_top_n_csr_small_blocks(monkeypatch):
+    # rows of differing lengths spread over many padded blocks
+    monkeypatch.setattr('structs.neighborGraph.BLOCK_CELLS', 16)
+    matrix = sparse_random(25, 20, density=0.4, format='csr',
+                           dtype=np.float32, random_state=1)
+    rows = csr_rows(*top_n_csr(matrix.indptr.astype(np.int64),
+                               matrix.indices, matrix.data, 4))
+    assert_rows_match(rows, [python_top_n(row.tolist(), 4)
+                             for row in matrix.toarray()])
+
+
+def test_top_n_csr_empty_rows():
+    indptr = np.zeros(shape=4, dtype=np.int64)
+    topIndptr, ids, scores = top_n_csr(indptr,
+                                       np.zeros(shape=0, dtype=np.int32),
+                                       np.zeros(shape=0, dtype=np.float32), 5)
+    assert (topIndptr.tolist() == [0, 0, 0, 0])
+    assert (len(ids) == len(scores) == 0)
+
+
+def test_top_n_dense_matches_csr():
+    matrix = sparse_random(30, 30, density=0.2, format='csr',
+                           dtype=np.float32, random_state=2)
+    dense = csr_rows(*top_n_dense(matrix.toarray(), 5, blockRows=7))
+    sparse = csr_rows(*top_n_csr(matrix.indptr.astype(np.int64),
+                                 matrix.indices, matrix.data, 5))
+    assert_rows_match(dense, sparse)
+
+
+def graph_rows(graph):
+    """ Returns list of (id, score) lists of every row of graph """
+    return [list(zip(graph[tokenId][0].tolist(), graph[tokenId][1].tolist()))
+            for tokenId in range(len(graph))]
+
+
+def test_replace_rows_matches_python():
+    matrix = sparse_random(12, 12, density=0.3, format='csr',
+                           dtype=np.float32, random_state=3)
+    graph = NeighborGraph(*top_n_csr(matrix.indptr.astype(np.int64),
+                                     matrix.indices, matrix.data, 4))
+    expectedRows = graph_rows(graph)
+    tokenIds = [7, 0, 11]
+    newRows = [[(3, 0.5), (1, 0.25)], [], [(2, 1.0)]]
+    for tokenId, row in zip(tokenIds, newRows):
+        expectedRows[tokenId] = row
+    rowIndptr = np.cumsum([0] + [len(row) for row in newRows])
+    rowIndices = np.array([i for row in newRows for i, _ in row],
+                          dtype=np.int32)
+    rowScores = np.array([s for row in newRows for _, s in row],
+                         dtype=np.float32)
+    replaced = graph.replace_rows(tokenIds, rowIndptr, rowIndices, rowScores)
+    assert_rows_match(graph_rows(replaced), expectedRows)
+    # quantized graphs are requantized with scales of rescored rows
+    quantized = graph.quantize('uint8').replace_rows(tokenIds, rowIndptr,
+                                                     rowIndices, rowScores)
+    assert (quantized.encoding == 'uint8')
+    for row, expected in zip(graph_rows(quantized), expectedRows):
+        assert ([i for i, _ in row] == [i for i, _ in expected])
+        assert np.allclose([s for _, s in row], [s for _, s in expected],
+                           atol=(1 / 255))
+
+
+def toy_graph(seed=4):
+    """
+    Returns graph of top 6 edges of random rows plus a last row whose scores
+    span many orders of magnitude
+    """
+    matrix = sparse_random(50, 50, density=0.3, format='csr',
+                           dtype=np.float32, random_state=seed)
+    graph = NeighborGraph(*top_n_csr(matrix.indptr.astype(np.int64),
+                                     matrix.indices, matrix.data, 6))
+    tinyScores = np.array([0.6, 0.3, 0.0035, 0.001, 0.00001],
+                          dtype=np.float32)
+    return graph.replace_rows([49], np.array([0, 5]),
+                              np.array([3, 1, 4, 5, 9], dtype=np.int32),
+                              tinyScores / tinyScores.sum())
+
+
+def test_quantize_round_trip(tmp_path):
+    graph = toy_graph()
+    expectedRows = graph_rows(graph)
+    for encoding, atol in (('float32', 0), ('float16', 1e-3), ('uint8', None)):
+        quantized = graph.quantize(encoding)
+        assert (quantized.encoding == encoding)
+        assert (quantized.indices.dtype == np.uint16)
+        assert (quantized.nbytes < graph.nbytes)
+        rows = graph_rows(quantized)
+        for row, expected in zip(rows, expectedRows):
+            # uint8 scores, including those of pruned edges, are off by at
+            # most half a step of the row max
+            rowAtol = atol if (atol is not None) else \
+                      (max((s for _, s in expected), default=0) / 510)
+            found = dict(row)
+            assert (found.keys() <= dict(expected).keys())
+            for i, score in expected:
+                assert np.isclose(found.get(i, 0), score, rtol=0,
+                                  atol=(rowAtol + 1e-7))
+            if (atol is not None):
+                assert ([i for i, _ in row] == [i for i, _ in expected])
+        folder = tmp_path / encoding
+        folder.mkdir()
+        quantized.save(str(folder))
+        loaded = NeighborGraph.load(str(folder))
+        assert (loaded.encoding == encoding)
+        assert (graph_rows(loaded) == rows)
+    # edges under half a step of their row max round to code 0 and are pruned
+    assert (graph.quantize('uint8')[49][0].tolist() == [3, 1, 4])
+    assert (graph.quantize('float16')[49][0].tolist() == [3, 1, 4, 5, 9])
+
+
+def test_quantize_prunes_under_min_score():
+    graph = toy_graph()
+    minScore = 0.15
+    expectedRows = [[(i, s) for i, s in row if (s >= minScore)]
+                    for row in graph_rows(graph)]
+    for encoding in ('float32', 'uint8'):
+        rows = graph_rows(graph.quantize(encoding, minScore))
+        for row, expected in zip(rows, expectedRows):
+            assert ([i for i, _ in row] == [i for i, _ in expected])
@@ -0,0 +1,105 @@
+"""
+Tests PhraseAutomaton() matching and phrase-aware counts against the python
+chunk loops of the original knowledge scoring draft
+"""
+
+import numpy as np
+from collections import Counter
+
+from conftest import toy_tokenizer
+from structs.phraseAutomaton import PhraseAutomaton, greedy_matches
+
+PHRASES = ('w1 w2', 'w1 w2 w3', 'w2 w3 w4 w5', 'w3 w4', 'w4 w5',
+           'w2 w3 w4 w5 w6 w7')
+
+
+def python_greedy(starts, lengths, wordNum):
+    """ Returns locs of leftmost-longest non-overlapping occurences """
+    picked, position = [], 0
+    while (position < wordNum):
+        locs = [loc for loc in range(len(starts)) if starts[loc] == position]
+        if locs:
+            loc = max(locs, key=lambda loc : (lengths[loc], loc))
+            picked.append(loc)
+            position += lengths[loc]
+        else:
+            position += 1
+    return picked
+
+
+def draft_knowledge_counts(tokenizer, cleanText, maxChunkSize):
+    """
+    Counts greedy flashtext tokens of cleaned text plus tokens in chunks of
+    every multi-word greedy token as in the original draft, visiting only
+    whole chunks. The draft also visited the chunks truncated at the end of
+    each greedy token, crediting them again at every smaller chunk size.
+    """
+    greedyTokens = Counter(tokenizer.extract_keywords(cleanText))
+    subTokens = Counter()
+    for greedyToken, greedyCount in greedyTokens.items():
+        greedyWords = greedyToken.split()
+        wordNum = len(greedyWords)
+        if (wordNum > 1):
+            chunkSize = min(maxChunkSize, (wordNum - 1))
+            while (chunkSize > 0):
+                for i in range(wordNum - chunkSize + 1):
+                    textChunk = ' '.join(greedyWords[i : i + chunkSize])
+                    if textChunk in tokenizer.idx:
+                        subTokens[textChunk] += (greedyCount
+                                                 * (chunkSize / wordNum))
+                chunkSize -= 1
+    greedyTokens.update(subTokens)
+    return greedyTokens
+
+
+def test_scan_finds_every_occurence():
+    automaton = PhraseAutomaton({phrase : i for i, phrase
+                                 in enumerate(PHRASES)})
+    words = 'w0 w1 w2 w3 w4 w5 w6 w7 w1 w2 w3'.split()
+    starts, lengths, ids = automaton.scan(words)
+    found = sorted(zip(starts.tolist(), lengths.tolist(), ids.tolist()))
+    expected = sorted((start, len(phrase.split()), i)
+                      for i, phrase in enumerate(PHRASES)
+                      for start in range(len(words))
+                      if words[start:(start + len(phrase.split()))]
+                      == phrase.split())
+    assert (found == expected)
+
+
+def test_greedy_matches_python():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        wordNum = 30
+        starts = rng.integers(0, wordNum, size=20)
+        lengths = np.minimum(rng.integers(1, 6, size=20), (wordNum - starts))
+        # occurences are unique by (start, length) as automaton yields them
+        _, uniqueLocs = np.unique(starts * 10 + lengths, return_index=True)
+        starts, lengths = starts[uniqueLocs], lengths[uniqueLocs]
+        picked, coverStarts, coverLengths = greedy_matches(starts, lengths,
+                                                           wordNum)
+        expected = python_greedy(starts.tolist(), lengths.tolist(), wordNum)
+        assert (picked.tolist() == expected)
+        for loc in expected:
+            span = slice(starts[loc], (starts[loc] + lengths[loc]))
+            assert (coverStarts[span] == starts[loc]).all()
+            assert (coverLengths[span] == lengths[loc]).all()
+        assert ((coverLengths > 0).sum() == lengths[expected].sum())
+
+
+def test_knowledge_counts_match_draft(texts):
+    tokenizer = toy_tokenizer(texts, PHRASES, 'flashtext')
+    rng = np.random.default_rng(1)
+    queries = [' '.join(f'w{i}' for i in rng.integers(0, 9, size=40))
+               for _ in range(30)]
+    queries.append('w2 w3 w4 w5 w6 w7 w1 w2 w3 w4 w5 w1 w2')
+    for maxChunkSize in (1, 2, 5):
+        for query in queries:
+            cleanText, _ = tokenizer.normalize(query)
+            ids, counts = tokenizer.knowledge_counts(cleanText, maxChunkSize)
+            found = {tokenizer.reverseIdx[i] : count
+                     for i, count in zip(ids.tolist(), counts.tolist())}
+            expected = draft_knowledge_counts(tokenizer, cleanText,
+                                              maxChunkSize)
+            assert (found.keys() == expected.keys())
+            for token, count in expected.items():
+                assert np.isclose(found[token], count)
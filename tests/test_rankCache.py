@@ -0,0 +1,97 @@
+"""
+Tests RankCache() eviction and expiry with an injected clock, and that
+cached TokenGraph rankings follow changes of token scoring
+"""
+
+import numpy as np
+
+from conftest import toy_texts, toy_tokenizer
+from structs.rankCache import RankCache
+from structs.tokengraph import TokenGraph
+
+
+class FakeClock(object):
+    """ Clock returning seconds set by the test """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_evicts_least_recently_used():
+    cache = RankCache(maxSize=2, clock=FakeClock())
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert (cache.get('a') == 1)
+    cache.put('c', 3)
+    assert (cache.get('b') is None)
+    assert (cache.get('a') == 1) and (cache.get('c') == 3)
+    # storing an existing key refreshes its recency without evicting
+    cache.put('a', 4)
+    cache.put('d', 5)
+    assert (list(cache.entries) == ['a', 'd'])
+    assert (cache.get('a', 'default') == 4)
+    assert (cache.stats() == {'size'      :   2,
+                              'hits'      :   4,
+                              'misses'    :   1,
+                              'evictions' :   2,
+                              'hitRate'   :   0.8})
+
+
+def test_expires_after_ttl():
+    clock = FakeClock()
+    cache = RankCache(maxSize=10, ttl=5, clock=clock)
+    cache.put('a', 1)
+    clock.now = 3.0
+    cache.put('b', 2)
+    clock.now = 4.9
+    assert (cache.get('a') == 1)
+    clock.now = 5.0
+    assert (cache.get('a') is None)
+    assert (cache.get('b') == 2)
+    assert (len(cache) == 1) and (cache.evictions == 1)
+    # storing again restarts the entry's ttl
+    cache.put('b', 3)
+    clock.now = 9.9
+    assert (cache.get('b') == 3)
+    clock.now = 10.0
+    assert (cache.get('b') is None)
+    # entries never expire without ttl
+    cache = RankCache(maxSize=10, clock=clock)
+    cache.put('a', 1)
+    clock.now = 10.0 ** 9
+    assert (cache.get('a') == 1)
+
+
+def assert_rankings_equal(found, expected):
+    # texts served from the subgraph cache were ranked in another batch, so
+    # their sums may differ in the last bits
+    assert np.array_equal(found[0], expected[0])
+    assert np.array_equal(found[1], expected[1])
+    assert np.allclose(found[2], expected[2], rtol=1e-12, atol=0)
+
+
+def test_cached_rankings_follow_scoring(texts):
+    tokenizer = toy_tokenizer(texts, phrases=('w1 w2', 'w2 w3', 'w3 w4'))
+    graph = TokenGraph(tokenizer)
+    graph.build_corr_matrix_from_iterator(lambda : iter(texts), 5)
+    graph.set_expansion(maxObserved=4)
+    queries = texts[:10]
+    graph.enable_cache()
+    graph.DICT_graph_rank_texts(queries, 2, 0.001)
+    # nested tokens credited by knowledge scoring change observed tokens
+    tokenizer.set_knowledge(3)
+    cached = graph.DICT_graph_rank_texts(queries, 2, 0.001)
+    graph.disable_cache()
+    assert_rankings_equal(cached,
+                          graph.DICT_graph_rank_texts(queries, 2, 0.001))
+    # refreshed freqs change which observed tokens are kept
+    graph.enable_cache()
+    graph.DICT_graph_rank_texts(queries, 2, 0.001)
+    tokenizer.update_freq_stats(toy_texts(textNum=40, seed=5))
+    cached = graph.DICT_graph_rank_texts(queries, 2, 0.001)
+    assert (graph.textCache.misses == (2 * len(queries)))
+    graph.disable_cache()
+    assert_rankings_equal(cached,
+                          graph.DICT_graph_rank_texts(queries, 2, 0.001))
@@ -0,0 +1,74 @@
+"""
+Tests PageStore() packing and SearchTable() search against brute-force
+scoring of every page
+"""
+
+import numpy as np
+
+from conftest import toy_texts
+from structs.pageObj import PageStore
+from structs.searchTable import SearchTable
+
+
+def page_vectors(pageStore):
+    """ Returns list of dicts mapping token ids to scores of every page """
+    return [dict(zip(pageStore[pageId].tokenIds.tolist(),
+                     pageStore[pageId].scores.tolist()))
+            for pageId in range(len(pageStore))]
+
+
+def brute_force_scores(searchTable, text, iter, delta):
+    """ Scores every page by dot product with normed query vector """
+    offsets, queryIds, queryWeights = \
+            searchTable.tokenGraph.DICT_graph_rank_texts([text], iter, delta)
+    queryWeights = queryWeights / queryWeights.sum()
+    return [sum((weight * pageVector.get(tokenId, 0))
+                for tokenId, weight in zip(queryIds.tolist(),
+                                           queryWeights.tolist()))
+            for pageVector in page_vectors(searchTable.pageStore)]
+
+
+def assert_search_matches(searchTable, queries, k):
+    for query in queries:
+        found = searchTable.search(query, k=k, iter=2)
+        pageScores = brute_force_scores(searchTable, query, 2, 0.001)
+        expected = sorted((score for score in pageScores if score > 0),
+                          reverse=True)[:k]
+        assert np.allclose([score for _, score in found], expected,
+                           rtol=1e-5)
+        for pageId, score in found:
+            assert np.isclose(pageScores[pageId], score, rtol=1e-5)
+
+
+def test_page_store_reads_pending_and_packed_pages(tmp_path):
+    pageStore = PageStore()
+    pageStore.add_pages(['a', 'b'], [0, 2, 3], [4, 1, 7], [0.5, 0.5, 1.0])
+    pageStore.add_page('c', [2, 3], [0.25, 0.75])
+    expected = [{4 : 0.5, 1 : 0.5}, {7 : 1.0}, {2 : 0.25, 3 : 0.75}]
+    assert (page_vectors(pageStore) == expected)
+    pageStore.compact()
+    assert (page_vectors(pageStore) == expected)
+    assert ([pageStore[i].title for i in range(3)] == ['a', 'b', 'c'])
+    pageStore.save(str(tmp_path / 'pages'))
+    loaded = PageStore()
+    loaded.load(str(tmp_path / 'pages'))
+    assert (page_vectors(loaded) == expected)
+
+
+def test_search_matches_brute_force(graph, texts, tmp_path):
+    searchTable = SearchTable(graph)
+    searchTable.build_from_iterator(lambda : iter(texts), iter=2,
+                                    pageTokens=8, batchSize=16)
+    assert (searchTable.pageNum == len(texts))
+    queries = toy_texts(textNum=10, minLength=2, maxLength=6, seed=3)
+    for k in (1, 5, 100):
+        assert_search_matches(searchTable, queries, k)
+    for k in (0, -1):
+        assert (searchTable.search(queries[0], k=k) == [])
+    assert (searchTable.search('unknown words only') == [])
+    searchTable.save(str(tmp_path / 'search'))
+    loaded = SearchTable(graph)
+    loaded.load(str(tmp_path / 'search'))
+    for query in queries:
+        assert (loaded.search(query, iter=2) == searchTable.search(query,
+                                                                   iter=2))
@@ -0,0 +1,117 @@
+"""
+Tests request parsing, micro-batching and ranking of the server with a thread
+executor and in-memory streams
+"""
+
+import json
+import asyncio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+
+
+@pytest.fixture
+def workerGraph(graph, monkeypatch):
+    monkeypatch.setattr(server, 'WORKER_STATE', {'graph' : graph, 'iter' : 2,
+                                                 'delta' : 0.001})
+    return graph
+
+
+def test_parse_request():
+    assert (server.parse_request('{"text": "w1 w2", "n": 3}', 7)
+            == ('w1 w2', 3))
+    assert (server.parse_request(b'{"text": "w1"}\n', 7) == ('w1', 7))
+    for line in ('{"text": "w1", "n": 0}', '{"text": "w1", "n": -2}',
+                 '{"text": "w1", "n": 3.7}', '{"text": "w1", "n": 1e999}',
+                 '{"text": "w1", "n": true}', '{"text": "w1", "n": "3"}',
+                 '{"n": 3}', '["w1"]', 'not json', b'\xff\n'):
+        with pytest.raises(ValueError):
+            server.parse_request(line, 7)
+
+
+def test_rank_batch_matches_single_rankings(workerGraph, texts):
+    requests = [(text, n) for text, n in zip(texts[:8], [1, 3, 5, 100] * 2)]
+    requests.append(('unknown words only', 5))
+    results = server.rank_batch(requests)
+    reverseIdx = workerGraph.tokenizer.reverseIdx
+    for (text, n), result in zip(requests, results):
+        ranking = workerGraph.DICT_graph_rank_text(text, 2, 0.001)
+        expected = sorted(ranking.items(), key=lambda x : -x[1])[:n]
+        assert ([tokenId for tokenId, _, _ in result]
+                == [tokenId for tokenId, _ in expected])
+        assert all((word == reverseIdx[tokenId])
+                   for tokenId, word, _ in result)
+    assert (results[-1] == [])
+
+
+async def rank_concurrently(batcher, requests):
+    runner = asyncio.ensure_future(batcher.run())
+    try:
+        return await asyncio.gather(*(batcher.rank(text, n)
+                                      for text, n in requests))
+    finally:
+        runner.cancel()
+
+
+def test_batcher_coalesces_requests_in_order(workerGraph, texts):
+    requests = [(text, 4) for text in texts[:10]]
+    expected = server.rank_batch(requests)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        batcher = server.MicroBatcher(executor, maxBatch=4, maxWait=0.2,
+                                      maxInFlight=2)
+        results = asyncio.run(rank_concurrently(batcher, requests))
+    assert (results == expected)
+    # full batches go as soon as they fill, without waiting maxWait
+    assert (batcher.batchNum == 3) and (batcher.requestNum == 10)
+
+
+class MemoryWriter(object):
+    """ Stream writer collecting written bytes in memory """
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+async def serve_lines(batcher, lines):
+    reader = asyncio.StreamReader()
+    for line in lines:
+        reader.feed_data(line.encode('utf-8') + b'\n')
+    reader.feed_eof()
+    writer = MemoryWriter()
+    runner = asyncio.ensure_future(batcher.run())
+    try:
+        await server.handle_client(batcher, 3, reader, writer)
+    finally:
+        runner.cancel()
+    return writer
+
+
+def test_client_gets_answers_in_order(workerGraph, texts):
+    lines = [json.dumps({'text' : texts[0]}),
+             '{"text": "w1", "n": 1e999}',
+             '',
+             json.dumps({'text' : texts[1], 'n' : 2}),
+             '{"text": "w1", "n": 3.7}',
+             'not json',
+             json.dumps({'text' : texts[2], 'n' : 5})]
+    expected = server.rank_batch([(texts[0], 3), (texts[1], 2),
+                                  (texts[2], 5)])
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        batcher = server.MicroBatcher(executor, maxBatch=8, maxWait=0.01)
+        writer = asyncio.run(serve_lines(batcher, lines))
+    responses = [json.loads(line) for line in writer.data.splitlines()]
+    assert writer.closed
+    assert ([response.get('status') for response in responses]
+            == [None, 400, None, 400, 400, None])
+    assert ([response['tokens'] for response in responses
+             if 'tokens' in response] == expected)
@@ -0,0 +1,64 @@
+"""
+Tests StringTable() and the crc32 open-addressing StringIndex() against
+python lists and dicts
+"""
+
+import zlib
+import numpy as np
+import pytest
+
+from structs.stringTable import StringIndex, StringTable
+
+STRINGS = ['w0', 'w1 w2', '', 'café', 'naïve word', '東京', 'w10', 'w01']
+
+
+def assert_index_matches(index, strings):
+    assert (len(index) == len(strings))
+    assert (list(index) == strings)
+    for loc, string in enumerate(strings):
+        assert (index.locate(string) == loc)
+        assert (string in index)
+        assert (index[string] == loc)
+    for missing in ('w2', 'cafe', 'w1  w2', 'w0 ', None, 3):
+        assert (index.locate(missing) == -1)
+        assert (missing not in index)
+        assert (index.get(missing, 'default') == 'default')
+    with pytest.raises(KeyError):
+        index['missing']
+
+
+def test_string_table_round_trip(tmp_path):
+    table = StringTable.from_list(STRINGS)
+    assert (table.to_list() == STRINGS)
+    table.save(str(tmp_path), 'strings')
+    assert (StringTable.load(str(tmp_path), 'strings').to_list() == STRINGS)
+
+
+def test_index_matches_list(tmp_path):
+    strings = STRINGS + [f'w{i}' for i in range(11, 500)]
+    index = StringIndex.from_table(StringTable.from_list(strings))
+    assert ((index.slots >= 0).sum() == len(strings))
+    assert_index_matches(index, strings)
+    index.save(str(tmp_path), 'strings')
+    loaded = StringIndex.load(str(tmp_path), 'strings', index.table)
+    assert_index_matches(loaded, strings)
+
+
+def test_index_with_colliding_hashes(monkeypatch):
+    # every string hashes to one of the last three slots, so probe chains
+    # wrap around the table and run through strings of other hashes
+    realCrc = zlib.crc32
+    monkeypatch.setattr(zlib, 'crc32',
+                        lambda data, *args : (realCrc(data) % 3) - 3)
+    strings = STRINGS + [f'w{i}' for i in range(11, 200)]
+    index = StringIndex.from_table(StringTable.from_list(strings))
+    assert_index_matches(index, strings)
+
+
+def test_index_values():
+    freqs = np.arange(len(STRINGS), dtype=np.float64) / 2
+    table = StringTable.from_list(STRINGS)
+    index = StringIndex.from_table(table, freqs)
+    assert (dict(index.items()) == dict(zip(STRINGS, freqs.tolist())))
+    assert (index['café'] == freqs[3])
+    assert (index.get('missing') is None)
@@ -0,0 +1,249 @@
+"""
+Tests TokenGraph() candidate expansion and ranking on toy corpora
+"""
+
+import os
+import numpy as np
+from collections import defaultdict
+
+import utils
+from conftest import toy_texts
+from structs.stringTable import StringIndex
+from structs.tokengraph import (FORMAT_VERSION, ZERO_BOOSTER, TokenGraph,
+                               budget_keys)
+
+
+def python_budget_keys(keys, priorities, vocabSize, budget):
+    """
+    Keeps per text the budget keys of highest max priority, with ties going
+    to lower keys, plus all keys of infinite priority
+    """
+    maxPriorities = defaultdict(lambda : -np.inf)
+    for key, priority in zip(keys.tolist(), priorities.tolist()):
+        maxPriorities[key] = max(maxPriorities[key], priority)
+    textKeys = defaultdict(list)
+    for key in sorted(maxPriorities):
+        textKeys[key // vocabSize].append(key)
+    kept = []
+    for sameTextKeys in textKeys.values():
+        ranked = sorted(sameTextKeys, key=lambda key : -maxPriorities[key])
+        kept.extend(key for rank, key in enumerate(ranked)
+                    if (rank < budget) or np.isinf(maxPriorities[key]))
+    return sorted(kept)
+
+
+def test_budget_keys_matches_python():
+    rng = np.random.default_rng(0)
+    vocabSize = 20
+    keys = rng.integers(0, (5 * vocabSize), size=200)
+    priorities = rng.random(200)
+    priorities[rng.random(200) < 0.1] = np.inf
+    for budget in (1, 3, 8):
+        assert (budget_keys(keys, priorities, vocabSize, budget).tolist()
+                == python_budget_keys(keys, priorities, vocabSize, budget))
+    assert (budget_keys(keys, priorities, vocabSize).tolist()
+            == sorted(set(keys.tolist())))
+
+
+def candidate_sizes(graph, texts):
+    """ Returns candidate set size of every text """
+    offsets = graph.candidate_subgraphs(graph.observed_token_lists(texts),
+                                        0.001)[0]
+    return np.diff(offsets)
+
+
+def test_candidates_bounded_regardless_of_length(graph):
+    longTexts = toy_texts(textNum=5, minLength=400, maxLength=600, seed=2)
+    for hops in (1, 2):
+        graph.set_expansion(maxCandidates=6, hops=hops)
+        assert (candidate_sizes(graph, longTexts).max() <= 6)
+        graph.set_expansion(maxCandidates=6, hops=hops, maxObserved=9)
+        assert (candidate_sizes(graph, longTexts).max() <= 9)
+    graph.set_expansion()
+    assert (candidate_sizes(graph, longTexts).max() > 9)
+
+
+def test_top_observed_keeps_highest_scores(graph):
+    tokenScores = {5 : 0.1, 2 : 0.9, 7 : 0.5, 1 : 0.7}
+    graph.set_expansion(maxCandidates=2)
+    assert (graph.top_observed(tokenScores) == [2, 1])
+    graph.set_expansion(maxCandidates=2, maxObserved=3)
+    assert (graph.top_observed(tokenScores) == [2, 7, 1])
+    graph.set_expansion()
+    assert (graph.top_observed(tokenScores) == [5, 2, 7, 1])
+
+
+def test_quantize_clears_page_rank(graph, tmp_path):
+    graph.build_page_rank()
+    graph.quantize('uint8', minScore=0.01)
+    assert (graph.pageRank is None)
+    assert (graph.corrGraph.encoding == 'uint8')
+    graph.save(str(tmp_path / 'graph'))
+    assert not (tmp_path / 'graph' / 'pageRank.npy').exists()
+
+
+def assert_rankings_match(graph, loaded, texts):
+    expected = graph.DICT_graph_rank_texts(texts, 2, 0.001)
+    found = loaded.DICT_graph_rank_texts(texts, 2, 0.001)
+    assert (found[0].tolist() == expected[0].tolist())
+    assert (found[1].tolist() == expected[1].tolist())
+    assert np.allclose(found[2], expected[2], rtol=1e-6)
+    for text in texts[:5]:
+        assert (loaded.personal_rank_text(text)[0]
+                == graph.personal_rank_text(text)[0])
+
+
+def test_save_load_round_trip(graph, texts, tmp_path):
+    path = str(tmp_path / 'graph')
+    graph.build_page_rank()
+    graph.save(path)
+    assert (utils.load_json(f'{path}/meta')['version'] == FORMAT_VERSION)
+    loaded = TokenGraph()
+    loaded.load(path)
+    # arrays are memory-mapped and vocab is looked up through hash slots
+    assert isinstance(loaded.corrGraph.indices, np.memmap)
+    assert isinstance(loaded.tokenizer.idx, StringIndex)
+    assert (list(loaded.tokenizer.idx) == list(graph.tokenizer.idx))
+    assert np.array_equal(loaded.pageRank, graph.pageRank)
+    assert_rankings_match(graph, loaded, texts)
+
+
+def test_load_legacy_pickles(graph, texts, tmp_path):
+    # folder as written by the original pickling save
+    path = str(tmp_path / 'graph')
+    os.makedirs(f'{path}/tokenizer')
+    corrDict = {tokenId : [(score, relId) for relId, score
+                           in zip(*graph.corrGraph[tokenId])]
+                for tokenId in range(len(graph.corrGraph))}
+    utils.save_obj(corrDict, f'{path}/corrDict.sav')
+    tokenizer = graph.tokenizer
+    utils.save_obj(dict(tokenizer.freqDict), f'{path}/tokenizer/freqDict')
+    utils.save_obj(dict(tokenizer.idx), f'{path}/tokenizer/idx')
+    utils.save_obj(tokenizer.tokenizer, f'{path}/tokenizer/tokenizer')
+    with open(f'{path}/tokenizer/lower.sav', 'w+') as lowerFile:
+        lowerFile.write('t')
+    loaded = TokenGraph()
+    loaded.load(path)
+    assert np.array_equal(loaded.corrGraph.indptr, graph.corrGraph.indptr)
+    assert_rankings_match(graph, loaded, texts)
+
+
+def dense_rank_text(graph, text, iter, delta):
+    """
+    Ranks text as the original DICT_graph_rank_text did, over a dense
+    miniCorr of observed and related tokens raised to the power iter
+    """
+    tokenFreqs = graph.tokenizer.single_mechanically_score_tokens(text)
+    relatedTokens = {token : graph.corrGraph[token] for token in tokenFreqs}
+    candidateSet = set(relatedTokens)
+    for relatedIds, _ in relatedTokens.values():
+        candidateSet.update(relatedIds.tolist())
+    candidateTokens = {oldId : newId for newId, oldId
+                       in enumerate(candidateSet)}
+    candidateNum = len(candidateTokens)
+    miniCorr = np.zeros(shape=(candidateNum, candidateNum)) + ZERO_BOOSTER
+    for baseToken, (relatedIds, relatedScores) in relatedTokens.items():
+        baseId = candidateTokens[baseToken]
+        for relatedToken, relatedScore in zip(relatedIds.tolist(),
+                                              relatedScores.tolist()):
+            relatedId = candidateTokens[relatedToken]
+            miniCorr[baseId, relatedId] += relatedScore
+            miniCorr[relatedId, baseId] += relatedScore
+    iterCorr = np.linalg.matrix_power(miniCorr, n=iter)
+    rawWeights = np.tile([delta], reps=candidateNum)
+    for token in tokenFreqs:
+        rawWeights[candidateTokens[token]] += 1
+    normedWeights = np.divide(rawWeights, (sum(rawWeights) + ZERO_BOOSTER))
+    convergedWeights = np.dot(iterCorr, normedWeights)
+    return {oldId : convergedWeights[newId]
+            for oldId, newId in candidateTokens.items()}
+
+
+def test_batched_ranking_matches_dense(graph, texts):
+    # texts without known tokens rank no candidates
+    batch = texts[:20] + ['', 'unknown words only'] + texts[20:30]
+    for iter in (1, 2, 3):
+        offsets, ids, scores = graph.DICT_graph_rank_texts(batch, iter, 0.001)
+        assert (len(offsets) == (len(batch) + 1))
+        for i, text in enumerate(batch):
+            found = dict(zip(ids[offsets[i]:offsets[i + 1]].tolist(),
+                             scores[offsets[i]:offsets[i + 1]].tolist()))
+            expected = dense_rank_text(graph, text, iter, 0.001)
+            assert (found.keys() == expected.keys())
+            for token, score in expected.items():
+                assert np.isclose(found[token], score, rtol=1e-6, atol=0)
+    # cached batches match uncached ones, on misses and on hits
+    expected = graph.DICT_graph_rank_texts(batch, 2, 0.001)
+    graph.enable_cache()
+    for _ in range(2):
+        found = graph.DICT_graph_rank_texts(batch, 2, 0.001)
+        for foundPart, expectedPart in zip(found, expected):
+            assert np.array_equal(foundPart, expectedPart)
+    for cacheSize in (None, 100):
+        if cacheSize is None:
+            graph.disable_cache()
+        else:
+            graph.enable_cache(cacheSize)
+        offsets, ids, scores = graph.DICT_graph_rank_texts([], 2, 0.001)
+        assert (offsets.tolist() == [0])
+        assert (len(ids) == len(scores) == 0)
+
+
+def dense_pagerank(graph, seed, alpha, maxIter=1000, minDelta=1e-13):
+    """
+    Runs personalized PageRank by dense power iteration over the row-normed
+    transition matrix of corr graph, restarting dangling mass at seed
+    """
+    tokenNum = len(graph.corrGraph)
+    transitions = np.zeros(shape=(tokenNum, tokenNum))
+    for tokenId in range(tokenNum):
+        relatedIds, relatedScores = graph.corrGraph[tokenId]
+        if (relatedScores.sum() > 0):
+            transitions[tokenId, relatedIds] = (relatedScores
+                                                / relatedScores.sum())
+    ranks = seed.copy()
+    for _ in range(maxIter):
+        pushed = transitions.T @ ranks
+        stepped = (alpha * pushed) + ((1 - alpha * pushed.sum()) * seed)
+        if (np.abs(stepped - ranks).sum() < minDelta):
+            return stepped
+        ranks = stepped
+    return ranks
+
+
+def test_personal_rank_matches_dense(graph, texts):
+    # walks normalize float32 edge scores, so ranks agree to float32 precision
+    tokenNum = len(graph.corrGraph)
+    for text in texts[:10]:
+        tokenScores = graph.tokenizer.single_mechanically_score_tokens(text)
+        seed = np.zeros(shape=tokenNum)
+        seed[list(tokenScores)] = list(tokenScores.values())
+        seed /= seed.sum()
+        expected = dense_pagerank(graph, seed, 0.85)
+        ranks, _ = graph.personal_rank_vector(tokenScores, maxIter=500,
+                                              minDelta=1e-12)
+        assert np.allclose(ranks, expected, rtol=0, atol=1e-7)
+    # global ranks are personalized ranks of a uniform seed
+    graph.build_page_rank(minDelta=1e-12)
+    uniform = np.full(shape=tokenNum, fill_value=(1 / tokenNum))
+    assert np.allclose(graph.pageRank, dense_pagerank(graph, uniform, 0.85),
+                       rtol=0, atol=1e-7)
+    # warm starts from global ranks converge to the same ranks
+    for text in texts[:10]:
+        tokenScores = graph.tokenizer.single_mechanically_score_tokens(text)
+        coldRanks, _ = graph.personal_rank_vector(
+                                tokenScores, maxIter=500, minDelta=1e-12,
+                                init=np.full(shape=tokenNum,
+                                             fill_value=(1 / tokenNum)))
+        warmRanks, _ = graph.personal_rank_vector(tokenScores, maxIter=500,
+                                                  minDelta=1e-12)
+        assert np.allclose(warmRanks, coldRanks, rtol=0, atol=1e-7)
+    assert (graph.personal_rank_vector({})[0] == 0).all()
+
+
+def test_rank_text_without_tokens_requested(graph, texts):
+    # loaded graphs have no dense corrMatrix and rank with PageRank
+    assert (graph.corrMatrix is None)
+    assert (graph.graph_rank_text(texts[0], n=0) == [])
+    assert (graph.personal_rank_text(texts[0], n=-1)[0] == [])
+    assert (len(graph.graph_rank_text(texts[0], n=3)) == 3)
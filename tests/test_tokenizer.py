@@ -0,0 +1,97 @@
+"""
+Tests Tokenizer() scoring and freq stats on toy corpora
+"""
+
+import re
+import numpy as np
+from unidecode import unidecode
+from collections import Counter
+
+from conftest import toy_texts, toy_tokenizer
+from structs.tokenizer import Tokenizer
+
+
+def python_freqs(texts, vocab):
+    """ Returns freqs of vocab tokens counted over texts in plain python """
+    tokenCounts, tokenAppearances = Counter(), Counter()
+    for text in texts:
+        words = text.split()
+        tokenCounts.update(words)
+        tokenAppearances.update(set(words))
+    totalLength = sum(tokenCounts.values())
+    return [1 + np.log((tokenCounts[token] / totalLength)
+                       * np.log(len(texts) / tokenAppearances[token]))
+            for token in vocab]
+
+
+def test_update_freq_stats_matches_full_count(tokenizer, texts):
+    newTexts = toy_texts(textNum=30, seed=1)
+    tokenizer.update_freq_stats(newTexts)
+    vocab = tokenizer.vocab_list()
+    assert np.allclose(tokenizer.freqs, python_freqs((texts + newTexts),
+                                                     vocab))
+    assert np.allclose([tokenizer.freqDict[token] for token in vocab],
+                       tokenizer.freqs)
+
+
+def test_refresh_freq_dict_keeps_uncounted_freqs(tokenizer):
+    oldFreqs = np.array(tokenizer.freqs)
+    tokenizer.termCounts[0] = 0
+    tokenizer.docCounts[1] = 0
+    tokenizer.refresh_freq_dict()
+    assert np.isfinite(tokenizer.freqs).all()
+    assert (tokenizer.freqs[:2].tolist() == oldFreqs[:2].tolist())
+
+
+PHRASES = ('w3 w4', 'w5 w6 w7', 'w6 w7')
+
+
+def test_unigram_backend_matches_flashtext(texts, tmp_path):
+    queries = texts[:20] + ['W3 w4 w5 W6 w7 w6 w7.', 'w5, w6 w7 w3 w4 w4']
+    for lower in (True, False):
+        unigram = toy_tokenizer(texts, PHRASES, 'unigram', lower)
+        flashtext = toy_tokenizer(texts, PHRASES, 'flashtext', lower)
+        for query in queries:
+            assert (unigram.clean_and_count(query)
+                    == flashtext.clean_and_count(query))
+            assert (unigram.single_mechanically_score_tokens(query)
+                    == flashtext.single_mechanically_score_tokens(query))
+        # loaded tokenizers build their lookups on first use
+        unigram.save(str(tmp_path / f'lower{lower}'))
+        loaded = Tokenizer()
+        loaded.load(str(tmp_path / f'lower{lower}'))
+        assert (loaded.wordIdx is None)
+        for query in queries:
+            assert (loaded.single_mechanically_score_tokens(query)
+                    == flashtext.single_mechanically_score_tokens(query))
+
+
+STRIP = re.compile(r'[^0-9a-zA-Z\t\n\s_.?!:;/<>*&^%$#@()"~`+-]')
+SPACE = re.compile(r'[\t\n\s_.?!:;/<>*&^%$#@()"~`+-]+')
+
+
+def regex_clean(rawString, lower):
+    """
+    Cleans rawString with the original STRIP and SPACE regexes, applied to
+    its transliteration as the original clean meant to
+    """
+    cleanedString = re.sub(STRIP, '', unidecode(rawString))
+    spacedString = re.sub(SPACE, ' ', cleanedString).strip()
+    return spacedString.lower() if lower else spacedString
+
+
+def test_normalize_matches_regexes():
+    rng = np.random.default_rng(0)
+    alphabet = ([chr(code) for code in range(128)]
+                + list('éßÆñ東京ü\u00a0\u2003\u2028—’“”…€😀'))
+    rawStrings = [f'Ab{chr(code)}Cd {chr(code)}{chr(code)} e'
+                  for code in range(128)]
+    rawStrings += [''.join(rng.choice(alphabet, size=rng.integers(0, 40)))
+                   for _ in range(500)]
+    rawStrings += ['  Café crème,\tnaïve  — “quoted”\n\nword_s ', '\x1c\x1f']
+    for lower in (True, False):
+        tokenizer = Tokenizer(lower=lower)
+        for rawString in rawStrings:
+            expected = regex_clean(rawString, lower)
+            assert (tokenizer.normalize(rawString)
+                    == (expected, len(expected.split())))
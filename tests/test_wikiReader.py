@@ -0,0 +1,64 @@
+"""
+Tests WikiReader() parsing and sharding against python csv parsing
+"""
+
+import csv
+import io
+
+from structs.wikiReader import WikiReader
+
+RECORDS = ['0,"\'plain text of an article\'"\n',
+           '1,"\'text with ""quoted"" words, and commas\'"\n',
+           '2,"\'text spanning\nseveral\nlines\'"\n',
+           '3,"\'\'"\n',
+           '4,"\'café naïve über\'"\n',
+           '5,"\'last record\'"\n']
+
+
+def python_texts(content):
+    """ Returns texts of wiki csv content parsed by csv module """
+    return [row[1][1:-1] for row in csv.reader(io.StringIO(content))
+            if (len(row) > 1)]
+
+
+def write_csv(path, records, lineEnd='\n'):
+    with open(path, 'wb') as wikiFile:
+        wikiFile.write(''.join(records).replace('\n', lineEnd
+                                                ).encode('utf-8'))
+    return str(path)
+
+
+def test_iter_texts_matches_csv(tmp_path):
+    expected = python_texts(''.join(RECORDS))
+    assert (expected[0] == 'plain text of an article')
+    reader = WikiReader(write_csv(tmp_path / 'lf.csv', RECORDS))
+    assert (list(reader.iter_texts()) == expected)
+    assert ([row for _, row in reader.read_records()]
+            == list(csv.reader(io.StringIO(''.join(RECORDS)))))
+
+
+def test_single_line_records_match_old_slice(tmp_path):
+    records = [RECORDS[0], RECORDS[4], RECORDS[5]]
+    reader = WikiReader(write_csv(tmp_path / 'plain.csv', records))
+    assert (list(reader.iter_texts())
+            == [line[(line.find(',') + 3):-3] for line in records])
+
+
+def test_crlf_reads_as_text_mode(tmp_path):
+    lfReader = WikiReader(write_csv(tmp_path / 'lf.csv', RECORDS))
+    crlfReader = WikiReader(write_csv(tmp_path / 'crlf.csv', RECORDS, '\r\n'))
+    assert (list(crlfReader.iter_texts()) == list(lfReader.iter_texts()))
+
+
+def test_shards_cover_every_record_once(tmp_path):
+    reader = WikiReader(write_csv(tmp_path / 'lf.csv', RECORDS * 5))
+    expected = list(reader.iter_texts())
+    # sharding indexes record starts, so shards split no multi-line record
+    for shardNum in (1, 3, 7):
+        shards = reader.shard(shardNum)
+        assert ([text for start, end in shards
+                 for text in reader.iter_texts(start, end)] == expected)
+    assert (len(reader) == len(expected))
+    batches = list(reader.iter_batches(4))
+    assert ([len(batch) for batch in batches[:-1]] == [4] * (len(batches) - 1))
+    assert ([text for batch in batches for text in batch] == expected)
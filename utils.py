@@ -1,7 +1,13 @@
 import os
+import json
 import pickle
 
 
+class SaverError(Exception):
+    """ Raised when an object cannot be safely saved """
+    pass
+
+
 def save_obj(obj, name):
     """ Pickles objectt to file under name """
     with open(f'{name}.sav', 'wb+') as attributeFile:
@@ -15,6 +21,19 @@ def load_obj(name):
         obj = pickle.load(loadFile)
     return obj
 
+def save_json(obj, name):
+    """ Writes json-serializable object to file under name """
+    with open(f'{name}.json', 'w+') as jsonFile:
+        json.dump(obj, jsonFile)
+    return True
+
+
+def load_json(name):
+    """ Loads json object from file under name """
+    with open(f'{name}.json', 'r') as jsonFile:
+        obj = json.load(jsonFile)
+    return obj
+
 def path_exists(path):
     """ Asserts path existance """
     assert os.path.exists(path), f'Folder {path} cannot be found.'
@@ -25,7 +44,7 @@ def delete_folder(folderPath):
         for file in os.listdir(folderPath):
             try:
                 os.remove(f'{folderPath}/{file}')
-            except PermissionError:
+            except (PermissionError, IsADirectoryError):
                 delete_folder(f'{folderPath}/{file}')
         os.rmdir(folderPath)
         return True
@@ -53,3 +72,37 @@ def safe_make_folder(folderPath):
             safe_make_folder(folderPath)
     else:
         os.mkdir(folderPath)
+
+
+def make_folder(folderPath, overwrite=False):
+    """
+    Makes folder without prompting. Deletes existing folder first if overwrite,
+    otherwise raises SaverError if it already exists.
+    """
+    if os.path.exists(folderPath):
+        if not overwrite:
+            raise SaverError(f'{folderPath} already exists. Pass '\
+                             'overwrite=True to replace it.')
+        delete_folder(folderPath)
+    os.makedirs(folderPath)
+    return True
+
+
+def next_version_path(root):
+    """
+    Returns path of next numbered version folder under root, making root if
+    needed. Versions are zero-padded so they sort lexically.
+    """
+    if not os.path.exists(root):
+        os.makedirs(root)
+    versions = [int(name) for name in os.listdir(root) if name.isdigit()]
+    nextVersion = (max(versions) + 1) if versions else 0
+    return f'{root}/{nextVersion:05d}'
+
+
+def latest_version_path(root):
+    """ Returns path of highest numbered version folder under root """
+    path_exists(root)
+    versions = [name for name in os.listdir(root) if name.isdigit()]
+    assert versions, f'No versions found in {root}.'
+    return f'{root}/{max(versions, key=int)}'